@@ -0,0 +1,96 @@
+"""
+Benchmarks the token-aware chunker (`src.data_manager.chunking`) against langchain's `RecursiveCharacterTextSplitter`.
+
+The splitters chunk the same pages to roughly the same size and the script reports the wall time and the distribution
+of chunk sizes in tokens:
+    - `RecursiveCharacterTextSplitter` sized in characters (`chunk_size` * the average number of characters per token)
+    - `RecursiveCharacterTextSplitter` sized in tokens (its `length_function` counts tokens, re-scanning every split)
+    - `split_text_by_tokens` (one tokenization per page and a single separator scan per chunk)
+
+Usage:
+    python -m examples.benchmark_chunking --file path/to/document.pdf --chunk-size 250 --chunk-overlap 25
+    python -m examples.benchmark_chunking --synthetic-pages 200
+"""
+
+import io
+import time
+import random
+import argparse
+import statistics
+
+# LANGCHAIN
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.config.settings import CHUNK_TOKENIZER
+from src.data_manager.chunking import count_tokens, split_text_by_tokens
+from src.data_manager.data_loader import parse_document
+
+
+def make_synthetic_pages(n_pages, words_per_page=800, seed=0):
+    """ Generates pages of random sentences and paragraphs """
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(2000)] + ["the", "a", "of", "and", "to", "in", "AB-1234", "4.2.1"]
+    pages = []
+    for _ in range(n_pages):
+        sentences = [
+            " ".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 30))).capitalize() + "."
+            for _ in range(words_per_page // 17)
+        ]
+        paragraphs = [" ".join(sentences[i:i + rng.randint(3, 8)]) for i in range(0, len(sentences), 5)]
+        pages.append("\n\n".join(paragraphs))
+    return pages
+
+
+def summarize(name, chunks, seconds, tokenizer):
+    n_tokens = [count_tokens(chunk, tokenizer) for chunk in chunks]
+    print(
+        f"{name:<58} {seconds * 1000:9.1f} ms  {len(chunks):6d} chunks  "
+        f"tokens/chunk: mean={statistics.mean(n_tokens):7.1f}  stdev={statistics.pstdev(n_tokens):6.1f}  "
+        f"min={min(n_tokens):5d}  max={max(n_tokens):5d}"
+    )
+
+
+def run_benchmark(pages, chunk_size=250, chunk_overlap=0, tokenizer=CHUNK_TOKENIZER, repeats=3):
+    n_chars, n_tokens = sum(map(len, pages)), sum(count_tokens(page, tokenizer) for page in pages)
+    chars_per_token = n_chars / max(n_tokens, 1)
+    print(f"{len(pages)} pages, {n_chars} characters, {n_tokens} tokens ({chars_per_token:.2f} characters/token)")
+
+    char_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=int(chunk_size * chars_per_token), chunk_overlap=int(chunk_overlap * chars_per_token)
+    )
+    token_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=lambda text: count_tokens(text, tokenizer)
+    )
+    splitters = {
+        f"RecursiveCharacterTextSplitter ({char_splitter._chunk_size} chars)": char_splitter.split_text,
+        f"RecursiveCharacterTextSplitter ({chunk_size} tokens)": token_splitter.split_text,
+        f"split_text_by_tokens ({chunk_size} tokens)": lambda page: split_text_by_tokens(
+            page, chunk_size, chunk_overlap, tokenizer=tokenizer
+        ),
+    }
+    for name, split_text in splitters.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            chunks = [chunk for page in pages for chunk in split_text(page)]
+            timings.append(time.perf_counter() - start)
+        summarize(name, chunks, min(timings), tokenizer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="A pdf, docx or txt file to chunk (defaults to synthetic pages)")
+    parser.add_argument("--synthetic-pages", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=250, help="The chunk size in tokens")
+    parser.add_argument("--chunk-overlap", type=int, default=0, help="The chunk overlap in tokens")
+    parser.add_argument("--tokenizer", default=CHUNK_TOKENIZER)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            document = parse_document(io.BytesIO(f.read()), args.file)
+        document_pages = [document] if isinstance(document, str) else list(document)
+    else:
+        document_pages = make_synthetic_pages(args.synthetic_pages)
+    run_benchmark(document_pages, args.chunk_size, args.chunk_overlap, args.tokenizer, args.repeats)
@@ -1,4 +1,4 @@
-import os, sys
+import os, sys, json
 from dotenv import load_dotenv, find_dotenv
 
 # Load environment variables from a .env file
@@ -47,3 +47,108 @@ INFRASTRUCTURE_KEYS = {
     }
 }
 #########################
+
+# Data Manager Configurations
+EMBEDDING_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "boilerllm", "embeddings")
+)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 1024 ** 3))  # 1GB
+
+# Embedding pipeline (batching, concurrency and rate limits for the embedding API)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", 8))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", 3000))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 1000000))
+
+# PDF parsing (documents with at least this many pages are extracted in a process pool, 0 disables it)
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", 64))
+PDF_PARALLEL_MAX_WORKERS = int(os.getenv("PDF_PARALLEL_MAX_WORKERS", 0)) or None  # None -> os.cpu_count()
+
+# Persisted vectorstores (one sub-directory per document fingerprint)
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "boilerllm", "indexes"))
+# The number of persisted indexes each process keeps loaded (the least recently used ones are dropped)
+INDEX_CACHE_MAX_INDEXES = int(os.getenv("INDEX_CACHE_MAX_INDEXES", 16))
+
+# Approximate nearest neighbour indexes (see `src.data_manager.index_factory`)
+ANN_MEMORY_BUDGET_BYTES = int(os.getenv("ANN_MEMORY_BUDGET_BYTES", 4 * 1024 ** 3))  # 4GB
+ANN_FLAT_MAX_VECTORS = int(os.getenv("ANN_FLAT_MAX_VECTORS", 50000))
+ANN_TRAIN_SAMPLE_SIZE = int(os.getenv("ANN_TRAIN_SAMPLE_SIZE", 100000))
+# Default search knobs stored on the indexes: IVF lists visited (0 -> sqrt(nlist)) and the HNSW candidate list size
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 0))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", 64))
+
+# Semantic answer cache (paraphrased repeats of a question on the same document reuse the first answer)
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 24 * 60 * 60))  # 0 -> never expire
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10000))
+
+# Cache of the app's event-loop stages (parse, retrieve, query). The 'sqlite' backend is shared by every process on
+# the host that uses the same directory, 'memory' is per process and 'none' disables it
+STAGE_CACHE_BACKEND = os.getenv("STAGE_CACHE_BACKEND", "sqlite")
+STAGE_CACHE_DIR = os.getenv("STAGE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "boilerllm", "stages"))
+STAGE_CACHE_MAX_BYTES = int(os.getenv("STAGE_CACHE_MAX_BYTES", 512 * 1024 ** 2))  # 512MB
+
+# Chunking (chunk sizes are counted in tokens of this tiktoken encoding, '' -> characters with the langchain splitter)
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "cl100k_base")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 250))  # ~1000 characters of English text
+
+# Context packing (retrieved sources are packed into the model's context window minus the prompt and answer tokens)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo": 4096,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "text-davinci-003": 4097,
+}
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", 4096))
+CONTEXT_ANSWER_TOKENS = int(os.getenv("CONTEXT_ANSWER_TOKENS", 512))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+
+# QA chains (the maximum number of concurrent per-chunk LLM calls of the 'map_reduce' and 'map_rerank' chains)
+QA_MAP_MAX_CONCURRENCY = int(os.getenv("QA_MAP_MAX_CONCURRENCY", 8))
+
+# The maximum number of in-flight LLM calls per process (shared by the sync and async query paths)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+
+# OpenAI clients (see `src.model_manager.client_registry`), the connection pool is shared by every client of the process
+OPENAI_HTTP_POOL_SIZE = int(os.getenv("OPENAI_HTTP_POOL_SIZE", LLM_MAX_CONCURRENCY))
+OPENAI_MAX_CLIENTS = int(os.getenv("OPENAI_MAX_CLIENTS", 32))
+
+# HTTP server (see `src.server.app`, backends can be 'fake' to run without OpenAI)
+SERVER_LLM_BACKEND = os.getenv("SERVER_LLM_BACKEND", "openai")
+SERVER_EMBEDDING_BACKEND = os.getenv("SERVER_EMBEDDING_BACKEND", "openai")
+SERVER_MAX_INDEXES = int(os.getenv("SERVER_MAX_INDEXES", 32))
+
+# Micro-batching of self-hosted model queries (see `src.runhouse_ops.batching`), a batch is dispatched once it holds
+# BATCH_MAX_SIZE queries or BATCH_MAX_WAIT_MS after its first query arrived
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 10))
+
+# Local Hugging Face models (see `src.model_manager.hf_backend`, the default is a tiny model that runs on CPU in tests)
+HF_MODEL_NAME = os.getenv("HF_MODEL_NAME", "sshleifer/tiny-gpt2")
+HF_DEVICE = os.getenv("HF_DEVICE", "cpu")
+HF_MAX_NEW_TOKENS = int(os.getenv("HF_MAX_NEW_TOKENS", 256))
+HF_MAX_LOADED_MODELS = int(os.getenv("HF_MAX_LOADED_MODELS", 2))
+
+# Token streaming (see `src.model_manager.streaming`), buffered tokens are flushed to the display at most
+# STREAM_MAX_FPS times per second or whenever STREAM_FLUSH_TOKENS tokens are buffered
+STREAM_MAX_FPS = float(os.getenv("STREAM_MAX_FPS", 12))
+STREAM_FLUSH_TOKENS = int(os.getenv("STREAM_FLUSH_TOKENS", 32))
+
+# Where uploads are parsed and embedded (see `src.runhouse_ops.remote_ingest`): 'off' (in the app process),
+# 'runhouse' (on the Runhouse cluster) or 'local' (in a local worker process standing in for the cluster)
+REMOTE_INGEST = os.getenv("REMOTE_INGEST", "off")
+
+# Runhouse cluster pool (see `src.runhouse_ops.cluster_pool`), RH_CLUSTER_SPECS is a JSON list of `rh.cluster` kwargs
+# (defaults to the paperspace box of `instance_handler.get_paperspace_kwargs`)
+RH_CLUSTER_SPECS = json.loads(os.getenv("RH_CLUSTER_SPECS", "[]"))
+RH_HEALTH_CHECK_INTERVAL = float(os.getenv("RH_HEALTH_CHECK_INTERVAL", 30))
+RH_MAX_RETRIES = int(os.getenv("RH_MAX_RETRIES", 3))
+RH_MAX_FAILURES = int(os.getenv("RH_MAX_FAILURES", 2))
+RH_INITIAL_BACKOFF = float(os.getenv("RH_INITIAL_BACKOFF", 0.5))
+RH_MAX_BACKOFF = float(os.getenv("RH_MAX_BACKOFF", 8))
+
+# Monitoring (see `src.monitoring.metrics`): finished stage spans are appended as JSON lines to MONITORING_TRACE_PATH
+# (disabled if empty) and the last MONITORING_MAX_SPANS are kept in memory
+MONITORING_TRACE_PATH = os.getenv("MONITORING_TRACE_PATH", "")
+MONITORING_MAX_SPANS = int(os.getenv("MONITORING_MAX_SPANS", 1000))
@@ -0,0 +1,127 @@
+import re
+import warnings
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+# Fallback tokenizer: words, numbers and single punctuation characters (roughly one BPE token each for English text)
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# A tokenizer maps a text to the character offsets at which each of its tokens starts
+Tokenizer = Callable[[str], List[int]]
+
+
+def _approx_token_offsets(text: str) -> List[int]:
+    return [match.start() for match in _APPROX_TOKEN_RE.finditer(text)]
+
+
+@lru_cache(maxsize=None)
+def _load_tokenizer(name: str) -> Tuple[str, Tokenizer]:
+    """ Returns the name of the tokenizer actually used for a tokenizer name and the tokenizer """
+    if name == "approx":
+        return name, _approx_token_offsets
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.get_encoding(name)
+        except ValueError:
+            encoding = tiktoken.encoding_for_model(name)
+    except Exception as e:
+        warnings.warn(f"Could not load the '{name}' tiktoken encoding ({e}), token counts will be approximated")
+        return "approx", _approx_token_offsets
+
+    def _token_offsets(text: str) -> List[int]:
+        return encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))[1]
+    return name, _token_offsets
+
+
+def get_tokenizer(name: str = "cl100k_base") -> Tokenizer:
+    """ Returns a tokenizer (text -> token start offsets) for a tiktoken encoding or model name
+
+    'approx' (or a tiktoken encoding that can't be loaded, i.e. offline without a cached BPE file) uses a regex
+    tokenizer that counts words and punctuation, which is close to the BPE token count of English prose.
+
+    Args:
+        name (str, optional): A tiktoken encoding name (i.e. 'cl100k_base'), an OpenAI model name or 'approx'.
+
+    Returns:
+        Tokenizer: A function returning the start offset (in characters) of every token in a text.
+    """
+    return _load_tokenizer(name)[1]
+
+
+def resolve_tokenizer(name: Optional[str]) -> Optional[str]:
+    """ Returns the name of the tokenizer `get_tokenizer` actually uses for a name ('approx' if it fell back)
+
+    Chunk settings that end up in cache keys and document fingerprints should hold the resolved name, so chunks made
+    with the fallback tokenizer are never served for the real one (None or '', for character chunks, resolve to None).
+    """
+    return None if not name else _load_tokenizer(name)[0]
+
+
+def count_tokens(text: str, tokenizer: str = "cl100k_base") -> int:
+    """ Returns the number of tokens in a text """
+    return len(get_tokenizer(tokenizer)(text))
+
+
+def get_token_spans(
+        text: str,
+        chunk_size: int,
+        chunk_overlap: int = 0,
+        separators: Tuple[str] = ("\n\n", "\n", ".", "!", "?", ",", " ", ""),
+        tokenizer: str = "cl100k_base",
+) -> List[Tuple[int, int, int]]:
+    """ Returns the (char start, char end, n_tokens) spans of the token-sized chunks of a text
+
+    The text is tokenized once. Each chunk takes the next `chunk_size` tokens and its end is moved back to the last
+    occurrence of the highest priority separator in the second half of the window (a paragraph break before a line
+    break before a sentence end, etc.), so each chunk is scanned once instead of being recursively re-split. The next
+    chunk starts `chunk_overlap` tokens before the end of the previous one.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+    offsets = get_tokenizer(tokenizer)(text)
+    n_tokens, spans, start = len(offsets), [], 0
+    while start < n_tokens:
+        stop = min(start + chunk_size, n_tokens)
+        char_start, char_end = offsets[start], len(text) if stop == n_tokens else offsets[stop]
+        if stop < n_tokens:
+            window_start = offsets[start + chunk_size // 2]
+            for separator in separators:
+                position = text.rfind(separator, window_start, char_end) if separator else -1
+                if position != -1:
+                    # Snap the end back to the start of the token it falls in, so a token that straddles the separator
+                    # (i.e. BPE tokens starting with a space) goes to the next chunk instead of being cut
+                    stop = max(bisect_right(offsets, position + len(separator), start + 1, stop + 1) - 1, start + 1)
+                    char_end = offsets[stop]
+                    break
+        spans.append((char_start, char_end, stop - start))
+        if stop == n_tokens:
+            break
+        start = max(stop - chunk_overlap, start + 1)
+    return spans
+
+
+def split_text_by_tokens(
+        text: str,
+        chunk_size: int,
+        chunk_overlap: int = 0,
+        separators: Tuple[str] = ("\n\n", "\n", ".", "!", "?", ",", " ", ""),
+        tokenizer: str = "cl100k_base",
+) -> List[str]:
+    """ Splits a text into chunks of at most `chunk_size` tokens (a drop-in for `TextSplitter.split_text`)
+
+    Args:
+        text (str): The text to split.
+        chunk_size (int): The maximum number of tokens per chunk.
+        chunk_overlap (int, optional): The number of tokens to overlap between chunks.
+        separators (Tuple[str], optional): The separators to end chunks on (in order of preference).
+        tokenizer (str, optional): The tokenizer used to count tokens (see `get_tokenizer`).
+
+    Returns:
+        List[str]: The (whitespace stripped, non-empty) chunks.
+    """
+    chunks = (text[start:end].strip() for start, end, _ in get_token_spans(
+        text, chunk_size, chunk_overlap=chunk_overlap, separators=separators, tokenizer=tokenizer
+    ))
+    return [chunk for chunk in chunks if chunk]
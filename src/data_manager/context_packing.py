@@ -0,0 +1,102 @@
+import re
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+
+from src.config.settings import (
+    MODEL_CONTEXT_WINDOWS,
+    DEFAULT_CONTEXT_WINDOW,
+    CONTEXT_ANSWER_TOKENS,
+    CONTEXT_DEDUP_THRESHOLD,
+    CHUNK_TOKENIZER,
+)
+from src.data_manager.chunking import count_tokens
+
+# The size of the word n-grams used to detect near-duplicate and overlapping chunks
+_SHINGLE_SIZE = 3
+
+# The stuff chain formats every source with this document prompt (joined by blank lines)
+_SOURCE_TEMPLATE = "Content: {page_content}\nSource: {source}\n\n"
+
+
+def get_context_window(model_name: str) -> int:
+    """ Returns the context window (in tokens) of a model (the longest matching prefix in `MODEL_CONTEXT_WINDOWS`) """
+    prefixes = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model_name.startswith(prefix)]
+    return MODEL_CONTEXT_WINDOWS[max(prefixes, key=len)] if prefixes else DEFAULT_CONTEXT_WINDOW
+
+
+def get_context_budget(
+        model_name: str,
+        prompt_template: str = "",
+        answer_tokens: int = CONTEXT_ANSWER_TOKENS,
+        tokenizer: str = CHUNK_TOKENIZER,
+) -> int:
+    """ Returns the number of tokens left for the sources once the prompt and the answer are accounted for
+
+    Args:
+        model_name (str): The name of the model.
+        prompt_template (str, optional): The prompt template the sources (and question) are injected into.
+        answer_tokens (int, optional): The number of tokens reserved for the answer.
+        tokenizer (str, optional): The tokenizer used to count tokens (see `src.data_manager.chunking`).
+
+    Returns:
+        int: The token budget for the sources.
+    """
+    return max(0, get_context_window(model_name) - count_tokens(prompt_template, tokenizer) - answer_tokens)
+
+
+def _shingles(text: str) -> FrozenSet[Tuple[str, ...]]:
+    words = re.findall(r"\w+", text.lower())
+    return frozenset(tuple(words[i:i + _SHINGLE_SIZE]) for i in range(max(1, len(words) - _SHINGLE_SIZE + 1)))
+
+
+def pack_sources(
+        sources: List[Document],
+        token_budget: int,
+        dedup_threshold: Optional[float] = CONTEXT_DEDUP_THRESHOLD,
+        tokenizer: str = CHUNK_TOKENIZER,
+) -> Tuple[List[Document], Dict[str, Any]]:
+    """ Packs retrieved sources (ordered by relevance) into a token budget
+
+    Sources are considered in order. A source is dropped if most of its text is contained in a more relevant source
+    that was already kept (word trigram containment of at least `dedup_threshold`, i.e. overlapping chunks or the same
+    passage in two documents) or if it does not fit in the remaining budget (later, shorter sources can still fill
+    the gap).
+
+    Args:
+        sources (List[Document]): The retrieved sources, most relevant first.
+        token_budget (int): The number of tokens the formatted sources may use (see `get_context_budget`).
+        dedup_threshold (float, optional): The containment above which a source is a near-duplicate (None disables it).
+        tokenizer (str, optional): The tokenizer used to count tokens (see `src.data_manager.chunking`).
+
+    Returns:
+        Tuple[List[Document], Dict[str, Any]]: The kept sources (in order) and a report with the 'token_budget', the
+                                               'tokens_used', the 'kept' source keys and the 'dropped' sources
+                                               (their 'source' key, 'reason' and 'tokens').
+    """
+    kept, kept_shingles, dropped, tokens_used = [], [], [], 0
+    for doc in sources:
+        source = doc.metadata.get("source")
+        n_tokens = count_tokens(_SOURCE_TEMPLATE.format(page_content=doc.page_content, source=source), tokenizer)
+        shingles = _shingles(doc.page_content)
+
+        if dedup_threshold is not None and any(
+            len(shingles & other) / max(1, min(len(shingles), len(other))) >= dedup_threshold
+            for other in kept_shingles
+        ):
+            dropped.append(dict(source=source, reason="duplicate", tokens=n_tokens))
+        elif tokens_used + n_tokens > token_budget:
+            dropped.append(dict(source=source, reason="budget", tokens=n_tokens))
+        else:
+            kept.append(doc)
+            kept_shingles.append(shingles)
+            tokens_used += n_tokens
+
+    report = dict(
+        token_budget=token_budget,
+        tokens_used=tokens_used,
+        kept=[doc.metadata.get("source") for doc in kept],
+        dropped=dropped,
+    )
+    return kept, report
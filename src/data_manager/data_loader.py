@@ -1,33 +1,52 @@
+import os
 import re
+import math
 import docx2txt
 import streamlit as st
 from io import BytesIO
 from PyPDF2 import PdfReader
 import pdfplumber
-from pdfminer.high_level import extract_text
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # _PDF_READER = pdfplumber.open
 # _PDF_READER = PdfReader
 _PDF_READER = "pdfminer"
 
-from typing import List, Union, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union, Tuple
 
 # OPENAI
 from openai.error import AuthenticationError
 
 # LANGCHAIN
 from langchain.vectorstores import VectorStore
-from langchain.vectorstores.faiss import FAISS
 from langchain.docstore.document import Document
-from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from src.config.settings import (
+    INDEX_DIR, PDF_PARALLEL_PAGE_THRESHOLD, PDF_PARALLEL_MAX_WORKERS, CHUNK_SIZE, CHUNK_TOKENIZER
+)
+from src.data_manager.chunking import resolve_tokenizer, split_text_by_tokens
+from src.data_manager.embedding_cache import embed_with_cache, get_embedding_model_name
+from src.data_manager.embedding_pipeline import embed_documents_batched, get_embedding_model
+from src.data_manager.index_store import document_fingerprint, load_vectorstore, save_vectorstore
+from src.data_manager.index_factory import build_vectorstore, get_vectorstore_embeddings, search_vectors
+from src.data_manager.lexical_index import BM25Index, reciprocal_rank_fusion
+from src.monitoring.metrics import get_metrics_registry, record_stage, trace_stage
 
-def parse_document(f_bytes, f_name):
+
+def parse_document(f_bytes, f_name, stream=False):
     """ Parses a document into a list of Documents
 
     Args:
         file_object (BytesIO): The uploaded file
+        stream (bool, optional): Whether pdf pages should be yielded lazily (see `parse_pdf`)
 
     Returns:
         str: The parsed document
@@ -36,7 +55,7 @@ def parse_document(f_bytes, f_name):
         ValueError: If the file type is not supported
     """
     if f_name.endswith(".pdf"):
-        return parse_pdf(f_bytes)
+        return parse_pdf(f_bytes, stream=stream)
     elif f_name.endswith(".docx"):
         return parse_docx(f_bytes)
     elif f_name.endswith(".txt"):
@@ -45,6 +64,29 @@ def parse_document(f_bytes, f_name):
         raise ValueError(" ... File type not supported ... " )
 
 
+def parse_documents(files: List[Tuple[BytesIO, str]], max_workers: int = 4) -> Dict[str, Union[str, List[str]]]:
+    """ Parses several documents concurrently
+
+    Each document is parsed on its own thread (large pdfs additionally fan out to a process pool in `parse_pdf`).
+
+    Args:
+        files (List[Tuple[BytesIO, str]]): A list of (file bytes, file name) pairs
+        max_workers (int, optional): The maximum number of documents parsed at the same time
+
+    Returns:
+        Dict[str, Union[str, List[str]]]: A mapping from file name (made unique, see `unique_document_names`) to
+                                          parsed document (in upload order)
+
+    Raises:
+        ValueError: If any of the file types is not supported
+    """
+    if not files:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        parsed = executor.map(lambda f: parse_document(f_bytes=f[0], f_name=f[1]), files)
+        return dict(zip(unique_document_names(f_name for _, f_name in files), parsed))
+
+
 def parse_docx(f_bytes: BytesIO) -> str:
     """ Parses a docx file and returns the contents as a string.
 
@@ -89,26 +131,173 @@ def pdf_repair(text: str) -> str:
     return text
 
 
-def parse_pdf(f_bytes: BytesIO) -> List[str]:
-    """ Parses a pdf file and returns the contents as a string.
+# The pdf readers that `_PDF_READER` can select (names are used to address them from worker processes)
+_PDF_READERS = {
+    "pdfminer": "pdfminer",
+    "pdfplumber": pdfplumber.open,
+    "pypdf2": PdfReader,
+}
 
-    Args:
-        file (BytesIO): A file-like object containing a txt file.
+# The pdf bytes and reader name held by each parallel extraction worker (see `_init_pdf_worker`)
+_WORKER_PDF = {}
 
-    Returns:
-        str: The contents of the txt file.
+
+def _get_pdf_reader_name(reader=None) -> str:
+    """ Returns the name (key in `_PDF_READERS`) of the given pdf reader (defaults to `_PDF_READER`) """
+    reader = _PDF_READER if reader is None else reader
+    for name, _reader in _PDF_READERS.items():
+        if reader == _reader:
+            return name
+    raise ValueError(f"Invalid pdf reader: {reader}")
+
+
+def _pdfminer_page_text(page_layout) -> str:
+    """ Returns the text of a pdfminer page layout """
+    return "".join(element.get_text() for element in page_layout if isinstance(element, LTTextContainer))
+
+
+def _extract_page_range(f_bytes: BytesIO, start: int, stop: int, reader_name: str) -> List[str]:
+    """ Extracts the text of the pages in [start, stop) with the given pdf reader """
+    if reader_name == "pdfminer":
+        page_layouts = extract_pages(f_bytes, page_numbers=range(start, stop))
+        return [_pdfminer_page_text(page_layout) for page_layout in page_layouts]
+    pdf = _PDF_READERS[reader_name](f_bytes)
+
+    # Fix common issues with pdf text extraction
+    return [pdf_repair(pdf.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+def _init_pdf_worker(pdf_data: bytes, reader_name: str) -> None:
+    """ Stores the pdf once per worker process so that each task only has to ship its page range """
+    _WORKER_PDF.update(pdf_data=pdf_data, reader_name=reader_name)
+
+
+def _extract_page_range_worker(page_range: Tuple[int, int]) -> List[str]:
+    return _extract_page_range(BytesIO(_WORKER_PDF["pdf_data"]), *page_range, _WORKER_PDF["reader_name"])
+
+
+# Pdfs smaller than this many bytes per page of the parallel threshold are parsed sequentially without counting pages
+_MIN_PDF_PAGE_BYTES = 512
+
+
+def count_pdf_pages(f_bytes: BytesIO) -> int:
+    """ Returns the number of pages in a pdf file (the stream position is restored afterwards)
+
+    Only the cross-reference table and the page count of the page tree's root are read (no page is parsed). The page
+    tree and its count may both be indirect objects.
     """
-    # Extract text from pdf
+    position = f_bytes.tell()
+    try:
+        f_bytes.seek(0)
+        n_pages = resolve1(resolve1(PDFDocument(PDFParser(f_bytes)).catalog["Pages"])["Count"])
+    finally:
+        f_bytes.seek(position)
+    return int(n_pages)
+
+
+def iter_pdf_pages(f_bytes: BytesIO) -> Iterator[str]:
+    """ Yields the text of a pdf file one page at a time.
 
-    if "pdfminer" in _PDF_READER:
-        output = extract_text(f_bytes)
+    Pages are parsed lazily so only a single page of text is held in memory at once (pdfminer parses the page tree
+    incrementally via `extract_pages`).
+
+    Args:
+        f_bytes (BytesIO): A file-like object containing a pdf file.
+
+    Yields:
+        str: The text of each page (in page order).
+    """
+    if _PDF_READER == "pdfminer":
+        for page_layout in extract_pages(f_bytes):
+            yield _pdfminer_page_text(page_layout)
     else:
-        pdf = pdf_repair(_PDF_READER(f_bytes))
+        pdf = _PDF_READER(f_bytes)
 
         # Fix common issues with pdf text extraction
-        output = [pdf_repair(page.extract_text()) for page in pdf.pages]
+        for page in pdf.pages:
+            yield pdf_repair(page.extract_text() or "")
+
+
+def iter_pdf_pages_parallel(
+        f_bytes: BytesIO,
+        n_pages: int = None,
+        max_workers: int = PDF_PARALLEL_MAX_WORKERS,
+        pages_per_task: int = None,
+) -> Iterator[str]:
+    """ Yields the text of a pdf file one page at a time, extracting page ranges in a process pool.
+
+    The pdf is split into contiguous page ranges that are extracted concurrently by worker processes (each worker
+    receives the pdf bytes once). Ranges are reassembled in page order, so the output is identical to
+    `iter_pdf_pages` and pages are yielded as soon as every earlier range has finished.
+
+    The workers are spawned (forking a threaded process such as a Streamlit server is unsafe) and exit as soon as
+    every range is extracted, not when the consumer of the pages is done.
 
-    return output
+    Args:
+        f_bytes (BytesIO): A file-like object containing a pdf file.
+        n_pages (int, optional): The number of pages in the pdf (computed if not provided).
+        max_workers (int, optional): The number of worker processes. Defaults to `os.cpu_count()`.
+        pages_per_task (int, optional): The number of pages extracted by each task. Defaults to a size that gives
+                                        every worker ~4 tasks (so uneven pages are balanced across workers).
+
+    Yields:
+        str: The text of each page (in page order).
+    """
+    n_pages = count_pdf_pages(f_bytes) if n_pages is None else n_pages
+    max_workers = max_workers or os.cpu_count() or 1
+    pages_per_task = pages_per_task or max(1, math.ceil(n_pages / (max_workers * 4)))
+    page_ranges = [(start, min(start + pages_per_task, n_pages)) for start in range(0, n_pages, pages_per_task)]
+
+    f_bytes.seek(0)
+    executor = ProcessPoolExecutor(
+        max_workers=min(max_workers, len(page_ranges)) or 1,
+        mp_context=get_context("spawn"),
+        initializer=_init_pdf_worker,
+        initargs=(f_bytes.read(), _get_pdf_reader_name()),
+    )
+    try:
+        futures = [executor.submit(_extract_page_range_worker, page_range) for page_range in page_ranges]
+    finally:
+        # The queued tasks still run, the workers just exit once they are done
+        executor.shutdown(wait=False)
+    for future in futures:
+        yield from future.result()
+
+
+def parse_pdf(
+        f_bytes: BytesIO,
+        stream: bool = False,
+        parallel_page_threshold: int = PDF_PARALLEL_PAGE_THRESHOLD,
+        **parallel_kwargs,
+) -> Union[List[str], Iterator[str]]:
+    """ Parses a pdf file and returns the contents as a list of strings (one per page).
+
+    Args:
+        file (BytesIO): A file-like object containing a pdf file.
+        stream (bool, optional): Whether to return a generator that yields pages lazily instead of a list.
+        parallel_page_threshold (int, optional): Pdfs with at least this many pages are extracted in a process pool
+                                                 (see `iter_pdf_pages_parallel`). Set to 0 to disable.
+        **parallel_kwargs: Additional kwargs for `iter_pdf_pages_parallel` (max_workers, pages_per_task)
+
+    Returns:
+        Union[List[str], Iterator[str]]: The text of each page of the pdf file.
+    """
+    # Extract text from pdf (small files can't reach the parallel threshold, so their pages are not counted)
+    f_bytes.seek(0, os.SEEK_END)
+    n_bytes = f_bytes.tell()
+    f_bytes.seek(0)
+    n_pages = 0
+    if parallel_page_threshold and n_bytes >= parallel_page_threshold * _MIN_PDF_PAGE_BYTES:
+        try:
+            n_pages = count_pdf_pages(f_bytes)
+        except Exception:
+            # An unusual page tree (or a damaged cross-reference table) that the sequential parser may still read
+            f_bytes.seek(0)
+    if parallel_page_threshold and n_pages >= parallel_page_threshold:
+        pages = iter_pdf_pages_parallel(f_bytes, n_pages=n_pages, **parallel_kwargs)
+    else:
+        pages = iter_pdf_pages(f_bytes)
+    return pages if stream else list(pages)
 
 
 def parse_txt(f_bytes: BytesIO) -> str:
@@ -127,73 +316,270 @@ def parse_txt(f_bytes: BytesIO) -> str:
     return text
 
 
-def text_to_docs(
-        text: Union[str, List[str]],
-        chunk_size: int = 1000,
+def make_source_key(page: int, chunk: int, doc_name: Optional[str] = None) -> str:
+    """ Returns the `source` key of a chunk (`page-chunk` or `document:page-chunk` if a document name is given)
+
+    Characters that would break the comma separated SOURCES section of an LLM response are replaced in the name.
+    """
+    if doc_name is None:
+        return f"{page}-{chunk}"
+    return f"{_sanitize_doc_name(doc_name)}:{page}-{chunk}"
+
+
+def _sanitize_doc_name(doc_name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", doc_name)
+
+
+def unique_document_names(names: Iterable[str]) -> List[str]:
+    """ Makes document names unique (in their `source` key form) by suffixing repeats with `#2`, `#3`, etc.
+
+    Several uploads can share a file name, and different names can map to the same `source` key (see
+    `make_source_key`), in which case their documents would overwrite each other or share citations.
+    """
+    seen, unique_names = set(), []
+    for name in names:
+        unique_name, n = name, 1
+        while _sanitize_doc_name(unique_name) in seen:
+            n += 1
+            unique_name = f"{name}#{n}"
+        seen.add(_sanitize_doc_name(unique_name))
+        unique_names.append(unique_name)
+    return unique_names
+
+
+def iter_text_to_docs(
+        text: Union[str, Iterable[str]],
+        chunk_size: int = CHUNK_SIZE,
         chunk_overlap: int = 0,
         separators: Tuple[str] = ("\n\n", "\n", ".", "!", "?", ",", " ", ""),
-) -> List[Document]:
-    """Converts a string or list of strings to a list of Documents with metadata.
+        doc_name: Optional[str] = None,
+        first_page: int = 1,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+) -> Iterator[Document]:
+    """Lazily converts a string or an iterable of page strings to Documents with metadata.
+
+    Pages are consumed one at a time, so a generator of pages (i.e. `parse_pdf(..., stream=True)`) is chunked as it is
+    parsed and never has to be fully materialized.
 
     Args:
-        text (Union[str, List[str]]): A string or list of strings.
-        chunk_size (int, optional): The size of each chunk.
-        chunk_overlap (int, optional): The number of characters to overlap between chunks.
+        text (Union[str, Iterable[str]]): A string or an iterable of strings (one per page).
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
         separators (Tuple[str], optional): A tuple of strings to split on.
-
-    Returns:
-        List[Document]: A list of Documents.
+        doc_name (str, optional): The name of the document. If provided, it is stored as `document` metadata and
+                                  the `source` keys are qualified with it (see `make_source_key`).
+        first_page (int, optional): The page number of the first page (i.e. when appending pages to a document).
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (see `src.data_manager.chunking`).
+                                   None splits by character count with `RecursiveCharacterTextSplitter`.
+
+    Yields:
+        Document: The chunked Documents (in page and chunk order).
     """
     # Take a single string as one page (coercion)
     if isinstance(text, str): text = [text]
 
-    # Convert pages to Documents
-    page_docs = [Document(page_content=page) for page in text]
-
-    # Add page numbers as metadata
-    for i, doc in enumerate(page_docs):
-        doc.metadata["page"] = i + 1
-
     # - Define the text splitter to use for chunking -
+    #     - The token splitter tokenizes each page once and ends every chunk of `chunk_size` tokens on the best
+    #       separator in a single pass, so chunks have predictable token counts (see `split_text_by_tokens`)
     #     - RecursiveCharacterTextSplitter is a splitter that splits text into chunks of a specified size, but tries to
     #       split on a list of separators first.
     #     - This is useful for splitting text into contiguous sentences or paragraphs that have consistent semantics
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        separators=list(separators),
-        chunk_overlap=chunk_overlap,
-    )
+    if tokenizer:
+        def split_text(page: str) -> List[str]:
+            return split_text_by_tokens(page, chunk_size, chunk_overlap, separators=separators, tokenizer=tokenizer)
+    else:
+        split_text = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            separators=list(separators),
+            chunk_overlap=chunk_overlap,
+        ).split_text
+
+    # Split each page into chunks and add page numbers, chunk numbers and `sources` as metadata.
+    for page_number, page in enumerate(text, start=first_page):
+        for i, chunk in enumerate(split_text(page)):
+            metadata = {"page": page_number, "chunk": i, "source": make_source_key(page_number, i, doc_name)}
+            if doc_name is not None:
+                metadata["document"] = doc_name
+            yield Document(page_content=chunk, metadata=metadata)
+
+
+def text_to_docs(
+        text: Union[str, Iterable[str]],
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        separators: Tuple[str] = ("\n\n", "\n", ".", "!", "?", ",", " ", ""),
+        build_lexical_index: bool = False,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+) -> Union[List[Document], Tuple[List[Document], BM25Index]]:
+    """Converts a string or list of strings to a list of Documents with metadata.
+
+    Args:
+        text (Union[str, Iterable[str]]): A string or an iterable of strings (one per page).
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        separators (Tuple[str], optional): A tuple of strings to split on.
+        build_lexical_index (bool, optional): Whether to also build a BM25 inverted index over the chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (None for characters).
+
+    Returns:
+        Union[List[Document], Tuple[List[Document], BM25Index]]: A list of Documents (and the BM25 index over them if
+                                                                 `build_lexical_index` is True).
+    """
+    docs = list(iter_text_to_docs(
+        text, chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators, tokenizer=tokenizer
+    ))
+    if build_lexical_index:
+        return docs, BM25Index.from_documents(docs)
+    return docs
+
+
+def texts_to_docs(doc_texts: Dict[str, Union[str, Iterable[str]]], **chunk_kwargs) -> List[Document]:
+    """Converts several documents to a single list of Documents with document-qualified `source` keys.
+
+    Args:
+        doc_texts (Dict[str, Union[str, Iterable[str]]]): A mapping from document name to document text (or pages).
+        **chunk_kwargs: Additional kwargs for `iter_text_to_docs` (chunk_size, chunk_overlap, separators, tokenizer)
+
+    Returns:
+        List[Document]: A list of Documents from every document (in document, page and chunk order).
+    """
+    return [
+        doc
+        for doc_name, text in zip(unique_document_names(doc_texts), doc_texts.values())
+        for doc in iter_text_to_docs(text, doc_name=doc_name, **chunk_kwargs)
+    ]
+
+
+def embed_chunks(
+        texts: List[str],
+        embeddings: Embeddings,
+        chunk_settings: Optional[Dict] = None,
+        use_cache: bool = True,
+        **pipeline_kwargs,
+) -> List[List[float]]:
+    """Embeds chunk texts through the embedding cache and the batched embedding pipeline
+
+    Args:
+        texts (List[str]): The chunk texts to embed.
+        embeddings (Embeddings): The embedding model (see `get_embedding_model`).
+        chunk_settings (Dict, optional): The settings used to chunk the texts (part of the cache key).
+        use_cache (bool, optional): Whether to read from and write to the persistent embedding cache.
+        **pipeline_kwargs: Additional kwargs for `embed_documents_batched` (batch_size, max_workers, etc.)
+
+    Returns:
+        List[List[float]]: One vector per chunk text.
+    """
+    embed_fn = lambda batch: embed_documents_batched(batch, embeddings, **pipeline_kwargs)
+    if use_cache:
+        return embed_with_cache(texts, embeddings, chunk_settings=chunk_settings, embed_fn=embed_fn)
+    return embed_fn(texts)
+
+
+def embed_docs(
+        docs: List[Document],
+        embeddings: Embeddings,
+        chunk_settings: Optional[Dict] = None,
+        use_cache: bool = True,
+        index_spec: str = "auto",
+        **pipeline_kwargs,
+) -> VectorStore:
+    """Embeds a list of (already chunked) Documents and returns a FAISS vectorstore
+
+    Chunk embeddings are looked up in the persistent embedding cache (see `src.data_manager.embedding_cache`) first,
+    so only chunks that have never been embedded with the same model and chunk settings are sent to the API. The
+    remaining chunks are embedded in concurrent, rate limited batches (see `src.data_manager.embedding_pipeline`).
+
+    Args:
+        docs (List[Document]): The chunked Documents to embed.
+        embeddings (Embeddings): The embedding model (see `get_embedding_model`).
+        chunk_settings (Dict, optional): The settings used to chunk the Documents (part of the cache key).
+        use_cache (bool, optional): Whether to read from and write to the persistent embedding cache.
+        index_spec (str, optional): A FAISS index factory string (i.e. 'Flat', 'HNSW32', 'IVF1024,PQ64') or 'auto' to
+                                    pick one from the number of chunks and the memory budget
+                                    (see `src.data_manager.index_factory.choose_index_spec`).
+        **pipeline_kwargs: Additional kwargs for `embed_documents_batched` (batch_size, max_workers, etc.)
+
+    Returns:
+        VectorStore: A FAISS index of the embedded Documents (with a BM25 index over them as `lexical_index`).
+    """
+    texts = [doc.page_content for doc in docs]
+    vectors = embed_chunks(texts, embeddings, chunk_settings=chunk_settings, use_cache=use_cache, **pipeline_kwargs)
+
+    # Create vectorstore (exact search for small documents, an approximate index for large collections)
+    vs = build_vectorstore(docs, vectors, embeddings, index_spec=index_spec)
+
+    # Keep a BM25 index over the same chunks for lexical/hybrid retrieval (see `search_docs`)
+    vs.lexical_index = BM25Index.from_documents(docs)
+    return vs
+
+
+def _load_or_embed(
+        doc_texts: Union[str, Iterable[str], Dict[str, Union[str, Iterable[str]]]],
+        to_docs: Callable[..., List[Document]],
+        openai_api_key: str,
+        chunk_settings: Dict,
+        embedding_backend: str = "openai",
+        persist: bool = True,
+        index_dir: str = INDEX_DIR,
+        **embed_kwargs,
+) -> VectorStore:
+    """ Loads the persisted vectorstore for the document(s) or chunks, embeds and persists them on a miss
+
+    Generators of pages cannot be fingerprinted without consuming them, so they are always embedded (and not persisted).
+    """
+    embeddings = get_embedding_model(embedding_backend, openai_api_key=openai_api_key)
+
+    fingerprint = None
+    if persist and not isinstance(doc_texts, Iterator):
+        index_settings = dict(chunk_settings, index_spec=embed_kwargs.get("index_spec", "auto"))
+        fingerprint = document_fingerprint(doc_texts, index_settings, get_embedding_model_name(embeddings))
+        vs = load_vectorstore(fingerprint, embeddings, index_dir=index_dir)
+        result = "miss" if vs is None else "hit"
+        get_metrics_registry().inc("stage_cache_requests_total", stage="embed_document", result=result)
+        if vs is not None:
+            vs.fingerprint = fingerprint
+            return vs
+
+    # Convert the text to Langchain Documents, embed the chunks and create vectorstore
+    with trace_stage("chunking", tokenizer=chunk_settings.get("tokenizer")) as span:
+        docs = to_docs(doc_texts, **chunk_settings)
+        span.record(chunks=len(docs), characters=sum(len(doc.page_content) for doc in docs))
+    # The chunks embedded by the enclosing stage (i.e. `embed_document`)
+    record_stage(chunks=len(docs))
+    vs = embed_docs(docs, embeddings, chunk_settings=chunk_settings, **embed_kwargs)
+    if fingerprint is not None:
+        save_vectorstore(vs, fingerprint, index_dir=index_dir)
+
+    # The fingerprint identifies the document for caches keyed on it (i.e. `src.model_manager.answer_cache`)
+    vs.fingerprint = fingerprint
+    return vs
 
-    # Split each page into chunks and add page numbers and chunk numbers as metadata.
-    doc_chunks = []
-    for doc in page_docs:
-        chunks = text_splitter.split_text(doc.page_content)
-        # Add chunk numbers and `sources` as metadata
-        for i, chunk in enumerate(chunks):
-            doc = Document(page_content=chunk, metadata={"page": doc.metadata["page"], "chunk": i})
-            doc.metadata["source"] = f"{doc.metadata['page']}-{doc.metadata['chunk']}"
-            doc_chunks.append(doc)
-    return doc_chunks
-
-
-# @st.cache_data(show_spinner=False)
-# The st.cache_data decorator caches the result of this function so that it is
-#     only run once per file. This is useful for large files that take a long
-#     time to process. `` is required because the
-#     Document objects need to be mutable. `show_spinner=False` hides the
-#     spinner that Streamlit displays while the function is running.
-# If the user has not entered an API key that is stored in state, raise an error
-#     if not st.session_state.get("OPENAI_API_KEY"):
-#         raise AuthenticationError("👈 Enter your API key in the sidebar (https://platform.openai.com/account/api-keys)")
-#     st.session_state.get("OPENAI_API_KEY")
-def embed_text(doc_txt: str, openai_api_key: str) -> VectorStore:
+
+def embed_text(
+        doc_txt: Union[str, Iterable[str]],
+        openai_api_key: str,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+        **embed_kwargs,
+) -> VectorStore:
     """Embeds a list of Documents and returns a FAISS vectorstore
 
     FAISS is a library for efficient similarity search and clustering of dense vectors.
 
+    The vectorstore is persisted to the index directory under a fingerprint of the document text, chunk settings and
+    embedding model (see `src.data_manager.index_store`), so later sessions and other worker processes load it from
+    disk instead of re-chunking and re-embedding the document.
+
     Args:
-        doc_txt (str): The full document text to embed. This is kept as a string to allow for hashing
+        doc_txt (Union[str, Iterable[str]]): The full document text to embed. This is kept as a string (or a list of
+                                             page strings) to allow for hashing. A generator of pages is consumed
+                                             lazily so chunking starts before the last page has been parsed.
         openai_api_key (str): The OpenAI API key to use for embedding the text.
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (see `src.data_manager.chunking`).
+        **embed_kwargs: Additional kwargs for `embed_docs` (use_cache, embedding_backend, persist, index_dir, etc.)
 
     Raises:
         AuthenticationError: If the user has not previously entered a valid OpenAI API key that is stored in state.
@@ -201,19 +587,48 @@ def embed_text(doc_txt: str, openai_api_key: str) -> VectorStore:
     Returns:
         VectorStore: A FAISS index of the embedded Documents.
     """
+    chunk_settings = dict(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=resolve_tokenizer(tokenizer))
+    return _load_or_embed(doc_txt, text_to_docs, openai_api_key, chunk_settings, **embed_kwargs)
 
-    # Convert the text to Langchain Documents
-    docs = text_to_docs(doc_txt)
 
-    # Embed the chunks
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+def embed_texts(
+        doc_texts: Dict[str, Union[str, Iterable[str]]],
+        openai_api_key: str,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+        **embed_kwargs,
+) -> VectorStore:
+    """Embeds several documents into a single shared FAISS vectorstore
 
-    # Create vectorstore
-    vs = FAISS.from_documents(docs, embeddings)
-    return vs
+    Every chunk carries a `document` metadata field and a document-qualified `source` key (i.e. `handbook.pdf:3-15`)
+    so that a single `search_docs` call retrieves (and cites) chunks across all of the documents. The vectorstore is
+    persisted like in `embed_text`.
 
+    Args:
+        doc_texts (Dict[str, Union[str, Iterable[str]]]): A mapping from document name to document text (or pages).
+        openai_api_key (str): The OpenAI API key to use for embedding the text.
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (see `src.data_manager.chunking`).
+        **embed_kwargs: Additional kwargs for `embed_docs` (use_cache, embedding_backend, persist, index_dir, etc.)
 
-def search_docs(vectorstore: VectorStore, query: str, top_k: int = 5) -> List[Document]:
+    Returns:
+        VectorStore: A FAISS index of the embedded Documents from every document.
+    """
+    chunk_settings = dict(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=resolve_tokenizer(tokenizer))
+    return _load_or_embed(doc_texts, texts_to_docs, openai_api_key, chunk_settings, **embed_kwargs)
+
+
+def search_docs(
+        vectorstore: VectorStore,
+        query: str,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        mode: str = "vector",
+        n_candidates: Optional[int] = None,
+) -> List[Document]:
     """Searches a FAISS index for similar chunks to the query and returns a list of Documents.
 
     The `query` is embedded and then compared to the embedded Documents in the vectorstore`index`.
@@ -221,15 +636,84 @@ def search_docs(vectorstore: VectorStore, query: str, top_k: int = 5) -> List[Do
 
     FAISS is a library for efficient similarity search and clustering of dense vectors.
 
+    In 'hybrid' mode the dense results are fused with the results of the BM25 index over the same chunks
+    (`vectorstore.lexical_index`) using reciprocal rank fusion, so exact-term queries (part numbers, clause ids) are
+    found without having to raise `top_k`.
+
     Args:
         vectorstore (VectorStore): A FAISS index (vectorstore) of the embedded Documents.
         query (str): A query string.
         top_k (int): The number of similar chunks to return.
+        nprobe (int, optional): The number of inverted lists to visit (IVF indexes only, higher is more accurate).
+        ef_search (int, optional): The size of the candidate list (HNSW indexes only, higher is more accurate).
+        mode (str, optional): The retrieval mode. Can be ['vector' | 'lexical' | 'hybrid']
+        n_candidates (int, optional): The number of candidates each ranking contributes in 'hybrid' mode.
+                                      Defaults to 4 * top_k.
 
     Returns:
         List[Document]: A list of Documents that are similar to the query based on the embedded vector similarity.
     """
-
-    # Search for similar chunks
-    docs = vectorstore.similarity_search(query, k=top_k)
+    # Vectorstores persisted without a lexical index (i.e. by older versions) fall back to vector search
+    lexical_index = getattr(vectorstore, "lexical_index", None)
+    if mode == "hybrid" and lexical_index is None:
+        mode = "vector"
+    if mode == "lexical":
+        if lexical_index is None:
+            raise ValueError("Lexical retrieval requires a vectorstore with a `lexical_index`")
+        return [doc for doc, _ in lexical_index.search(query, top_k=top_k)]
+    elif mode not in ("vector", "hybrid"):
+        raise ValueError(f"Invalid retrieval mode: {mode}")
+
+    # Search for similar chunks (over-fetching to make up for tombstoned chunks, see `vectorstore_ops`)
+    k = top_k if mode == "vector" else (n_candidates or 4 * top_k)
+    tombstones = getattr(vectorstore, "tombstones", None) or ()
+    if nprobe is None and ef_search is None:
+        docs = vectorstore.similarity_search(query, k=k + len(tombstones))
+    else:
+        query_vector = [vectorstore.embedding_function(query)]
+        results = search_vectors(vectorstore, query_vector, k + len(tombstones), nprobe=nprobe, ef_search=ef_search)
+        docs = [doc for doc, _ in results[0]]
+    if tombstones:
+        docs = [doc for doc in docs if not doc.metadata.get("deleted")][:k]
+
+    if mode == "hybrid":
+        lexical_docs = [doc for doc, _ in lexical_index.search(query, top_k=k)]
+        docs = [doc for doc, _ in reciprocal_rank_fusion([docs, lexical_docs])][:top_k]
     return docs
+
+
+def search_docs_batch(
+        vectorstore: VectorStore,
+        queries: List[str],
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """Searches a FAISS index for many queries at once and returns the top_k Documents (with scores) of each query.
+
+    All of the queries are embedded with a single `embed_documents` call and searched with a single matrix search
+    against the index, which avoids a round trip per query for evaluation and pre-answering jobs.
+
+    Args:
+        vectorstore (VectorStore): A FAISS index (vectorstore) of the embedded Documents.
+        queries (List[str]): The query strings.
+        top_k (int): The number of similar chunks to return per query.
+        nprobe (int, optional): The number of inverted lists to visit (IVF indexes only, higher is more accurate).
+        ef_search (int, optional): The size of the candidate list (HNSW indexes only, higher is more accurate).
+
+    Returns:
+        List[List[Tuple[Document, float]]]: For each query (in order), the (Document, L2 distance) pairs of the most
+                                            similar chunks, nearest first (lower distances are more similar).
+    """
+    if not queries:
+        return []
+    query_vectors = get_vectorstore_embeddings(vectorstore).embed_documents(list(queries))
+
+    # Over-fetch to make up for tombstoned chunks (see `vectorstore_ops`)
+    tombstones = getattr(vectorstore, "tombstones", None) or ()
+    results = search_vectors(vectorstore, query_vectors, top_k + len(tombstones), nprobe=nprobe, ef_search=ef_search)
+    if tombstones:
+        results = [
+            [(doc, score) for doc, score in result if not doc.metadata.get("deleted")][:top_k] for result in results
+        ]
+    return results
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from array import array
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# LANGCHAIN
+from langchain.embeddings.base import Embeddings
+
+from src.config.settings import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_BYTES
+from src.data_manager.sqlite_lru import connect_sqlite, create_lru_table, evict_lru
+
+# SQLite caps the number of host parameters in a single statement (999 on older builds)
+_SQLITE_MAX_VARS = 500
+
+
+class EmbeddingCache:
+    """ A persistent, content-addressed cache of embedding vectors with size-bounded LRU eviction.
+
+    Vectors are stored as float32 blobs in a SQLite database so that the cache survives process restarts and can be
+    shared by every worker process on the same host. Each entry is keyed by a hash of the chunk text, the embedding
+    model name and the chunk settings that produced the chunk (see `EmbeddingCache.make_key`).
+
+    Args:
+        cache_dir (str, optional): The directory in which the SQLite database is stored.
+        max_bytes (int, optional): The maximum number of vector bytes to keep before the least recently used
+                                   entries are evicted.
+    """
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "embeddings.sqlite3")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        create_lru_table(self.db_path, "embeddings", "vector")
+
+    @staticmethod
+    def make_key(text: str, model_name: str, chunk_settings: Optional[Dict[str, Any]] = None) -> str:
+        """ Returns the content address for a chunk of text.
+
+        Args:
+            text (str): The chunk text that will be embedded.
+            model_name (str): The name of the embedding model.
+            chunk_settings (Dict[str, Any], optional): The settings used to chunk the document (chunk size etc.)
+
+        Returns:
+            str: A sha256 hex digest identifying the (text, model, chunk settings) triplet.
+        """
+        payload = json.dumps([text, model_name, chunk_settings or {}], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """ Looks up a collection of keys and returns the vectors of those that are cached.
+
+        Args:
+            keys (Iterable[str]): The keys to look up.
+
+        Returns:
+            Dict[str, List[float]]: A mapping from key to vector for every cache hit.
+        """
+        keys = list(dict.fromkeys(keys))
+        hits = {}
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            for i in range(0, len(keys), _SQLITE_MAX_VARS):
+                batch = keys[i:i + _SQLITE_MAX_VARS]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    hits[key] = array("f", blob).tolist()
+                if rows:
+                    conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(time.time(), key) for key, _ in rows]
+                    )
+        return hits
+
+    def put_many(self, vectors: Dict[str, List[float]]) -> None:
+        """ Stores a collection of vectors and evicts the least recently used entries if the cache is too large.
+
+        Args:
+            vectors (Dict[str, List[float]]): A mapping from key to vector.
+        """
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in vectors.items():
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, n_bytes, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            evict_lru(conn, "embeddings", self.max_bytes)
+
+    def clear(self) -> None:
+        """ Removes every entry from the cache """
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            conn.execute("DELETE FROM embeddings")
+
+
+@lru_cache(maxsize=None)
+def get_embedding_cache(cache_dir: str = EMBEDDING_CACHE_DIR,
+                        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES) -> EmbeddingCache:
+    """ Returns the process-wide embedding cache for the given directory """
+    return EmbeddingCache(cache_dir=cache_dir, max_bytes=max_bytes)
+
+
+def get_embedding_model_name(embeddings: Embeddings) -> str:
+    """ Returns a name identifying the embedding model (used as part of the cache key) """
+    return str(getattr(embeddings, "model", None) or type(embeddings).__name__)
+
+
+def embed_with_cache(
+        texts: List[str],
+        embeddings: Embeddings,
+        chunk_settings: Optional[Dict[str, Any]] = None,
+        cache: Optional[EmbeddingCache] = None,
+        embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+) -> List[List[float]]:
+    """ Embeds a list of texts, only sending the texts that are not already cached to the embedding model.
+
+    Args:
+        texts (List[str]): The chunk texts to embed.
+        embeddings (Embeddings): The embedding model used for cache misses.
+        chunk_settings (Dict[str, Any], optional): The settings used to chunk the document (part of the cache key).
+        cache (EmbeddingCache, optional): The cache to use. Defaults to the process-wide cache.
+        embed_fn (Callable, optional): The function used to embed the cache misses. Defaults to
+                                       `embeddings.embed_documents`.
+
+    Returns:
+        List[List[float]]: One vector per input text (in the same order as `texts`).
+    """
+    cache = get_embedding_cache() if cache is None else cache
+    embed_fn = embeddings.embed_documents if embed_fn is None else embed_fn
+    model_name = get_embedding_model_name(embeddings)
+    keys = [cache.make_key(text, model_name, chunk_settings) for text in texts]
+    vectors = cache.get_many(keys)
+
+    # Only embed each missing text once, even if it occurs multiple times in the document
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        new_vectors = dict(zip(missing.keys(), embed_fn(list(missing.values()))))
+        cache.put_many(new_vectors)
+        vectors.update(new_vectors)
+
+    return [vectors[key] for key in keys]
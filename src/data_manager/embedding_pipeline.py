@@ -0,0 +1,253 @@
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+# OPENAI
+from openai.error import APIConnectionError, APIError, RateLimitError, ServiceUnavailableError, Timeout
+
+# LANGCHAIN
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+
+from src.config.settings import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_WORKERS,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+)
+
+# Errors that are worth retrying (everything else is raised immediately)
+_RETRYABLE_ERRORS = (RateLimitError, APIError, APIConnectionError, ServiceUnavailableError, Timeout)
+
+
+class FakeEmbeddings(Embeddings):
+    """ A local, deterministic embedding backend used to exercise the pipeline offline.
+
+    Each text is mapped to a pseudo-random unit vector seeded by its sha256 hash, so identical texts always receive
+    identical vectors. An optional per-call latency simulates the round trip to a remote embedding API.
+
+    Args:
+        size (int, optional): The dimensionality of the vectors.
+        latency (float, optional): The number of seconds each `embed_documents`/`embed_query` call sleeps for.
+    """
+    model = "fake-embeddings"
+
+    def __init__(self, size: int = 1536, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.size)]
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+def get_embedding_model(backend: str = "openai", openai_api_key: Optional[str] = None, **kwargs) -> Embeddings:
+    """ Returns the embedding model for the given backend
+
+    Args:
+        backend (str, optional): The embedding backend to use. Can be ['openai' | 'fake']
+        openai_api_key (str, optional): The OpenAI API key (only used by the 'openai' backend)
+        **kwargs: Additional kwargs to pass to the embedding model
+
+    Returns:
+        Embeddings: The embedding model.
+    """
+    if backend == "openai":
+        return OpenAIEmbeddings(openai_api_key=openai_api_key, **kwargs)
+    elif backend == "fake":
+        return FakeEmbeddings(**kwargs)
+    else:
+        raise ValueError(f"Invalid embedding backend: {backend}")
+
+
+def estimate_tokens(text: str) -> int:
+    """ Cheap token estimate (~4 characters per token for english text) used for rate limiting """
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    """ A thread-safe token bucket that enforces request and token rate limits with adaptive (AIMD) throttling.
+
+    Both buckets refill continuously at their per-minute rate scaled by `rate_factor`. Every rate limit error halves
+    the `rate_factor` (down to `min_rate_factor`) and every successful call slowly restores it, so that the pipeline
+    converges on the throughput the API is actually willing to serve.
+
+    Args:
+        requests_per_minute (int, optional): The maximum number of requests per minute (None for no limit).
+        tokens_per_minute (int, optional): The maximum number of tokens per minute (None for no limit).
+        min_rate_factor (float, optional): The lower bound for the adaptive rate factor.
+    """
+    def __init__(self, requests_per_minute: Optional[int] = EMBEDDING_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: Optional[int] = EMBEDDING_TOKENS_PER_MINUTE, min_rate_factor: float = 0.1):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_rate_factor = min_rate_factor
+        self.rate_factor = 1.0
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60.0
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute * self.rate_factor,
+                self._request_allowance + elapsed_minutes * self.requests_per_minute * self.rate_factor
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute * self.rate_factor,
+                self._token_allowance + elapsed_minutes * self.tokens_per_minute * self.rate_factor
+            )
+
+    def acquire(self, n_tokens: int = 0) -> None:
+        """ Blocks until a request consuming `n_tokens` tokens is allowed to proceed """
+        while True:
+            with self._lock:
+                self._refill()
+                wait_minutes = 0.0
+                if self.requests_per_minute and self._request_allowance < 1:
+                    wait_minutes = max(wait_minutes, (1 - self._request_allowance) /
+                                       (self.requests_per_minute * self.rate_factor))
+                if self.tokens_per_minute:
+                    # A single request larger than the bucket only has to wait for a full bucket
+                    needed = min(n_tokens, self.tokens_per_minute * self.rate_factor)
+                    if self._token_allowance < needed:
+                        wait_minutes = max(wait_minutes, (needed - self._token_allowance) /
+                                           (self.tokens_per_minute * self.rate_factor))
+                if wait_minutes == 0.0:
+                    self._request_allowance -= 1
+                    self._token_allowance -= n_tokens
+                    return
+            time.sleep(wait_minutes * 60.0)
+
+    def penalize(self) -> None:
+        """ Multiplicatively decreases the rate after a rate limit error """
+        with self._lock:
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+
+    def reward(self) -> None:
+        """ Additively increases the rate after a successful request """
+        with self._lock:
+            self.rate_factor = min(1.0, self.rate_factor + 0.05)
+
+
+@lru_cache(maxsize=None)
+def get_rate_limiter(model: str, key_hash: str = "") -> RateLimiter:
+    """ Returns the process-wide rate limiter of a model and API key (the limits are per account, not per call)
+
+    Args:
+        model (str): The name of the embedding model.
+        key_hash (str, optional): A hash of the API key (so that the key itself is never kept as a cache key).
+
+    Returns:
+        RateLimiter: The limiter shared by every pipeline embedding with this model and key.
+    """
+    # The arguments are only the `lru_cache` key (one limiter per model and key), the limits come from the settings
+    return RateLimiter()
+
+
+def _get_default_rate_limiter(embeddings: Embeddings) -> RateLimiter:
+    api_key = getattr(embeddings, "openai_api_key", None) or ""
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else ""
+    return get_rate_limiter(getattr(embeddings, "model", type(embeddings).__name__), key_hash)
+
+
+def _without_client_retries(embeddings: Embeddings) -> Embeddings:
+    """ Returns a copy of an OpenAI embedding model that makes a single attempt per request
+
+    `OpenAIEmbeddings` retries failed requests itself (6 attempts by default), which would multiply the attempts of
+    `_embed_batch_with_backoff` and hide the rate limit errors from the adaptive `RateLimiter`. The model given to the
+    pipeline is left as is (its queries keep their retries).
+    """
+    if isinstance(embeddings, OpenAIEmbeddings):
+        # `max_retries` is the number of attempts (tenacity's `stop_after_attempt`)
+        return embeddings.copy(update=dict(max_retries=1))
+    return embeddings
+
+
+def _embed_batch_with_backoff(
+        batch: List[str],
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        rate_limiter: RateLimiter,
+        max_retries: int,
+        initial_backoff: float,
+        max_backoff: float,
+) -> List[List[float]]:
+    """ Embeds a single batch, retrying retryable errors with jittered exponential backoff """
+    n_tokens = sum(estimate_tokens(text) for text in batch)
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire(n_tokens)
+        try:
+            vectors = embed_fn(batch)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            if isinstance(e, RateLimitError):
+                rate_limiter.penalize()
+            time.sleep(min(max_backoff, initial_backoff * 2 ** attempt) * (1 + random.random()))
+        else:
+            rate_limiter.reward()
+            return vectors
+
+
+def embed_documents_batched(
+        texts: List[str],
+        embeddings: Embeddings,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_workers: int = EMBEDDING_MAX_WORKERS,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+) -> List[List[float]]:
+    """ Embeds a list of texts by running fixed-size batches concurrently on a bounded thread pool.
+
+    Args:
+        texts (List[str]): The texts to embed.
+        embeddings (Embeddings): The embedding model to use.
+        batch_size (int, optional): The number of texts sent in each embedding request.
+        max_workers (int, optional): The maximum number of requests in flight at any time.
+        rate_limiter (RateLimiter, optional): The rate limiter shared by all batches. Defaults to the process-wide
+                                              limiter of the model and API key (see `get_rate_limiter`).
+        max_retries (int, optional): The number of times a failed batch is retried.
+        initial_backoff (float, optional): The backoff (in seconds) before the first retry.
+        max_backoff (float, optional): The upper bound on the backoff (in seconds) between retries.
+
+    Returns:
+        List[List[float]]: One vector per input text (in the same order as `texts`).
+    """
+    if not texts:
+        return []
+    rate_limiter = _get_default_rate_limiter(embeddings) if rate_limiter is None else rate_limiter
+    embed_fn = _without_client_retries(embeddings).embed_documents
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        batch_vectors = executor.map(
+            lambda batch: _embed_batch_with_backoff(
+                batch, embed_fn, rate_limiter, max_retries, initial_backoff, max_backoff
+            ),
+            batches
+        )
+        # `executor.map` yields results in submission order so the vectors line up with `texts`
+        return [vector for vectors in batch_vectors for vector in vectors]
@@ -0,0 +1,196 @@
+import math
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+from src.config.settings import (
+    ANN_MEMORY_BUDGET_BYTES, ANN_FLAT_MAX_VECTORS, ANN_TRAIN_SAMPLE_SIZE, ANN_NPROBE, ANN_EF_SEARCH
+)
+
+# Approximate per-vector overhead of the HNSW graph links (M=32 -> 2*M neighbours on level 0 at 4 bytes each)
+_HNSW_M = 32
+_HNSW_LINK_BYTES = 2 * _HNSW_M * 4
+
+# Candidate numbers of PQ sub-quantizers (the largest one that divides the dimension and fits the budget is used)
+_PQ_SUBQUANTIZERS = (192, 128, 96, 64, 48, 32, 24, 16, 8)
+
+
+def choose_index_spec(
+        n_vectors: int,
+        dim: int,
+        memory_budget_bytes: int = ANN_MEMORY_BUDGET_BYTES,
+        flat_max_vectors: int = ANN_FLAT_MAX_VECTORS,
+) -> str:
+    """ Picks a FAISS index factory string for a corpus size and memory budget
+
+    The rules (in order) are:
+        1. 'Flat' (exact search) for small corpora that fit in memory
+        2. 'HNSW32' (graph search, no training) while vectors plus graph links fit in memory
+        3. 'IVF{nlist},Flat' (inverted lists over full vectors) while the raw vectors fit in memory
+        4. 'IVF{nlist},PQ{m}' (product-quantized codes) otherwise
+
+    Args:
+        n_vectors (int): The number of vectors to index.
+        dim (int): The dimensionality of the vectors.
+        memory_budget_bytes (int, optional): The memory the index may use.
+        flat_max_vectors (int, optional): The largest corpus that is searched exactly.
+
+    Returns:
+        str: A FAISS index factory string.
+    """
+    vector_bytes = n_vectors * dim * 4
+    if n_vectors <= flat_max_vectors and vector_bytes <= memory_budget_bytes:
+        return "Flat"
+    if vector_bytes + n_vectors * _HNSW_LINK_BYTES <= memory_budget_bytes:
+        return f"HNSW{_HNSW_M}"
+
+    # ~4 * sqrt(n) lists keeps both the coarse quantizer and the lists small (each list needs ~39 training points)
+    nlist = max(16, int(min(65536, 4 * math.sqrt(n_vectors), n_vectors // 39)))
+    if vector_bytes * 1.05 <= memory_budget_bytes:
+        return f"IVF{nlist},Flat"
+
+    # PQ codes take m bytes per vector (8 bits per sub-quantizer) plus an 8 byte id in the inverted lists
+    candidates = [m for m in _PQ_SUBQUANTIZERS if dim % m == 0]
+    fitting = [m for m in candidates if n_vectors * (m + 8) <= memory_budget_bytes]
+    m = fitting[0] if fitting else (candidates[-1] if candidates else 1)
+    return f"IVF{nlist},PQ{m}"
+
+
+def build_index(vectors: np.ndarray, index_spec: str, train_sample_size: int = ANN_TRAIN_SAMPLE_SIZE):
+    """ Builds (and trains, if required) a FAISS index from a matrix of vectors
+
+    Args:
+        vectors (np.ndarray): A float32 matrix of shape (n_vectors, dim).
+        index_spec (str): A FAISS index factory string (see `choose_index_spec`).
+        train_sample_size (int, optional): The maximum number of vectors sampled to train IVF/PQ indexes.
+
+    Returns:
+        faiss.Index: The index containing every vector (in order).
+    """
+    faiss = dependable_faiss_import()
+    index = faiss.index_factory(vectors.shape[1], index_spec)
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        n_train = min(len(vectors), train_sample_size)
+        index.train(vectors[rng.choice(len(vectors), n_train, replace=False)])
+    index.add(vectors)
+    set_search_defaults(index)
+    return index
+
+
+def set_search_defaults(index, nprobe: int = ANN_NPROBE, ef_search: int = ANN_EF_SEARCH) -> None:
+    """ Raises the search knobs stored on an IVF or HNSW index to sensible defaults (in place)
+
+    FAISS defaults to nprobe=1 and efSearch=16, which gives poor recall to every search that doesn't pass its own
+    knobs (i.e. LangChain's `similarity_search`). The knobs are saved with the index, so persisted indexes keep them,
+    and values already above the defaults are kept.
+
+    Args:
+        index (faiss.Index): The index.
+        nprobe (int, optional): The number of inverted lists visited by IVF indexes (0 for sqrt(nlist)).
+        ef_search (int, optional): The size of the HNSW candidate list.
+    """
+    faiss = dependable_faiss_import()
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(ivf.nlist, max(ivf.nprobe, nprobe or round(math.sqrt(ivf.nlist))))
+        return
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        hnsw_index.hnsw.efSearch = max(hnsw_index.hnsw.efSearch, ef_search)
+
+
+def build_vectorstore(
+        docs: List[Document],
+        vectors: List[List[float]],
+        embeddings: Embeddings,
+        index_spec: str = "auto",
+        memory_budget_bytes: int = ANN_MEMORY_BUDGET_BYTES,
+) -> FAISS:
+    """ Builds a FAISS vectorstore over pre-computed vectors using an exact or approximate index
+
+    Args:
+        docs (List[Document]): The Documents (one per vector).
+        vectors (List[List[float]]): The embedding vectors of the Documents.
+        embeddings (Embeddings): The embedding model used to embed queries.
+        index_spec (str, optional): A FAISS index factory string or 'auto' (see `choose_index_spec`).
+        memory_budget_bytes (int, optional): The memory budget used when `index_spec` is 'auto'.
+
+    Returns:
+        FAISS: The vectorstore.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if index_spec == "auto":
+        index_spec = choose_index_spec(len(vectors), vectors.shape[1], memory_budget_bytes=memory_budget_bytes)
+
+    index = build_index(vectors, index_spec)
+    index_to_docstore_id = {i: str(uuid.uuid4()) for i in range(len(docs))}
+    docstore = InMemoryDocstore({index_to_docstore_id[i]: doc for i, doc in enumerate(docs)})
+    return FAISS(embeddings.embed_query, index, docstore, index_to_docstore_id)
+
+
+def get_vectorstore_embeddings(vectorstore: FAISS) -> Embeddings:
+    """ Returns the embedding model of a FAISS vectorstore (LangChain only keeps its bound `embed_query` method) """
+    embedding_function = vectorstore.embedding_function
+    if isinstance(embedding_function, Embeddings):
+        return embedding_function
+    return embedding_function.__self__
+
+
+def make_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """ Returns per-call FAISS search parameters for an index (None if no knob applies)
+
+    Args:
+        index (faiss.Index): The index that will be searched.
+        nprobe (int, optional): The number of inverted lists visited by IVF indexes (higher is slower/more accurate).
+        ef_search (int, optional): The size of the HNSW candidate list (higher is slower/more accurate).
+
+    Returns:
+        Optional[faiss.SearchParameters]: The search parameters.
+    """
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(index)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    return None
+
+
+def search_vectors(
+        vectorstore: FAISS,
+        query_vectors: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """ Searches a vectorstore's index for a matrix of query vectors (with optional nprobe/efSearch knobs)
+
+    Args:
+        vectorstore (FAISS): The vectorstore to search.
+        query_vectors (np.ndarray): A float32 matrix of shape (n_queries, dim).
+        k (int): The number of neighbours to return per query.
+        nprobe (int, optional): The number of inverted lists visited by IVF indexes.
+        ef_search (int, optional): The size of the HNSW candidate list.
+
+    Returns:
+        List[List[Tuple[Document, float]]]: The (Document, L2 distance) pairs of each query, nearest first.
+    """
+    params = make_search_params(vectorstore.index, nprobe=nprobe, ef_search=ef_search)
+    search_kwargs = {} if params is None else dict(params=params)
+    distances, positions = vectorstore.index.search(np.asarray(query_vectors, dtype=np.float32), k, **search_kwargs)
+
+    results = []
+    for query_distances, query_positions in zip(distances, positions):
+        results.append([
+            (vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]), float(distance))
+            for distance, position in zip(query_distances, query_positions) if position != -1
+        ])
+    return results
@@ -0,0 +1,190 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Union
+
+# LANGCHAIN
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+from src.config.settings import INDEX_DIR, INDEX_CACHE_MAX_INDEXES
+from src.data_manager.index_factory import set_search_defaults
+
+# The files written by `FAISS.save_local` (the layout is kept so that `FAISS.load_local` can read our indexes too)
+_INDEX_FILE, _DOCSTORE_FILE = "index.faiss", "index.pkl"
+
+# The BM25 index over the chunks (see `src.data_manager.lexical_index`)
+_LEXICAL_INDEX_FILE = "lexical.pkl"
+
+# Indexes (and docstores) loaded by this process, keyed by their directory, least recently used first (see
+# `load_vectorstore`)
+_LOADED_INDEXES: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_LOADED_INDEXES_LOCK = threading.Lock()
+
+
+def document_fingerprint(
+        doc_texts: Union[str, Iterable[str], Dict[str, Union[str, Iterable[str]]]],
+        chunk_settings: Optional[Dict[str, Any]] = None,
+        embedding_model_name: Optional[str] = None,
+) -> str:
+    """ Returns a content hash identifying the vectorstore built from a document (or documents)
+
+    Args:
+        doc_texts (Union[str, Iterable[str], Dict[str, ...]]): The document text, a list of page strings or a mapping
+                                                               from document name to either of those.
+        chunk_settings (Dict[str, Any], optional): The settings used to chunk the document (chunk size etc.)
+        embedding_model_name (str, optional): The name of the embedding model.
+
+    Returns:
+        str: A sha256 hex digest of the document contents, chunk settings and embedding model.
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps([chunk_settings or {}, embedding_model_name], sort_keys=True, default=str).encode())
+
+    def _update(text: Union[str, Iterable[str]]) -> None:
+        # Length prefixes keep ["ab", "c"] and ["a", "bc"] from colliding
+        for page in [text] if isinstance(text, str) else text:
+            page = page.encode("utf-8")
+            fingerprint.update(f"{len(page)}:".encode())
+            fingerprint.update(page)
+
+    if isinstance(doc_texts, dict):
+        for doc_name, text in doc_texts.items():
+            _update(doc_name)
+            _update(text)
+    else:
+        _update(doc_texts)
+    return fingerprint.hexdigest()
+
+
+def get_index_path(fingerprint: str, index_dir: str = INDEX_DIR) -> str:
+    """ Returns the directory in which the vectorstore with the given fingerprint is stored """
+    return os.path.join(index_dir, fingerprint)
+
+
+def save_vectorstore(vectorstore: FAISS, fingerprint: str, index_dir: str = INDEX_DIR) -> str:
+    """ Saves a FAISS vectorstore (index and docstore) to the index directory
+
+    The vectorstore is written to a temporary directory first and then renamed into place, so that concurrent readers
+    in other worker processes never observe a partially written index.
+
+    Args:
+        vectorstore (FAISS): The vectorstore to save.
+        fingerprint (str): The fingerprint of the document (see `document_fingerprint`).
+        index_dir (str, optional): The root directory of the persisted vectorstores.
+
+    Returns:
+        str: The directory the vectorstore was saved to.
+    """
+    index_path = get_index_path(fingerprint, index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f".{fingerprint}-", dir=index_dir)
+    try:
+        vectorstore.save_local(tmp_path)
+        if getattr(vectorstore, "lexical_index", None) is not None:
+            with open(os.path.join(tmp_path, _LEXICAL_INDEX_FILE), "wb") as f:
+                pickle.dump(vectorstore.lexical_index, f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # Another process saved the same fingerprint first (the contents are identical, so keep theirs)
+        if not os.path.isdir(index_path):
+            raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return index_path
+
+
+def _is_memory_mapped(index) -> bool:
+    """ Returns whether the vectors of an index were memory-mapped (FAISS silently reads some parts into memory) """
+    faiss = dependable_faiss_import()
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+    index = faiss.downcast_index(index)
+    storage = faiss.downcast_index(index.storage) if isinstance(index, faiss.IndexHNSW) else index
+    codes = getattr(storage, "codes", None)
+    return codes is not None and getattr(codes, "is_owned", True) is False
+
+
+def _read_index(index_file: str, mmap: bool):
+    """ Reads a FAISS index, memory-mapping it if the index type supports it
+
+    IVF indexes map their inverted lists (`IO_FLAG_MMAP`) while flat-code indexes (flat, HNSW) map their codes
+    (`IO_FLAG_MMAP_IFC`, FAISS >= 1.10). The flags are not interchangeable (IVF indexes fail to load with both), so
+    they are picked from the fourcc at the start of the file.
+    """
+    faiss = dependable_faiss_import()
+    if mmap:
+        with open(index_file, "rb") as f:
+            is_ivf = f.read(2) in (b"Iw", b"Iv")
+        io_flags = faiss.IO_FLAG_MMAP if is_ivf else getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        if io_flags:
+            try:
+                index = faiss.read_index(index_file, io_flags | faiss.IO_FLAG_READ_ONLY)
+                return index, _is_memory_mapped(index)
+            except RuntimeError:
+                pass
+    return faiss.read_index(index_file), False
+
+
+def load_vectorstore(
+        fingerprint: str,
+        embeddings: Embeddings,
+        index_dir: str = INDEX_DIR,
+        mmap: bool = True,
+) -> Optional[FAISS]:
+    """ Loads a persisted FAISS vectorstore (if one exists for the fingerprint)
+
+    Each index is read from disk once per process (on first use) and shared by every vectorstore returned for the same
+    fingerprint, until it is one of the least recently used indexes beyond `INDEX_CACHE_MAX_INDEXES`. With `mmap=True`
+    the index is memory-mapped read-only, so several worker processes serving the same document share one copy in the
+    OS page cache. Returned vectorstores are flagged with `shared = True` (and `memory_mapped = True` if the vectors
+    were actually mapped) and must not be mutated in place (`src.data_manager.vectorstore_ops` copies them on the first
+    write).
+
+    Args:
+        fingerprint (str): The fingerprint of the document (see `document_fingerprint`).
+        embeddings (Embeddings): The embedding model used to embed queries.
+        index_dir (str, optional): The root directory of the persisted vectorstores.
+        mmap (bool, optional): Whether to memory-map the index.
+
+    Returns:
+        Optional[FAISS]: The vectorstore, or None if it has not been persisted.
+    """
+    index_path = get_index_path(fingerprint, index_dir)
+    index_file = os.path.join(index_path, _INDEX_FILE)
+    if not os.path.isfile(index_file):
+        return None
+
+    with _LOADED_INDEXES_LOCK:
+        if index_path not in _LOADED_INDEXES:
+            index, memory_mapped = _read_index(index_file, mmap)
+            # Indexes persisted before the defaults were stored on them still have FAISS's nprobe=1/efSearch=16
+            set_search_defaults(index)
+            with open(os.path.join(index_path, _DOCSTORE_FILE), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            lexical_index = None
+            if os.path.isfile(os.path.join(index_path, _LEXICAL_INDEX_FILE)):
+                with open(os.path.join(index_path, _LEXICAL_INDEX_FILE), "rb") as f:
+                    lexical_index = pickle.load(f)
+            _LOADED_INDEXES[index_path] = dict(
+                index=index, docstore=docstore, index_to_docstore_id=index_to_docstore_id,
+                memory_mapped=memory_mapped, lexical_index=lexical_index,
+                tombstones=frozenset(_id for _id, doc in docstore._dict.items() if doc.metadata.get("deleted")),
+            )
+        _LOADED_INDEXES.move_to_end(index_path)
+        while len(_LOADED_INDEXES) > max(1, INDEX_CACHE_MAX_INDEXES):
+            _LOADED_INDEXES.popitem(last=False)
+        loaded = _LOADED_INDEXES[index_path]
+
+    vectorstore = FAISS(embeddings.embed_query, loaded["index"], loaded["docstore"], loaded["index_to_docstore_id"])
+    vectorstore.lexical_index = loaded["lexical_index"]
+    vectorstore.memory_mapped = loaded["memory_mapped"]
+    vectorstore.shared = True
+    vectorstore.tombstones = set(loaded["tombstones"])
+    return vectorstore
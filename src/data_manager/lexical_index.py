@@ -0,0 +1,130 @@
+import re
+import math
+from collections import Counter
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+
+# Words, numbers and identifiers joined by '-', '.', '/' (i.e. part numbers like 'AB-1234' or clause ids like '4.2.1')
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """ Splits text into lowercase terms (identifiers are kept whole and also split into their parts) """
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(re.split(r"[-./]", token))
+    return terms
+
+
+class BM25Index:
+    """ A compact in-memory BM25 inverted index over chunked Documents
+
+    Documents are identified by their `source` metadata key and stored under small integer ids; each term maps to a
+    postings dict of {document id: term frequency}, so a query only touches the postings of its own terms.
+
+    Args:
+        k1 (float, optional): The term frequency saturation parameter.
+        b (float, optional): The document length normalization parameter.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.docs: Dict[int, Document] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.source_to_id: Dict[str, int] = {}
+        self.total_length = 0
+        self._next_id = 0
+
+    @classmethod
+    def from_documents(cls, docs: Iterable[Document], **kwargs) -> "BM25Index":
+        """ Builds an index over a collection of Documents """
+        index = cls(**kwargs)
+        index.add_documents(docs)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add_documents(self, docs: Iterable[Document]) -> None:
+        """ Adds Documents to the index (a Document with an already indexed `source` replaces the old one) """
+        for doc in docs:
+            source = doc.metadata["source"]
+            if source in self.source_to_id:
+                self.remove([source])
+            doc_id, self._next_id = self._next_id, self._next_id + 1
+            term_frequencies = Counter(tokenize(doc.page_content))
+            for term, frequency in term_frequencies.items():
+                self.postings.setdefault(term, {})[doc_id] = frequency
+            self.docs[doc_id] = doc
+            self.doc_lengths[doc_id] = sum(term_frequencies.values())
+            self.source_to_id[source] = doc_id
+            self.total_length += self.doc_lengths[doc_id]
+
+    def remove(self, sources: Iterable[str]) -> None:
+        """ Removes Documents (by `source` key) from the index """
+        for source in sources:
+            doc_id = self.source_to_id.pop(source, None)
+            if doc_id is None:
+                continue
+            for term in set(tokenize(self.docs.pop(doc_id).page_content)):
+                postings = self.postings.get(term, {})
+                postings.pop(doc_id, None)
+                if not postings:
+                    self.postings.pop(term, None)
+            self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[Document, float]]:
+        """ Returns the top_k (Document, BM25 score) pairs for a query, highest score first """
+        if not self.docs:
+            return []
+        n_docs, avg_length = len(self.docs), self.total_length / len(self.docs) or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + length_norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.docs[doc_id], score) for doc_id, score in ranked]
+
+    def copy(self) -> "BM25Index":
+        """ Returns a copy that can be modified without affecting this index (Documents are shared) """
+        index = BM25Index(k1=self.k1, b=self.b)
+        index.postings = {term: dict(postings) for term, postings in self.postings.items()}
+        index.docs, index.doc_lengths = dict(self.docs), dict(self.doc_lengths)
+        index.source_to_id = dict(self.source_to_id)
+        index.total_length, index._next_id = self.total_length, self._next_id
+        return index
+
+
+def reciprocal_rank_fusion(
+        rankings: List[List[Document]],
+        k: int = 60,
+        key: Optional[Callable[[Document], Hashable]] = None,
+) -> List[Tuple[Document, float]]:
+    """ Fuses several rankings of Documents with reciprocal rank fusion (score = sum of 1 / (k + rank))
+
+    Args:
+        rankings (List[List[Document]]): The rankings to fuse (best first).
+        k (int, optional): The RRF smoothing constant (higher values flatten the contribution of the top ranks).
+        key (Callable, optional): Identifies the same Document across rankings. Defaults to the `source` metadata.
+
+    Returns:
+        List[Tuple[Document, float]]: The fused (Document, RRF score) pairs, highest score first.
+    """
+    key = (lambda doc: doc.metadata["source"]) if key is None else key
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            doc_key = key(doc)
+            scores[doc_key] = scores.get(doc_key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(doc_key, doc)
+    return [(docs[doc_key], score) for doc_key, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
@@ -1,9 +1,15 @@
-from typing import List, Union, Dict, Any, Tuple
+import re
+from typing import List, Optional, Union, Dict, Any, Tuple
 import streamlit as st
 
 # LANGCHAIN
 from langchain.docstore.document import Document
 
+# The inline citation format of the prompts (i.e. '<sup><b>0-1</b></sup>') and the marker of the sources section
+_CITATION_RE = re.compile(r"<sup><b>\s*([^<]+?)\s*</b></sup>")
+_CITATION_START = "<sup>"
+_SOURCES_MARKER = "SOURCES: "
+
 
 def wrap_text_in_html(text: Union[str, List[str]]) -> str:
     """ Wraps each text block separated by newlines in <p> tags so that it can be displayed in Streamlit.
@@ -47,7 +53,7 @@ def split_raw_llm_response(
         response_split = raw_response.split("SOURCES: ")
         llm_response, sources = response_split[0], "".join(response_split[1:])
 
-    source_keys = [x.strip() for x in sources.split(",")]
+    source_keys = {x.strip() for x in sources.split(",")}
     referenced_sources = [doc for doc in top_k_sources if doc.metadata["source"] in source_keys]
 
     if return_llm_response:
@@ -55,3 +61,83 @@ def split_raw_llm_response(
     else:
         return referenced_sources
 
+
+
+class StreamingCitationParser:
+    """ Finds the sources a completion cites while it is being generated
+
+    Feed the streamed text as it arrives. Each source key is reported once, the first time it is cited (inline as
+    `<sup><b>key</b></sup>` or in the trailing 'SOURCES: key, key' section), and resolved to its Document through a
+    dict index of the sources given to the model (keys of other sources are ignored).
+
+    Usage:
+        parser = StreamingCitationParser(sources)
+        for token in stream:
+            for event in parser.feed(token):
+                ...  # event = {'source': key, 'document': Document, 'inline': bool}
+        events = parser.close()
+
+    Args:
+        sources (List[Document]): The Documents given to the model (with a 'source' key in their metadata).
+    """
+    def __init__(self, sources: List[Document]):
+        self.sources_by_key = {doc.metadata["source"]: doc for doc in sources}
+        self.text = ""
+        self.referenced: Dict[str, Document] = {}
+        self._scan_from = 0
+        self._sources_start: Optional[int] = None
+        self._n_section_keys = 0
+
+    @property
+    def answer(self) -> str:
+        """ The text before the sources section """
+        return self.text if self._sources_start is None else self.text[:self._sources_start - len(_SOURCES_MARKER)]
+
+    @property
+    def referenced_sources(self) -> List[Document]:
+        """ The cited Documents in the order they were first cited """
+        return list(self.referenced.values())
+
+    def _reference(self, key: str, inline: bool) -> List[Dict[str, Any]]:
+        document = self.sources_by_key.get(key)
+        if document is None or key in self.referenced:
+            return []
+        self.referenced[key] = document
+        return [dict(source=key, document=document, inline=inline)]
+
+    def _scan_section(self, final: bool) -> List[Dict[str, Any]]:
+        # A key is complete once it is followed by a comma (or the completion ends)
+        keys = self.text[self._sources_start:].split(",")
+        complete_keys = keys if final else keys[:-1]
+        events = []
+        for key in complete_keys[self._n_section_keys:]:
+            events += self._reference(key.strip(), inline=False)
+        self._n_section_keys = len(complete_keys)
+        return events
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """ Adds streamed text and returns the events of the sources it cites for the first time """
+        self.text += text
+        events = []
+        if self._sources_start is None:
+            end = self.text.find(_SOURCES_MARKER, max(0, self._scan_from - len(_SOURCES_MARKER)))
+            answer_end = len(self.text) if end == -1 else end
+            for match in _CITATION_RE.finditer(self.text, self._scan_from, answer_end):
+                events += self._reference(match.group(1), inline=True)
+                self._scan_from = match.end()
+
+            if end != -1:
+                self._sources_start = end + len(_SOURCES_MARKER)
+            else:
+                # Rescan an unfinished citation (or marker) at the end of the text once more text arrives
+                unfinished = self.text.rfind(_CITATION_START, self._scan_from)
+                tail = len(self.text) - len(_SOURCES_MARKER) + 1
+                self._scan_from = max(self._scan_from, min(tail, unfinished) if unfinished != -1 else tail)
+                return events
+        return events + self._scan_section(final=False)
+
+    def close(self) -> List[Dict[str, Any]]:
+        """ Ends the completion and returns the events of the sources cited by its last key """
+        if self._sources_start is None:
+            return []
+        return self._scan_section(final=True)
@@ -0,0 +1,50 @@
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+
+@contextmanager
+def connect_sqlite(db_path: str, timeout: float = 30) -> Iterator[sqlite3.Connection]:
+    """ Opens a connection that is committed (or rolled back) and closed on exit
+
+    `with sqlite3.connect(...)` alone only commits, the connection stays open until it is garbage collected.
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def create_lru_table(db_path: str, table: str, value_column: str) -> None:
+    """ Creates a size-bounded LRU table (key, value blob, size in bytes, last access time) in WAL mode
+
+    Every process that opens the same database shares the table (WAL mode keeps readers from being blocked by writers).
+
+    Args:
+        db_path (str): The path of the SQLite database.
+        table (str): The name of the table.
+        value_column (str): The name of the blob column holding the values.
+    """
+    with connect_sqlite(db_path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"key TEXT PRIMARY KEY, {value_column} BLOB NOT NULL, n_bytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+
+
+def evict_lru(conn: sqlite3.Connection, table: str, max_bytes: int) -> None:
+    """ Deletes the least recently used entries of a table (see `create_lru_table`) until it fits within `max_bytes` """
+    total_bytes = conn.execute(f"SELECT COALESCE(SUM(n_bytes), 0) FROM {table}").fetchone()[0]
+    if total_bytes <= max_bytes:
+        return
+    to_free, evicted = total_bytes - max_bytes, []
+    for key, n_bytes in conn.execute(f"SELECT key, n_bytes FROM {table} ORDER BY last_access ASC").fetchall():
+        evicted.append((key,))
+        to_free -= n_bytes
+        if to_free <= 0:
+            break
+    conn.executemany(f"DELETE FROM {table} WHERE key = ?", evicted)
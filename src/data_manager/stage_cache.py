@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+# LANGCHAIN
+from langchain.vectorstores.base import VectorStore
+
+from src.config.settings import STAGE_CACHE_BACKEND, STAGE_CACHE_DIR, STAGE_CACHE_MAX_BYTES
+from src.data_manager.sqlite_lru import connect_sqlite, create_lru_table, evict_lru
+from src.monitoring.metrics import get_metrics_registry
+
+# Returned by `CacheBackend.get` on a miss (None is a valid cached value)
+MISSING = object()
+
+
+class CacheBackend(ABC):
+    """ The interface of the stage cache backends (values are any picklable object, keys are strings) """
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        """ Returns the cached value for a key (or `MISSING`) """
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """ Stores a value (evicting the least recently used entries if the cache is too large) """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """ Removes a key from the cache """
+
+    @abstractmethod
+    def clear(self) -> None:
+        """ Removes every entry from the cache """
+
+
+class NullCacheBackend(CacheBackend):
+    """ A backend that caches nothing (every stage is recomputed) """
+    def get(self, key: str) -> Any:
+        return MISSING
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """ A per-process LRU cache bounded by the pickled size of its values
+
+    Args:
+        max_bytes (int, optional): The maximum number of (pickled) value bytes to keep.
+    """
+    def __init__(self, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return MISSING
+            self._entries.move_to_end(key)
+            return pickle.loads(self._entries[key])
+
+    def set(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value)
+        with self._lock:
+            self._n_bytes -= len(self._entries.pop(key, b""))
+            self._entries[key] = blob
+            self._n_bytes += len(blob)
+            while self._n_bytes > self.max_bytes and self._entries:
+                self._n_bytes -= len(self._entries.popitem(last=False)[1])
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._n_bytes -= len(self._entries.pop(key, b""))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """ A local-disk cache in a SQLite database with size-bounded LRU eviction
+
+    Every process that opens the same `cache_dir` shares the cache (the database runs in WAL mode so readers are not
+    blocked by writers), so replicas/worker processes on one host only compute each stage once.
+
+    Args:
+        cache_dir (str, optional): The directory in which the SQLite database is stored.
+        max_bytes (int, optional): The maximum number of (pickled) value bytes to keep.
+    """
+    def __init__(self, cache_dir: str = STAGE_CACHE_DIR, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "stages.sqlite3")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        create_lru_table(self.db_path, "stages", "value")
+
+    def get(self, key: str) -> Any:
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            row = conn.execute("SELECT value FROM stages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return MISSING
+            conn.execute("UPDATE stages SET last_access = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value)
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stages (key, value, n_bytes, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time())
+            )
+            evict_lru(conn, "stages", self.max_bytes)
+
+    def delete(self, key: str) -> None:
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            conn.execute("DELETE FROM stages WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, connect_sqlite(self.db_path) as conn:
+            conn.execute("DELETE FROM stages")
+
+
+_BACKENDS = {
+    "sqlite": SQLiteCacheBackend,
+    "memory": MemoryCacheBackend,
+    "none": NullCacheBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_stage_cache(backend: str = STAGE_CACHE_BACKEND) -> CacheBackend:
+    """ Returns the process-wide stage cache for a backend name ['sqlite' | 'memory' | 'none'] """
+    if backend not in _BACKENDS:
+        raise ValueError(f"Invalid stage cache backend: {backend}")
+    return _BACKENDS[backend]()
+
+
+def make_stage_key(stage: str, **key_parts) -> str:
+    """ Returns the cache key of a stage for explicit key parts (document fingerprint, query, model parameters, etc.)
+
+    Args:
+        stage (str): The name of the stage (i.e. 'parse_upload').
+        **key_parts: JSON serializable values that determine the output of the stage.
+
+    Returns:
+        str: The stage name followed by a sha256 hex digest of the key parts.
+    """
+    payload = json.dumps(key_parts, sort_keys=True, default=str)
+    return f"{stage}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def get_vectorstore_key(vectorstore: VectorStore) -> Optional[str]:
+    """ Returns a key identifying the contents of a vectorstore across processes (None if it has no fingerprint)
+
+    The key is the document fingerprint (see `src.data_manager.index_store`), which the incremental updates of
+    `src.data_manager.vectorstore_ops` replace with a hash of the chunks the vectorstore holds after the update.
+    """
+    return getattr(vectorstore, "fingerprint", None)
+
+
+def cached_stage(key: Optional[str], compute_fn: Callable[[], Any], cache: Optional[CacheBackend] = None) -> Any:
+    """ Returns the cached output of a stage, computing (and caching) it on a miss
+
+    Hits and misses are counted per stage (the prefix of the key) as `stage_cache_requests_total` in the metrics
+    registry (see `src.monitoring.metrics`).
+
+    Args:
+        key (str, optional): The stage key (see `make_stage_key`). None disables caching for this call.
+        compute_fn (Callable): Computes the output of the stage.
+        cache (CacheBackend, optional): The cache to use. Defaults to the process-wide stage cache.
+
+    Returns:
+        Any: The output of the stage.
+    """
+    if key is None:
+        return compute_fn()
+    cache = get_stage_cache() if cache is None else cache
+    value = cache.get(key)
+    get_metrics_registry().inc(
+        "stage_cache_requests_total", stage=key.split(":", 1)[0], result="miss" if value is MISSING else "hit"
+    )
+    if value is MISSING:
+        value = compute_fn()
+        cache.set(key, value)
+    return value
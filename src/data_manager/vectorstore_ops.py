@@ -0,0 +1,264 @@
+import json
+import hashlib
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+from src.config.settings import CHUNK_SIZE, CHUNK_TOKENIZER
+from src.data_manager.chunking import resolve_tokenizer
+from src.data_manager.data_loader import embed_chunks, iter_text_to_docs
+from src.data_manager.index_factory import get_vectorstore_embeddings
+
+
+def chunk_hash(text: str) -> str:
+    """ Returns the content hash of a chunk of text """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _make_writable(vectorstore: FAISS) -> None:
+    """ Gives a shared (possibly memory-mapped) vectorstore its own private copy of the index and docstore
+
+    Vectorstores loaded by `src.data_manager.index_store` share their index and docstore with every other session in
+    the process (and a memory-mapped index cannot be written to at all), so they are copied before the first write.
+    """
+    if not getattr(vectorstore, "shared", False):
+        return
+    faiss = dependable_faiss_import()
+    vectorstore.index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+    vectorstore.docstore = InMemoryDocstore(dict(vectorstore.docstore._dict))
+    vectorstore.index_to_docstore_id = dict(vectorstore.index_to_docstore_id)
+    if getattr(vectorstore, "lexical_index", None) is not None:
+        vectorstore.lexical_index = vectorstore.lexical_index.copy()
+    vectorstore.memory_mapped = vectorstore.shared = False
+
+
+def content_hash(vectorstore: FAISS) -> str:
+    """ Returns a hash of the live chunks of a vectorstore (their `source` keys and text, not their docstore ids) """
+    chunks = sorted(
+        (doc.metadata.get("source", ""), chunk_hash(doc.page_content)) for doc in get_live_docs(vectorstore).values()
+    )
+    return hashlib.sha256(json.dumps(chunks).encode("utf-8")).hexdigest()
+
+
+def _refresh_fingerprint(vectorstore: FAISS) -> None:
+    """ Re-keys a changed vectorstore on its contents
+
+    The document fingerprint identifies the documents the vectorstore was built from (and their persisted index), so
+    once chunks are added or deleted it is replaced with a hash of that original fingerprint and the live chunks. Caches
+    keyed on the fingerprint (see `get_vectorstore_key` and `src.model_manager.answer_cache`) then never mix up the
+    original and the changed vectorstore, while every session (or process) that makes the same change shares them.
+    Vectorstores without a fingerprint (i.e. built from a stream of pages) are left without one.
+    """
+    base_fingerprint = getattr(vectorstore, "base_fingerprint", None) or getattr(vectorstore, "fingerprint", None)
+    if base_fingerprint is None:
+        return
+    vectorstore.base_fingerprint = base_fingerprint
+    payload = f"{base_fingerprint}:{content_hash(vectorstore)}"
+    vectorstore.fingerprint = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_live_docs(vectorstore: FAISS) -> Dict[str, Document]:
+    """ Returns every Document in the vectorstore that has not been tombstoned (keyed by docstore id) """
+    tombstones = getattr(vectorstore, "tombstones", set())
+    return {
+        _id: vectorstore.docstore._dict[_id]
+        for _id in vectorstore.index_to_docstore_id.values() if _id not in tombstones
+    }
+
+
+def add_documents(
+        vectorstore: FAISS,
+        docs: List[Document],
+        chunk_settings: Optional[Dict] = None,
+        **embed_kwargs,
+) -> List[str]:
+    """ Embeds (already chunked) Documents and adds them to an existing vectorstore
+
+    Args:
+        vectorstore (FAISS): The vectorstore to add to (modified in place).
+        docs (List[Document]): The Documents to add.
+        chunk_settings (Dict, optional): The settings used to chunk the Documents (part of the embedding cache key).
+        **embed_kwargs: Additional kwargs for `embed_chunks` (use_cache, batch_size, max_workers, etc.)
+
+    Returns:
+        List[str]: The docstore ids of the added Documents.
+    """
+    if not docs:
+        return []
+    _make_writable(vectorstore)
+    texts = [doc.page_content for doc in docs]
+    vectors = embed_chunks(
+        texts, get_vectorstore_embeddings(vectorstore), chunk_settings=chunk_settings, **embed_kwargs
+    )
+    ids = vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=[doc.metadata for doc in docs])
+    if getattr(vectorstore, "lexical_index", None) is not None:
+        vectorstore.lexical_index.add_documents(vectorstore.docstore.search(_id) for _id in ids)
+    _refresh_fingerprint(vectorstore)
+    return ids
+
+
+def add_pages(
+        vectorstore: FAISS,
+        pages: Iterable[str],
+        doc_name: Optional[str] = None,
+        first_page: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+        **embed_kwargs,
+) -> List[str]:
+    """ Chunks, embeds and adds new pages of a document to an existing vectorstore
+
+    Args:
+        vectorstore (FAISS): The vectorstore to add to (modified in place).
+        pages (Iterable[str]): The text of the new pages.
+        doc_name (str, optional): The name of the document the pages belong to (see `iter_text_to_docs`).
+        first_page (int, optional): The page number of the first new page.
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (None for characters).
+        **embed_kwargs: Additional kwargs for `embed_chunks` (use_cache, batch_size, max_workers, etc.)
+
+    Returns:
+        List[str]: The docstore ids of the added chunks.
+    """
+    tokenizer = resolve_tokenizer(tokenizer)
+    docs = list(iter_text_to_docs(
+        pages, chunk_size=chunk_size, chunk_overlap=chunk_overlap, doc_name=doc_name, first_page=first_page,
+        tokenizer=tokenizer
+    ))
+    chunk_settings = dict(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=tokenizer)
+    return add_documents(vectorstore, docs, chunk_settings=chunk_settings, **embed_kwargs)
+
+
+def delete_documents(vectorstore: FAISS, ids: Iterable[str], tombstone: bool = False) -> List[str]:
+    """ Deletes Documents (by docstore id) from a vectorstore
+
+    Flat indexes support removing vectors, in which case the vectors are removed and the positions of the remaining
+    vectors are compacted. Other index types (or `tombstone=True`) keep the vectors but flag the Documents with
+    `deleted` metadata and add their ids to `vectorstore.tombstones`, which `search_docs` filters out. Deleted
+    Documents are always removed from the vectorstore's `lexical_index`.
+
+    Args:
+        vectorstore (FAISS): The vectorstore to delete from (modified in place).
+        ids (Iterable[str]): The docstore ids of the Documents to delete.
+        tombstone (bool, optional): Whether to tombstone the Documents even if the vectors could be removed.
+
+    Returns:
+        List[str]: The docstore ids that were deleted.
+    """
+    ids = set(ids).intersection(get_live_docs(vectorstore))
+    if not ids:
+        return []
+    _make_writable(vectorstore)
+    faiss = dependable_faiss_import()
+
+    # Deleted chunks are always removed from the lexical index (it supports removal for every index type)
+    if getattr(vectorstore, "lexical_index", None) is not None:
+        vectorstore.lexical_index.remove(vectorstore.docstore.search(_id).metadata["source"] for _id in ids)
+
+    if not tombstone and isinstance(vectorstore.index, faiss.IndexFlat):
+        positions = [i for i, _id in vectorstore.index_to_docstore_id.items() if _id in ids]
+        vectorstore.index.remove_ids(np.array(positions, dtype=np.int64))
+
+        # Removing vectors from a flat index shifts the remaining vectors down, so the mapping is rebuilt in order
+        remaining = [_id for _, _id in sorted(vectorstore.index_to_docstore_id.items()) if _id not in ids]
+        vectorstore.index_to_docstore_id = dict(enumerate(remaining))
+        for _id in ids:
+            vectorstore.docstore._dict.pop(_id, None)
+    else:
+        tombstones: Set[str] = getattr(vectorstore, "tombstones", set())
+        for _id in ids:
+            doc = vectorstore.docstore._dict[_id]
+            vectorstore.docstore._dict[_id] = Document(
+                page_content=doc.page_content, metadata={**doc.metadata, "deleted": True}
+            )
+        vectorstore.tombstones = tombstones | ids
+    _refresh_fingerprint(vectorstore)
+    return list(ids)
+
+
+def delete_by_source(
+        vectorstore: FAISS,
+        sources: Iterable[str] = (),
+        document: Optional[str] = None,
+        tombstone: bool = False,
+) -> List[str]:
+    """ Deletes chunks from a vectorstore by their `source` key and/or the document they belong to
+
+    Args:
+        vectorstore (FAISS): The vectorstore to delete from (modified in place).
+        sources (Iterable[str], optional): The `source` keys of the chunks to delete (i.e. ['3-1', '3-2']).
+        document (str, optional): The name of a document whose chunks are all deleted.
+        tombstone (bool, optional): Whether to tombstone the chunks instead of removing the vectors.
+
+    Returns:
+        List[str]: The docstore ids that were deleted.
+    """
+    sources = set(sources)
+    ids = [
+        _id for _id, doc in get_live_docs(vectorstore).items()
+        if doc.metadata.get("source") in sources or (document is not None and doc.metadata.get("document") == document)
+    ]
+    return delete_documents(vectorstore, ids, tombstone=tombstone)
+
+
+def update_document(
+        vectorstore: FAISS,
+        doc_text: Iterable[str],
+        doc_name: Optional[str] = None,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+        tombstone: bool = False,
+        **embed_kwargs,
+) -> Dict[str, List[str]]:
+    """ Updates a vectorstore to a new revision of a document, re-embedding only the chunks that changed
+
+    The new revision is chunked and each chunk is compared (by `source` key and content hash) with the chunks of the
+    same document already in the vectorstore. Unchanged chunks are kept as is, changed and new chunks are embedded and
+    added, and chunks that changed or no longer exist are deleted.
+
+    Args:
+        vectorstore (FAISS): The vectorstore to update (modified in place).
+        doc_text (Iterable[str]): The new revision of the document (a string or a list of page strings).
+        doc_name (str, optional): The name of the document (None for a single, unnamed document).
+        chunk_size (int, optional): The size of each chunk (must match the settings the document was indexed with).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (None for characters).
+        tombstone (bool, optional): Whether to tombstone deleted chunks instead of removing the vectors.
+        **embed_kwargs: Additional kwargs for `embed_chunks` (use_cache, batch_size, max_workers, etc.)
+
+    Returns:
+        Dict[str, List[str]]: The `source` keys that were 'added', 'deleted' and 'unchanged'.
+    """
+    tokenizer = resolve_tokenizer(tokenizer)
+    new_docs = {
+        doc.metadata["source"]: doc
+        for doc in iter_text_to_docs(
+            doc_text, chunk_size=chunk_size, chunk_overlap=chunk_overlap, doc_name=doc_name, tokenizer=tokenizer
+        )
+    }
+    old_docs = {
+        doc.metadata["source"]: (_id, doc)
+        for _id, doc in get_live_docs(vectorstore).items() if doc.metadata.get("document") == doc_name
+    }
+
+    unchanged = {
+        source for source, doc in new_docs.items()
+        if source in old_docs and chunk_hash(old_docs[source][1].page_content) == chunk_hash(doc.page_content)
+    }
+    added = [source for source in new_docs if source not in unchanged]
+    deleted = [source for source in old_docs if source not in unchanged]
+
+    delete_documents(vectorstore, [old_docs[source][0] for source in deleted], tombstone=tombstone)
+    add_documents(
+        vectorstore, [new_docs[source] for source in added],
+        chunk_settings=dict(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=tokenizer), **embed_kwargs
+    )
+    return dict(added=added, deleted=deleted, unchanged=[source for source in new_docs if source in unchanged])
@@ -1 +1,208 @@
-# TBD
\ No newline at end of file
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# LANGCHAIN
+from langchain.base_language import BaseLanguageModel
+from langchain.docstore.document import Document
+from langchain.prompts import PromptTemplate
+
+from src.config.settings import QA_MAP_MAX_CONCURRENCY
+from src.model_manager.concurrency import get_llm_limiter
+from src.prompts import IR_PROMPTS
+
+# Returned by the map prompt for excerpts that are irrelevant to the question
+_NO_RELEVANT_TEXT = "NO RELEVANT TEXT"
+
+_SCORE_RE = re.compile(r"\s*SCORE:\s*(\d+(?:\.\d+)?)\s*$", re.IGNORECASE)
+
+
+def format_sources(docs: List[Document]) -> str:
+    """ Formats Documents like the 'stuff' chain does (one 'Content: ...' / 'Source: ...' pair per Document) """
+    return "\n\n".join(f"Content: {doc.page_content}\nSource: {doc.metadata['source']}" for doc in docs)
+
+
+def without_streaming(llm: BaseLanguageModel) -> BaseLanguageModel:
+    """ Returns a copy of the model that doesn't stream (concurrent map calls would interleave their tokens) """
+    if not getattr(llm, "streaming", False):
+        return llm
+    # `BaseModel.copy(update=...)` drops unset fields like `tags`, so the copy is constructed from every field
+    return type(llm).construct(**dict(llm.__dict__, streaming=False, callbacks=None))
+
+
+def map_llm(
+        llm: BaseLanguageModel,
+        prompt: PromptTemplate,
+        docs: List[Document],
+        question: str,
+        max_concurrency: int = QA_MAP_MAX_CONCURRENCY,
+) -> List[str]:
+    """ Runs a prompt over every Document concurrently (at most `max_concurrency` calls in flight)
+
+    Args:
+        llm (BaseLanguageModel): The model to call.
+        prompt (PromptTemplate): A prompt with 'context' and 'question' input variables.
+        docs (List[Document]): The Documents (one call each).
+        question (str): The question.
+        max_concurrency (int, optional): The maximum number of concurrent model calls.
+
+    Returns:
+        List[str]: One model output per Document (in order).
+    """
+    map_model = without_streaming(llm)
+
+    def _map(doc: Document) -> str:
+        with get_llm_limiter():
+            return map_model.predict(prompt.format(context=doc.page_content, question=question))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(docs)))) as executor:
+        return list(executor.map(_map, docs))
+
+
+async def amap_llm(
+        llm: BaseLanguageModel,
+        prompt: PromptTemplate,
+        docs: List[Document],
+        question: str,
+        max_concurrency: int = QA_MAP_MAX_CONCURRENCY,
+) -> List[str]:
+    """ The async version of `map_llm` (the calls run concurrently on the event loop) """
+    map_model, semaphore = without_streaming(llm), asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _map(doc: Document) -> str:
+        async with semaphore, get_llm_limiter():
+            return await map_model.apredict(prompt.format(context=doc.page_content, question=question))
+    return list(await asyncio.gather(*[_map(doc) for doc in docs]))
+
+
+def format_reduce_prompt(
+        docs: List[Document],
+        extracts: List[str],
+        question: str,
+        reduce_prompt: PromptTemplate,
+) -> str:
+    """ Formats the reduce step of `map_reduce_qa` with the relevant extracts of the map step """
+    relevant = [
+        Document(page_content=extract.strip(), metadata=doc.metadata)
+        for doc, extract in zip(docs, extracts)
+        if extract.strip() and _NO_RELEVANT_TEXT not in extract.upper()
+    ]
+    return reduce_prompt.format(summaries=format_sources(relevant), question=question)
+
+
+def map_reduce_qa(
+        llm: BaseLanguageModel,
+        docs: List[Document],
+        question: str,
+        max_concurrency: int = QA_MAP_MAX_CONCURRENCY,
+        map_prompt: Optional[PromptTemplate] = None,
+        reduce_prompt: Optional[PromptTemplate] = None,
+) -> Dict[str, Any]:
+    """ Answers a question over many Documents with a concurrent map step and a single reduce step
+
+    Each Document is condensed to the text relevant to the question (the map calls run concurrently) and the relevant
+    extracts are answered in one call with the 'stuff' format, so the latency is roughly one map call plus one reduce
+    call regardless of the number of Documents.
+
+    Args:
+        llm (BaseLanguageModel): The model to call (the reduce call streams if the model streams).
+        docs (List[Document]): The Documents to answer from.
+        question (str): The question.
+        max_concurrency (int, optional): The maximum number of concurrent map calls.
+        map_prompt (PromptTemplate, optional): The map prompt. Defaults to `IR_PROMPTS['map_reduce']['map']`.
+        reduce_prompt (PromptTemplate, optional): The reduce prompt. Defaults to `IR_PROMPTS['map_reduce']['reduce']`.
+
+    Returns:
+        Dict[str, Any]: The 'output_text' (answer and SOURCES) and the map 'intermediate_steps'.
+    """
+    map_prompt = map_prompt or IR_PROMPTS["map_reduce"]["map"]
+    reduce_prompt = reduce_prompt or IR_PROMPTS["map_reduce"]["reduce"]
+    extracts = map_llm(llm, map_prompt, docs, question, max_concurrency=max_concurrency)
+    with get_llm_limiter():
+        output_text = llm.predict(format_reduce_prompt(docs, extracts, question, reduce_prompt))
+    return {"output_text": output_text, "intermediate_steps": extracts}
+
+
+async def amap_reduce_qa(
+        llm: BaseLanguageModel,
+        docs: List[Document],
+        question: str,
+        max_concurrency: int = QA_MAP_MAX_CONCURRENCY,
+        map_prompt: Optional[PromptTemplate] = None,
+        reduce_prompt: Optional[PromptTemplate] = None,
+) -> Dict[str, Any]:
+    """ The async version of `map_reduce_qa` """
+    map_prompt = map_prompt or IR_PROMPTS["map_reduce"]["map"]
+    reduce_prompt = reduce_prompt or IR_PROMPTS["map_reduce"]["reduce"]
+    extracts = await amap_llm(llm, map_prompt, docs, question, max_concurrency=max_concurrency)
+    async with get_llm_limiter():
+        output_text = await llm.apredict(format_reduce_prompt(docs, extracts, question, reduce_prompt))
+    return {"output_text": output_text, "intermediate_steps": extracts}
+
+
+def parse_scored_answer(output: str) -> Tuple[str, float]:
+    """ Splits a map-rerank output into the answer and its score (0 if the score is missing) """
+    match = _SCORE_RE.search(output)
+    if match is None:
+        return output.strip(), 0.0
+    return output[:match.start()].strip(), float(match.group(1))
+
+
+def rerank_answers(docs: List[Document], outputs: List[str]) -> Dict[str, Any]:
+    """ Picks the best scoring answer of the map step (the rerank step of `map_rerank_qa`) """
+    scored = [(*parse_scored_answer(output), doc) for doc, output in zip(docs, outputs)]
+    if not scored:
+        return {"output_text": "I don't know.\nSOURCES: ", "intermediate_steps": []}
+    answer, score, doc = max(scored, key=lambda item: item[1])
+    source = doc.metadata["source"] if score > 0 else ""
+    intermediate_steps = [dict(answer=a, score=s, source=d.metadata["source"]) for a, s, d in scored]
+    return {"output_text": f"{answer}\nSOURCES: {source}", "intermediate_steps": intermediate_steps}
+
+
+def map_rerank_qa(
+        llm: BaseLanguageModel,
+        docs: List[Document],
+        question: str,
+        max_concurrency: int = QA_MAP_MAX_CONCURRENCY,
+        rerank_prompt: Optional[PromptTemplate] = None,
+) -> Dict[str, Any]:
+    """ Answers a question from each Document separately (concurrently) and keeps the best scoring answer
+
+    Args:
+        llm (BaseLanguageModel): The model to call.
+        docs (List[Document]): The Documents to answer from.
+        question (str): The question.
+        max_concurrency (int, optional): The maximum number of concurrent calls.
+        rerank_prompt (PromptTemplate, optional): The prompt. Defaults to `IR_PROMPTS['map_rerank']['map']`.
+
+    Returns:
+        Dict[str, Any]: The 'output_text' (best answer and its SOURCES) and the scored 'intermediate_steps'.
+    """
+    rerank_prompt = rerank_prompt or IR_PROMPTS["map_rerank"]["map"]
+    outputs = map_llm(llm, rerank_prompt, docs, question, max_concurrency=max_concurrency)
+    return rerank_answers(docs, outputs)
+
+
+async def amap_rerank_qa(
+        llm: BaseLanguageModel,
+        docs: List[Document],
+        question: str,
+        max_concurrency: int = QA_MAP_MAX_CONCURRENCY,
+        rerank_prompt: Optional[PromptTemplate] = None,
+) -> Dict[str, Any]:
+    """ The async version of `map_rerank_qa` """
+    rerank_prompt = rerank_prompt or IR_PROMPTS["map_rerank"]["map"]
+    outputs = await amap_llm(llm, rerank_prompt, docs, question, max_concurrency=max_concurrency)
+    return rerank_answers(docs, outputs)
+
+
+QA_CHAINS = {
+    "map_reduce": map_reduce_qa,
+    "map_rerank": map_rerank_qa,
+}
+
+ASYNC_QA_CHAINS = {
+    "map_reduce": amap_reduce_qa,
+    "map_rerank": amap_rerank_qa,
+}
@@ -0,0 +1,202 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+from langchain.vectorstores.faiss import FAISS
+
+from src.config.settings import (
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_ENTRIES,
+)
+
+
+class SemanticAnswerCache:
+    """ An in-memory cache of LLM answers that also matches paraphrased (near-duplicate) questions
+
+    Each entry stores the (unit normalized) embedding of a question together with the answer and the sources it was
+    answered from. A lookup returns the entry of the most similar previously answered question in the same namespace
+    (the document and model parameters, see `get_answer_namespace`) if its cosine similarity is at least
+    `similarity_threshold`. Entries expire after `ttl_seconds` and the least recently used entries are evicted once
+    the cache holds more than `max_entries`.
+
+    Args:
+        similarity_threshold (float, optional): The minimum cosine similarity for two questions to share an answer.
+        ttl_seconds (float, optional): The time after which an entry expires (0 disables expiry).
+        max_entries (int, optional): The maximum number of entries kept (across every namespace).
+    """
+    def __init__(
+            self,
+            similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+            max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._namespaces: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._lru: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, expirations=0, evictions=0)
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _remove(self, namespace: str, entry_id: int) -> None:
+        entries = self._namespaces[namespace]
+        del entries[entry_id]
+        if not entries:
+            del self._namespaces[namespace]
+        self._lru.pop((namespace, entry_id), None)
+
+    def _expire(self, namespace: str, now: float) -> None:
+        """ Removes the expired entries of a namespace """
+        if not self.ttl_seconds:
+            return
+        expired = [
+            entry_id for entry_id, entry in self._namespaces.get(namespace, {}).items()
+            if now - entry["created_at"] > self.ttl_seconds
+        ]
+        for entry_id in expired:
+            self._remove(namespace, entry_id)
+        self._stats["expirations"] += len(expired)
+
+    def lookup(self, namespace: str, question_vector: List[float]) -> Optional[Dict[str, Any]]:
+        """ Returns the cached entry of the most similar previously answered question (None on a miss)
+
+        Args:
+            namespace (str): The namespace to search (see `get_answer_namespace`).
+            question_vector (List[float]): The embedding of the question.
+
+        Returns:
+            Optional[Dict[str, Any]]: The entry ('question', 'answer', 'sources', 'similarity', ...) or None.
+        """
+        question_vector = self._normalize(question_vector)
+        with self._lock:
+            self._expire(namespace, time.time())
+            entries = self._namespaces.get(namespace)
+            if entries:
+                entry_ids = list(entries)
+                similarities = np.stack([entries[entry_id]["vector"] for entry_id in entry_ids]) @ question_vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self._stats["hits"] += 1
+                    self._lru.move_to_end((namespace, entry_ids[best]))
+                    return dict(entries[entry_ids[best]], similarity=float(similarities[best]))
+            self._stats["misses"] += 1
+            return None
+
+    def store(
+            self,
+            namespace: str,
+            question: str,
+            question_vector: List[float],
+            answer: Any,
+            sources: List[Document],
+    ) -> None:
+        """ Adds an answered question to the cache (evicting the least recently used entries if it is full)
+
+        Args:
+            namespace (str): The namespace the question was answered in (see `get_answer_namespace`).
+            question (str): The question text.
+            question_vector (List[float]): The embedding of the question.
+            answer (Any): The answer (i.e. the raw LLM response text).
+            sources (List[Document]): The Documents the answer was generated from.
+        """
+        with self._lock:
+            entry_id, self._next_id = self._next_id, self._next_id + 1
+            self._namespaces.setdefault(namespace, {})[entry_id] = dict(
+                question=question, vector=self._normalize(question_vector), answer=answer, sources=list(sources),
+                created_at=time.time(),
+            )
+            self._lru[(namespace, entry_id)] = None
+            while len(self._lru) > self.max_entries:
+                self._remove(*next(iter(self._lru)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """ Returns the hit/miss/expiration/eviction counters, the number of entries and the hit rate """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats, entries=len(self._lru), hit_rate=self._stats["hits"] / lookups if lookups else 0.0)
+
+    def clear(self) -> None:
+        """ Removes every entry from the cache (the counters are kept) """
+        with self._lock:
+            self._namespaces.clear()
+            self._lru.clear()
+
+
+@lru_cache(maxsize=None)
+def get_answer_cache() -> SemanticAnswerCache:
+    """ Returns the process-wide answer cache """
+    return SemanticAnswerCache()
+
+
+def get_answer_namespace(vectorstore: FAISS, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """ Returns the answer cache namespace for a vectorstore and the parameters that change the answer
+
+    The namespace combines the document fingerprint (replaced by a hash of the chunks after every incremental update in
+    `src.data_manager.vectorstore_ops`) and the model/retrieval parameters (model name, temperature, top k, etc.), so
+    answers are never shared across documents or settings. Vectorstores without a fingerprint (i.e. built from a stream
+    of pages) can't be identified by their contents, so they have no namespace (None) and are not cached.
+    """
+    fingerprint = getattr(vectorstore, "fingerprint", None)
+    if fingerprint is None:
+        return None
+    payload = json.dumps([fingerprint, params or {}], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def answer_with_cache(
+        vectorstore: FAISS,
+        query_text: str,
+        retrieve_fn: Callable[[], List[Document]],
+        answer_fn: Callable[[List[Document]], Any],
+        params: Optional[Dict[str, Any]] = None,
+        cache: Optional[SemanticAnswerCache] = None,
+) -> Tuple[Any, List[Document], bool]:
+    """ Answers a question from the answer cache if a near-duplicate was already answered, otherwise calls the LLM
+
+    Vectorstores without a fingerprint bypass the cache (see `get_answer_namespace`).
+
+    Args:
+        vectorstore (FAISS): The vectorstore of the document being queried (its embedding model embeds the question).
+        query_text (str): The question.
+        retrieve_fn (Callable): Returns the sources for the question (only called on a miss).
+        answer_fn (Callable): Returns the answer given the sources (only called on a miss).
+        params (Dict[str, Any], optional): The model/retrieval parameters that change the answer.
+        cache (SemanticAnswerCache, optional): The cache to use. Defaults to the process-wide cache.
+
+    Returns:
+        Tuple[Any, List[Document], bool]: The answer, its sources and whether it was served from the cache.
+    """
+    cache = get_answer_cache() if cache is None else cache
+    namespace = get_answer_namespace(vectorstore, params)
+    if namespace is None:
+        sources = retrieve_fn()
+        return answer_fn(sources), sources, False
+    question_vector = vectorstore.embedding_function(query_text)
+
+    entry = cache.lookup(namespace, question_vector)
+    if entry is not None:
+        return entry["answer"], entry["sources"], True
+
+    sources = retrieve_fn()
+    answer = answer_fn(sources)
+    cache.store(namespace, query_text, question_vector, answer, sources)
+    return answer, sources, False
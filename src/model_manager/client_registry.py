@@ -0,0 +1,120 @@
+import os
+import asyncio
+import weakref
+from functools import lru_cache
+from typing import Any, List, Optional
+
+import aiohttp
+import openai
+import requests
+from openai.api_requestor import MAX_CONNECTION_RETRIES
+from requests.adapters import HTTPAdapter
+
+# LANGCHAIN
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chat_models import ChatOpenAI
+from langchain.llms import OpenAI
+
+from src.auth import dotenv_auth
+from src.config.settings import OPENAI_HTTP_POOL_SIZE, OPENAI_MAX_CLIENTS
+
+# The pooled aiohttp session of every event loop (closed with `close_aiohttp_session`)
+_AIOHTTP_SESSIONS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+@lru_cache(maxsize=None)
+def load_credentials() -> Optional[str]:
+    """ Loads the .env file once per process and returns the OpenAI API key (None if there is none) """
+    dotenv_auth()
+    return os.environ.get("OPENAI_API_KEY")
+
+
+@lru_cache(maxsize=None)
+def get_http_session(pool_size: int = OPENAI_HTTP_POOL_SIZE) -> requests.Session:
+    """ Returns the process-wide pooled HTTP session used by every OpenAI request (installed on first use)
+
+    By default the openai library keeps one session per thread, so every new thread (i.e. every Streamlit rerun or
+    thread pool worker) pays for a new connection and TLS handshake. The shared session keeps up to `pool_size`
+    connections alive for every thread.
+
+    Args:
+        pool_size (int, optional): The maximum number of connections kept alive per host.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=MAX_CONNECTION_RETRIES)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    openai.requestssession = session
+    return session
+
+
+def use_pooled_aiohttp_session() -> aiohttp.ClientSession:
+    """ Makes the async OpenAI requests of the current task reuse the pooled session of the running event loop
+
+    Without it the openai library opens a new aiohttp session (and connection) for every async request. Only use it
+    on long-lived event loops (i.e. a server) and close the session with `close_aiohttp_session` on shutdown.
+
+    Returns:
+        aiohttp.ClientSession: The pooled session of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    session = _AIOHTTP_SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=OPENAI_HTTP_POOL_SIZE))
+        _AIOHTTP_SESSIONS[loop] = session
+    openai.aiosession.set(session)
+    return session
+
+
+async def close_aiohttp_session() -> None:
+    """ Closes the pooled aiohttp session of the running event loop (if there is one) """
+    session = _AIOHTTP_SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+@lru_cache(maxsize=OPENAI_MAX_CLIENTS)
+def get_openai_client(
+        model_name: str = "gpt-3.5-turbo-0613",
+        temperature: float = 0.7,
+        streaming: bool = False,
+        openai_api_key: Optional[str] = None,
+        **kwargs: Any,
+) -> BaseLanguageModel:
+    """ Returns the warm, shared OpenAI client of a configuration (built once per process)
+
+    The clients hold no per-request state and are safe to share across threads and event loops. They have no
+    callbacks: pass them per call (i.e. `client(messages, callbacks=[...])`) or use `with_callbacks`.
+
+    Args:
+        model_name (str, optional): The OpenAI model (chat models for 'gpt' names, completion models otherwise).
+        temperature (float, optional): The sampling temperature.
+        streaming (bool, optional): Whether the client streams its output to the callbacks.
+        openai_api_key (str, optional): The API key. Defaults to the key loaded by `load_credentials`.
+        **kwargs: Additional (hashable) kwargs of the client.
+
+    Returns:
+        BaseLanguageModel: The client.
+    """
+    get_http_session()
+    model_class = ChatOpenAI if "gpt" in model_name else OpenAI
+    return model_class(
+        model_name=model_name,
+        temperature=temperature,
+        streaming=streaming,
+        openai_api_key=openai_api_key or load_credentials(),
+        **kwargs
+    )
+
+
+def with_callbacks(model: BaseLanguageModel, callbacks: Optional[List[BaseCallbackHandler]]) -> BaseLanguageModel:
+    """ Returns a copy of a (shared) model with its own callbacks (no validation, so it is cheap enough per request) """
+    if not callbacks:
+        return model
+    return type(model).construct(**dict(model.__dict__, callbacks=callbacks))
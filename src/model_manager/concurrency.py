@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Any, Awaitable
+
+from src.config.settings import LLM_MAX_CONCURRENCY
+
+
+class ConcurrencyLimiter:
+    """ Caps the number of in-flight calls across every thread and event loop of the process
+
+    Unlike an `asyncio.Semaphore` (bound to one event loop) or a `threading.Semaphore` (which would block the event
+    loop), the limiter can be shared by synchronous callers (i.e. Streamlit script threads, thread pools) and by
+    coroutines running on any event loop (i.e. a server). Waiters are served in FIFO order.
+
+    Usage:
+        with limiter:            # synchronous callers
+            ...
+        async with limiter:      # coroutines
+            ...
+
+    Args:
+        max_concurrency (int): The maximum number of calls in flight at any time.
+    """
+    def __init__(self, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def acquire(self) -> None:
+        """ Blocks until a slot is free and takes it """
+        with self._lock:
+            if self.in_flight < self.max_concurrency and not self._waiters:
+                self.in_flight += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+
+    async def aacquire(self) -> None:
+        """ Waits (without blocking the event loop) until a slot is free and takes it """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < self.max_concurrency and not self._waiters:
+                self.in_flight += 1
+                return
+            future = loop.create_future()
+            wake = lambda: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+            self._waiters.append(wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in self._waiters:
+                    self._waiters.remove(wake)
+                    raise
+            # The slot was handed over while we were being cancelled, give it to the next waiter
+            self.release()
+            raise
+
+    def release(self) -> None:
+        """ Frees a slot (handing it directly to the longest waiting caller, if any) """
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft()()
+            else:
+                self.in_flight -= 1
+
+    def __enter__(self) -> "ConcurrencyLimiter":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    async def __aenter__(self) -> "ConcurrencyLimiter":
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+
+@lru_cache(maxsize=None)
+def get_llm_limiter(max_concurrency: int = LLM_MAX_CONCURRENCY) -> ConcurrencyLimiter:
+    """ Returns the process-wide limiter of in-flight LLM calls """
+    return ConcurrencyLimiter(max_concurrency)
+
+
+def run_async(coroutine: Awaitable) -> Any:
+    """ Runs a coroutine to completion from synchronous code (i.e. a Streamlit script) and returns its result
+
+    If the calling thread already runs an event loop the coroutine is run on a new loop in a helper thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+
+    def _run() -> None:
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+    thread = threading.Thread(target=_run)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
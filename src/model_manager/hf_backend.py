@@ -0,0 +1,290 @@
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# LANGCHAIN
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.llms.base import LLM
+from langchain.schema import AIMessage, BaseMessage, Generation, LLMResult, get_buffer_string
+
+from src.config.settings import HF_MODEL_NAME, HF_DEVICE, HF_MAX_NEW_TOKENS, HF_MAX_LOADED_MODELS
+
+# The chat template roles of the LangChain message types
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+# Serializes model loading so concurrent first requests don't load the same weights twice
+_LOAD_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=HF_MAX_LOADED_MODELS)
+def _load_hf_model(model_name: str, device: str) -> Tuple[Any, Any]:
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    # Left padding keeps the prompts of a batch right-aligned so the generated tokens start at the same position
+    tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(model_name).to(device).eval()
+    return tokenizer, model
+
+
+def get_hf_model(model_name: str = HF_MODEL_NAME, device: str = HF_DEVICE) -> Tuple[Any, Any]:
+    """ Returns the tokenizer and model of a Hugging Face causal LM (loaded once per process and device)
+
+    The `HF_MAX_LOADED_MODELS` most recently used models are kept in memory.
+
+    Args:
+        model_name (str, optional): A Hugging Face hub model id or a local directory.
+        device (str, optional): The torch device to run the model on (i.e. 'cpu', 'cuda').
+
+    Returns:
+        Tuple[PreTrainedTokenizer, PreTrainedModel]: The tokenizer and the model.
+    """
+    with _LOAD_LOCK:
+        return _load_hf_model(model_name, device)
+
+
+def messages_to_prompt(messages: Sequence[BaseMessage], tokenizer: Any) -> str:
+    """ Formats chat messages with the tokenizer's chat template (or as a plain 'Human: ... AI:' transcript) """
+    if getattr(tokenizer, "chat_template", None):
+        conversation = [dict(role=_ROLES.get(message.type, "user"), content=message.content) for message in messages]
+        return tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+    return f"{get_buffer_string(list(messages))}\nAI:"
+
+
+def _generation_kwargs(tokenizer: Any, max_new_tokens: int, temperature: float) -> dict:
+    kwargs = dict(max_new_tokens=max_new_tokens, do_sample=temperature > 0, pad_token_id=tokenizer.pad_token_id)
+    if temperature > 0:
+        kwargs["temperature"] = temperature
+    return kwargs
+
+
+def truncate_at_stop(text: str, stop: Optional[Sequence[str]]) -> str:
+    """ Cuts a text at the first occurrence of any of the stop sequences (matched literally) """
+    positions = [text.find(s) for s in stop or () if s and s in text]
+    return text[:min(positions)] if positions else text
+
+
+def _partial_stop_length(text: str, stop: Sequence[str]) -> int:
+    """ Returns the length of the longest end of a text that is the start of a stop sequence """
+    return max((k for s in stop for k in range(1, min(len(s), len(text) + 1)) if text.endswith(s[:k])), default=0)
+
+
+def stream_until_stop(chunks: Iterable[str], stop: Optional[Sequence[str]]) -> Iterator[str]:
+    """ Yields streamed text up to the first stop sequence (the concatenation equals `truncate_at_stop` of the whole)
+
+    The end of the text that could be the start of a stop sequence split across chunks is held back until the next
+    chunk tells whether it is one.
+    """
+    stop = [s for s in stop or () if s]
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        if not stop:
+            text, buffer = buffer, ""
+        else:
+            truncated = truncate_at_stop(buffer, stop)
+            if len(truncated) < len(buffer):
+                if truncated:
+                    yield truncated
+                return
+            held = _partial_stop_length(buffer, stop)
+            text, buffer = buffer[:len(buffer) - held], buffer[len(buffer) - held:]
+        if text:
+            yield text
+    if buffer:
+        yield buffer
+
+
+def hf_generate(
+        prompts: List[str],
+        model_name: str = HF_MODEL_NAME,
+        device: str = HF_DEVICE,
+        max_new_tokens: int = HF_MAX_NEW_TOKENS,
+        temperature: float = 0.0,
+        stop: Optional[List[str]] = None,
+) -> List[str]:
+    """ Generates the completions of a batch of prompts with one `generate` call
+
+    It can serve as the batched function of a `src.runhouse_ops.batching.MicroBatchScheduler`.
+
+    Args:
+        prompts (List[str]): The prompts.
+        model_name (str, optional): A Hugging Face hub model id or a local directory.
+        device (str, optional): The torch device to run the model on.
+        max_new_tokens (int, optional): The maximum number of generated tokens per prompt.
+        temperature (float, optional): The sampling temperature (0 decodes greedily).
+        stop (List[str], optional): Stop sequences (the completions are cut at the first one).
+
+    Returns:
+        List[str]: The completion of every prompt (without the prompt).
+    """
+    import torch
+
+    tokenizer, model = get_hf_model(model_name, device)
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    with torch.inference_mode():
+        output_ids = model.generate(**inputs, **_generation_kwargs(tokenizer, max_new_tokens, temperature))
+    completions = tokenizer.batch_decode(output_ids[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+    return [truncate_at_stop(completion, stop) for completion in completions]
+
+
+def hf_stream(
+        prompt: str,
+        model_name: str = HF_MODEL_NAME,
+        device: str = HF_DEVICE,
+        max_new_tokens: int = HF_MAX_NEW_TOKENS,
+        temperature: float = 0.0,
+        stop: Optional[List[str]] = None,
+) -> Iterator[str]:
+    """ Yields the completion of a prompt as it is generated (the generation runs in a background thread)
+
+    The stream ends at the first stop sequence (the streamed text is the completion `hf_generate` returns for the
+    same stop sequences) and the generation is stopped there.
+
+    Args:
+        prompt (str): The prompt.
+        model_name (str, optional): A Hugging Face hub model id or a local directory.
+        device (str, optional): The torch device to run the model on.
+        max_new_tokens (int, optional): The maximum number of generated tokens.
+        temperature (float, optional): The sampling temperature (0 decodes greedily).
+        stop (List[str], optional): Stop sequences (the stream ends before the first one).
+
+    Yields:
+        str: The decoded text of the new tokens (the tokenizer may group several tokens to yield whole words).
+    """
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+    stopped = threading.Event()
+
+    class _StopWhenSet(StoppingCriteria):
+        def __call__(self, input_ids: Any, scores: Any, **kwargs: Any) -> bool:
+            return stopped.is_set()
+
+    tokenizer, model = get_hf_model(model_name, device)
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    generation_kwargs = dict(
+        **inputs,
+        streamer=streamer,
+        stopping_criteria=StoppingCriteriaList([_StopWhenSet()]),
+        **_generation_kwargs(tokenizer, max_new_tokens, temperature),
+    )
+    thread = threading.Thread(target=model.generate, kwargs=generation_kwargs, daemon=True)
+    thread.start()
+    try:
+        yield from stream_until_stop(streamer, stop)
+    finally:
+        # Ends the generation early if the stream hit a stop sequence (or its consumer gave up)
+        stopped.set()
+        thread.join()
+
+
+class HuggingFaceLocalLLM(LLM):
+    """ A Hugging Face causal LM running in this process (a LangChain LLM)
+
+    The weights are loaded on the first call and shared by every instance with the same `model_name` and `device`
+    (see `get_hf_model`). Prompts given together (i.e. `llm.generate([...])`) run as one batched `generate` call and
+    the output streams to the callbacks token by token if `streaming` is set.
+    """
+    model_name: str = HF_MODEL_NAME
+    device: str = HF_DEVICE
+    max_new_tokens: int = HF_MAX_NEW_TOKENS
+    temperature: float = 0.0
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "huggingface_local"
+
+    @property
+    def _generation_params(self) -> dict:
+        return dict(
+            model_name=self.model_name,
+            device=self.device,
+            max_new_tokens=self.max_new_tokens,
+            temperature=self.temperature,
+        )
+
+    @property
+    def tokenizer(self) -> Any:
+        return get_hf_model(self.model_name, self.device)[0]
+
+    def _call(
+            self,
+            prompt: str,
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> str:
+        if not (self.streaming and run_manager):
+            return hf_generate([prompt], stop=stop, **self._generation_params)[0]
+        text = ""
+        for token in hf_stream(prompt, stop=stop, **self._generation_params):
+            run_manager.on_llm_new_token(token)
+            text += token
+        return text
+
+    async def _acall(
+            self,
+            prompt: str,
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> str:
+        # The generation runs in a worker thread, the tokens are handed to the callbacks on the event loop
+        loop = asyncio.get_running_loop()
+        if not (self.streaming and run_manager):
+            completions = await loop.run_in_executor(
+                None, lambda: hf_generate([prompt], stop=stop, **self._generation_params)
+            )
+            return completions[0]
+
+        def _stream() -> str:
+            text = ""
+            for token in hf_stream(prompt, stop=stop, **self._generation_params):
+                asyncio.run_coroutine_threadsafe(run_manager.on_llm_new_token(token), loop).result()
+                text += token
+            return text
+        return await loop.run_in_executor(None, _stream)
+
+    def _generate(
+            self,
+            prompts: List[str],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> LLMResult:
+        if self.streaming:
+            return super()._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+        completions = hf_generate(prompts, stop=stop, **self._generation_params)
+        return LLMResult(generations=[[Generation(text=completion)] for completion in completions])
+
+    async def _agenerate(
+            self,
+            prompts: List[str],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> LLMResult:
+        if self.streaming:
+            return await super()._agenerate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+        completions = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: hf_generate(prompts, stop=stop, **self._generation_params)
+        )
+        return LLMResult(generations=[[Generation(text=completion)] for completion in completions])
+
+    def predict_messages(
+            self, messages: List[BaseMessage], *, stop: Optional[Sequence[str]] = None, **kwargs: Any
+    ) -> BaseMessage:
+        """ Answers chat messages formatted with the model's chat template """
+        prompt = messages_to_prompt(messages, self.tokenizer)
+        return AIMessage(content=self.predict(prompt, stop=stop, **kwargs))
+
+    async def apredict_messages(
+            self, messages: List[BaseMessage], *, stop: Optional[Sequence[str]] = None, **kwargs: Any
+    ) -> BaseMessage:
+        """ The async version of `predict_messages` """
+        prompt = messages_to_prompt(messages, self.tokenizer)
+        return AIMessage(content=await self.apredict(prompt, stop=stop, **kwargs))
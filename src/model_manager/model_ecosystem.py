@@ -1,26 +1,94 @@
+import re
+import time
+import asyncio
 import streamlit as st
 from langchain.llms import OpenAI
+from langchain.llms.base import LLM
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain.chat_models import ChatOpenAI
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 from langchain.docstore.document import Document
 from langchain.chains.qa_with_sources import load_qa_with_sources_chain
-from langchain.callbacks.streaming_stdout import BaseCallbackHandler, StreamingStdOutCallbackHandler
 from src.prompts import IR_PROMPTS
+from src.lmnt.chains import QA_CHAINS, ASYNC_QA_CHAINS
+from src.model_manager.concurrency import get_llm_limiter
+from src.model_manager.streaming import StdoutSink, StreamlitSink
+from src.model_manager.hf_backend import HuggingFaceLocalLLM
+from src.model_manager.client_registry import get_openai_client, with_callbacks
 
 
-class StreamlitCallbackHandler(BaseCallbackHandler):
-    def __init__(self, container, initial_text="", display_method='markdown'):
-        self.container = container
-        self.text = initial_text
-        self.display_method = display_method
+class FakeLLM(LLM):
+    """ A deterministic local stand-in for the OpenAI models (for tests and offline development)
 
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        self.text += token
-        display_function = getattr(self.container, self.display_method, None)
-        if display_function is not None:
-            display_function(self.text, unsafe_allow_html=True)
-        else:
-            raise ValueError(f"Invalid display_method: {self.display_method}")
+    It answers the prompts in `src.prompts` in the expected formats (citing the first source of 'stuff' prompts, echoing
+    the excerpt of map prompts and scoring rerank prompts) and streams its output word by word if `streaming` is set.
+    """
+    streaming: bool = False
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        # Only look at the part of the prompt after the last question (the prompts contain worked examples)
+        question, _, context = prompt.rpartition("QUESTION: ")[2].partition("\n")
+        excerpt = context.split("=========")[1].strip() if context.count("=========") >= 2 else ""
+        if prompt.rstrip().endswith("RELEVANT TEXT:"):
+            return excerpt or "NO RELEVANT TEXT"
+        if "SCORE:" in prompt:
+            return f"{excerpt[:200]}\nSCORE: {50 if excerpt else 0}"
+        sources = re.findall(r"^Source: (.+)$", context, re.MULTILINE)
+        if not sources:
+            return "I don't know.\nSOURCES: "
+        return f"This is a fake answer to '{question.strip()}' <sup><b>{sources[0]}</b></sup>\nSOURCES: {sources[0]}"
+
+    def _call(
+            self,
+            prompt: str,
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> str:
+        time.sleep(self.latency)
+        text = self._answer(prompt)
+        if self.streaming and run_manager:
+            for token in re.findall(r"\S+\s*", text):
+                run_manager.on_llm_new_token(token)
+        return text
+
+    async def _acall(
+            self,
+            prompt: str,
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> str:
+        await asyncio.sleep(self.latency)
+        text = self._answer(prompt)
+        if self.streaming and run_manager:
+            for token in re.findall(r"\S+\s*", text):
+                await run_manager.on_llm_new_token(token)
+        return text
+
+
+def get_llm(backend="openai", model_name="gpt-3.5-turbo-0613", temperature=0.7, callbacks=None, **kwargs):
+    """ Returns a model for a backend name ['openai' | 'hf' | 'fake'] (streaming to `callbacks` if any are given)
+
+    For the 'hf' backend `model_name` is a Hugging Face hub model id or a local directory (see `HF_MODEL_NAME`).
+    """
+    if backend == "openai":
+        # The shared client of the configuration (a cheap copy carries the callbacks of this request)
+        client = get_openai_client(model_name, temperature, streaming=bool(callbacks), **kwargs)
+        return with_callbacks(client, callbacks)
+    elif backend == "hf":
+        return HuggingFaceLocalLLM(
+            model_name=model_name, temperature=temperature, streaming=bool(callbacks), callbacks=callbacks, **kwargs
+        )
+    elif backend == "fake":
+        return FakeLLM(streaming=bool(callbacks), callbacks=callbacks, **kwargs)
+    raise ValueError(f"Invalid llm backend: {backend}")
 
 
 def get_openai_model(model_name="gpt-3.5-turbo-0613", temperature=0.7, use_streaming=False,
@@ -28,33 +96,19 @@ def get_openai_model(model_name="gpt-3.5-turbo-0613", temperature=0.7, use_strea
     """
     ["gpt-3.5-turbo-16", "gpt-3.5-turbo-0613"]
     ["streamlit", "stdout"]
+
+    The model is a cheap copy (carrying the streaming callbacks) of the warm, shared client of the configuration (see
+    `get_openai_client`).
     """
     if streaming_cb == "stdout" and use_streaming:
-        streaming_cb = [StreamingStdOutCallbackHandler()]
+        streaming_cb = [StdoutSink()]
     elif streaming_cb == "streamlit" and use_streaming:
-        streaming_cb = [StreamlitCallbackHandler(st_container)]
+        streaming_cb = [StreamlitSink(st_container)]
     else:
         streaming_cb = None
 
-    if "gpt" in model_name:
-        model = ChatOpenAI(
-            model_name=model_name,
-            temperature=temperature,
-            verbose=verbose,
-            streaming=use_streaming,
-            callbacks=streaming_cb,
-            **kwargs
-        )
-    else:
-        model = OpenAI(
-            model_name=model_name,
-            temperature=temperature,
-            verbose=verbose,
-            streaming=use_streaming,
-            callbacks=streaming_cb,
-            **kwargs
-        )
-    return model
+    client = get_openai_client(model_name, temperature, streaming=use_streaming, verbose=verbose, **kwargs)
+    return with_callbacks(client, streaming_cb)
 
 
 def get_llm_response(
@@ -85,11 +139,15 @@ def get_llm_response(
                   higher values are more creative and unpredictable
             top_k_sources (int, optional):
                 - The number of top sources to use for the chat model
+            chain_type (str, optional):
+                - Overrides the `chain_type` argument
         chain_type (str, optional):
-            - The type of chain to use for the chat model. Can be ['stuff' | 'reduce' |'rerank']
-                - 'stuff' tbd
-                - 'reduce' tbd
-                - 'rerank' tbd
+            - The type of chain to use for the chat model. Can be ['stuff' | 'map_reduce' |'map_rerank']
+                - 'stuff' injects every Document into a single prompt
+                - 'map_reduce' extracts the relevant text from each Document (concurrently) and answers from the
+                  extracts in a single call (see `src.lmnt.chains.map_reduce_qa`)
+                - 'map_rerank' answers from each Document separately (concurrently) and keeps the answer with the
+                  highest self-reported score (see `src.lmnt.chains.map_rerank_qa`)
         use_streaming (bool, optional):
             - Whether to use streaming or not. Defaults to False.
         _container (st.container, optional):
@@ -99,6 +157,10 @@ def get_llm_response(
         Dict[str, Any]: A dictionary containing the answer and the source Documents.
     """
 
+    chain_type = qa_hyperparameters.get("chain_type", chain_type)
+    if chain_type in QA_CHAINS:
+        return QA_CHAINS[chain_type](llm, sources, query_text)
+
     # TODO: Replace with our own qa w/ sources chain
     qa_w_srcs_chain = load_qa_with_sources_chain(
         llm = llm,
@@ -106,6 +168,45 @@ def get_llm_response(
         prompt=IR_PROMPTS.get(chain_type),
     )
 
-    # Get the answer by running the chain
-    answer = qa_w_srcs_chain({"input_documents": sources, "question": query_text}, return_only_outputs=True)
+    # Get the answer by running the chain (every process shares a cap on the number of in-flight LLM calls)
+    with get_llm_limiter():
+        answer = qa_w_srcs_chain({"input_documents": sources, "question": query_text}, return_only_outputs=True)
+    return answer
+
+
+async def aget_llm_response(
+        llm: Union[OpenAI, ChatOpenAI],
+        sources: List[Document],
+        query_text: str,
+        qa_hyperparameters: Dict[str, Any],
+        chain_type: str = "stuff",
+) -> Dict[str, Any]:
+    """The async version of `get_llm_response` (built on the models' async generate APIs).
+
+    The calls share the process-wide limiter of in-flight LLM calls with the synchronous path, so the same function can
+    be awaited by a server or run from Streamlit with `src.model_manager.concurrency.run_async`.
+
+    Args:
+        llm (Union[OpenAI, ChatOpenAI]): The model to query.
+        sources (List[Document]): The Documents to inject as context.
+        query_text (str): The question.
+        qa_hyperparameters (Dict[str, Any]): The model hyperparameters (see `get_llm_response`).
+        chain_type (str, optional): The type of chain to use. Can be ['stuff' | 'map_reduce' |'map_rerank']
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the answer and the source Documents.
+    """
+    chain_type = qa_hyperparameters.get("chain_type", chain_type)
+    if chain_type in ASYNC_QA_CHAINS:
+        return await ASYNC_QA_CHAINS[chain_type](llm, sources, query_text)
+
+    qa_w_srcs_chain = load_qa_with_sources_chain(
+        llm = llm,
+        chain_type=chain_type,
+        prompt=IR_PROMPTS.get(chain_type),
+    )
+    async with get_llm_limiter():
+        answer = await qa_w_srcs_chain.acall(
+            {"input_documents": sources, "question": query_text}, return_only_outputs=True
+        )
     return answer
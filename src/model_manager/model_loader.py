@@ -1,20 +1,5 @@
-from langchain.chat_models import ChatOpenAI
-from langchain.callbacks.streaming_stdout import BaseCallbackHandler, StreamingStdOutCallbackHandler
-
-
-class StreamlitCallbackHandler(BaseCallbackHandler):
-    def __init__(self, container, initial_text="", display_method='markdown'):
-        self.container = container
-        self.text = initial_text
-        self.display_method = display_method
-
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        self.text += token
-        display_function = getattr(self.container, self.display_method, None)
-        if display_function is not None:
-            display_function(self.text, unsafe_allow_html=True)
-        else:
-            raise ValueError(f"Invalid display_method: {self.display_method}")
+from src.model_manager.client_registry import get_openai_client, with_callbacks
+from src.model_manager.streaming import StdoutSink, StreamlitSink
 
 
 def get_openai_chat_model(model_name="gpt-3.5-turbo-0613", temperature=0.7, use_streaming=False,
@@ -22,16 +7,17 @@ def get_openai_chat_model(model_name="gpt-3.5-turbo-0613", temperature=0.7, use_
     """
     ["gpt-3.5-turbo-16", "gpt-3.5-turbo-0613"]
     ["streamlit", "stdout"]
+
+    The model is a cheap copy (carrying the streaming callbacks) of the warm, shared client of the configuration (see
+    `get_openai_client`).
     """
-    streaming_cb = None
     if streaming_cb == "stdout" and use_streaming:
-        streaming_cb = [StreamingStdOutCallbackHandler()]
+        streaming_cb = [StdoutSink()]
     elif streaming_cb == "streamlit" and use_streaming:
-        streaming_cb = [StreamlitCallbackHandler(st_container)]
+        streaming_cb = [StreamlitSink(st_container)]
+    else:
+        streaming_cb = None
 
-    chat_model = ChatOpenAI(
-        model_name=model_name, temperature=temperature, verbose=verbose, streaming=use_streaming,
-        callbacks=streaming_cb, **kwargs
-    )
+    chat_model = get_openai_client(model_name, temperature, streaming=use_streaming, verbose=verbose, **kwargs)
 
-    return chat_model
+    return with_callbacks(chat_model, streaming_cb)
@@ -0,0 +1,184 @@
+import sys
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+# LANGCHAIN
+from langchain.callbacks.base import BaseCallbackHandler
+
+from src.config.settings import STREAM_MAX_FPS, STREAM_FLUSH_TOKENS
+from src.data_manager.output_parsing import StreamingCitationParser
+from src.monitoring.metrics import SIZE_BUCKETS, MetricsRegistry, get_metrics_registry
+
+
+class StreamingSink(BaseCallbackHandler, ABC):
+    """ Buffers streamed tokens and flushes them to a display at a bounded rate
+
+    Rendering every token (i.e. re-rendering the whole answer as markdown) costs work proportional to the answer
+    length per token, so the tokens are buffered and flushed at most `max_fps` times per second or whenever
+    `flush_every` tokens are buffered (the first token is flushed right away). The remaining tokens are flushed once
+    the model is done. Subclasses implement `render`.
+
+    The handler runs inline on async callback managers (no thread hop per token) and keeps the full `text` across
+    the model calls it is attached to.
+
+    Args:
+        max_fps (float, optional): The maximum number of flushes per second.
+        flush_every (int, optional): The number of buffered tokens that triggers a flush regardless of the rate.
+        initial_text (str, optional): The text the streamed tokens are appended to.
+    """
+    run_inline = True
+
+    def __init__(
+            self,
+            max_fps: float = STREAM_MAX_FPS,
+            flush_every: int = STREAM_FLUSH_TOKENS,
+            initial_text: str = "",
+    ):
+        self.min_interval = 1 / max_fps if max_fps > 0 else 0.0
+        self.flush_every = max(1, flush_every)
+        self.text = initial_text
+        self._buffer: List[str] = []
+        self._last_flush = float("-inf")
+
+    @abstractmethod
+    def render(self, new_text: str, final: bool) -> None:
+        """ Displays the flushed text (`new_text` is the part of `self.text` that was not displayed yet) """
+
+    def flush(self, final: bool = False) -> None:
+        """ Appends the buffered tokens to `text` and renders them """
+        if not self._buffer and not final:
+            return
+        new_text = "".join(self._buffer)
+        self._buffer.clear()
+        self.text += new_text
+        self._last_flush = time.monotonic()
+        self.render(new_text, final)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._buffer.append(token)
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.min_interval:
+            self.flush()
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self.flush(final=True)
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self.flush(final=True)
+
+
+class StreamlitSink(StreamingSink):
+    """ Streams into a Streamlit container (i.e. an `st.empty()` placeholder)
+
+    Args:
+        container (DeltaGenerator): The container the answer is displayed in.
+        display_method (str, optional): The container method used to display the text (i.e. 'markdown').
+        **kwargs: The `StreamingSink` arguments.
+    """
+    def __init__(self, container: Any, display_method: str = "markdown", **kwargs: Any):
+        super().__init__(**kwargs)
+        self.container = container
+        self.display_function = getattr(container, display_method, None)
+        if self.display_function is None:
+            raise ValueError(f"Invalid display_method: {display_method}")
+
+    def render(self, new_text: str, final: bool) -> None:
+        if new_text:
+            self.display_function(self.text, unsafe_allow_html=True)
+
+
+class StdoutSink(StreamingSink):
+    """ Streams to stdout (or any text stream) """
+    def __init__(self, stream: Optional[TextIO] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.stream = stream or sys.stdout
+
+    def render(self, new_text: str, final: bool) -> None:
+        self.stream.write(new_text)
+        self.stream.flush()
+
+
+class QueueSink(StreamingSink):
+    """ Streams the flushed text to an asyncio queue (i.e. consumed by a server-sent event stream)
+
+    The text is put on the queue from any thread through the queue's event loop.
+
+    Args:
+        queue (asyncio.Queue): The queue (one item per flush).
+        loop (asyncio.AbstractEventLoop, optional): The event loop of the queue. Defaults to the running loop.
+        **kwargs: The `StreamingSink` arguments.
+    """
+    def __init__(self, queue: asyncio.Queue, loop: Optional[asyncio.AbstractEventLoop] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.queue = queue
+        self.loop = loop or asyncio.get_running_loop()
+
+    def render(self, new_text: str, final: bool) -> None:
+        if new_text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, new_text)
+
+
+class CitationHandler(BaseCallbackHandler):
+    """ Feeds the streamed tokens to a `StreamingCitationParser` and reports every newly cited source
+
+    Args:
+        parser (StreamingCitationParser): The parser (holding the sources given to the model).
+        on_citation (Callable[[Dict[str, Any]], None]): Called with each citation event (see the parser).
+    """
+    run_inline = True
+
+    def __init__(self, parser: StreamingCitationParser, on_citation: Callable[[Dict[str, Any]], None]):
+        self.parser = parser
+        self.on_citation = on_citation
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        for event in self.parser.feed(token):
+            self.on_citation(event)
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        for event in self.parser.close():
+            self.on_citation(event)
+
+
+class FirstTokenTimer(BaseCallbackHandler):
+    """ Records the time to first token of every model call it is attached to
+
+    The seconds from the start of a call to its first streamed token are observed as
+    `llm_time_to_first_token_seconds` (and the number of streamed tokens as `llm_streamed_tokens`) in the metrics
+    registry. Calls that don't stream are not recorded.
+
+    Args:
+        registry (MetricsRegistry, optional): The registry. Defaults to the process-wide registry.
+        **labels: The labels of the metrics (i.e. the model name).
+    """
+    run_inline = True
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, **labels: Any):
+        self.registry = get_metrics_registry() if registry is None else registry
+        self.labels = labels
+        self.time_to_first_token: Optional[float] = None
+        self._starts: Dict[Any, float] = {}
+        self._tokens: Dict[Any, int] = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], run_id: Any = None, **kwargs: Any) -> None:
+        self._starts[run_id] = time.perf_counter()
+        self._tokens[run_id] = 0
+
+    def on_llm_new_token(self, token: str, run_id: Any = None, **kwargs: Any) -> None:
+        if run_id not in self._starts:
+            return
+        self._tokens[run_id] += 1
+        if self._tokens[run_id] == 1:
+            self.time_to_first_token = time.perf_counter() - self._starts[run_id]
+            self.registry.observe("llm_time_to_first_token_seconds", self.time_to_first_token, **self.labels)
+
+    def on_llm_end(self, response: Any, run_id: Any = None, **kwargs: Any) -> None:
+        self._starts.pop(run_id, None)
+        n_tokens = self._tokens.pop(run_id, 0)
+        if n_tokens:
+            self.registry.observe("llm_streamed_tokens", n_tokens, buckets=SIZE_BUCKETS, **self.labels)
+
+    def on_llm_error(self, error: BaseException, run_id: Any = None, **kwargs: Any) -> None:
+        self._starts.pop(run_id, None)
+        self._tokens.pop(run_id, None)
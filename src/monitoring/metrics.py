@@ -0,0 +1,257 @@
+import json
+import math
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.config.settings import MONITORING_TRACE_PATH, MONITORING_MAX_SPANS
+
+# Histogram buckets (upper bounds) for durations in seconds and for sizes (tokens, chunks, characters, ...)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1, 4, 16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# A metric series is identified by its name and its (sorted) labels
+_SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# The stage span of the current thread or task (see `trace_stage`)
+_CURRENT_SPAN: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """ A cumulative-bucket histogram (like a Prometheus histogram) with interpolated quantiles """
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ Estimates a quantile by linear interpolation within its bucket (like Prometheus' `histogram_quantile`) """
+        if not self.count:
+            return 0.0
+        rank, cumulative = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) - 1 else lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-2]
+
+    def summary(self) -> Dict[str, Any]:
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            mean=self.sum / self.count if self.count else 0.0,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+        )
+
+
+class Span:
+    """ The timing and attributes of one run of a stage (see `trace_stage`) """
+    def __init__(self, stage: str, labels: Dict[str, str]):
+        self.stage = stage
+        self.labels = labels
+        self.attributes: Dict[str, Any] = {}
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+
+    def record(self, **attributes: Any) -> None:
+        """ Attaches attributes to the span (numbers become histograms, booleans counters, see `finish_span`) """
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            stage=self.stage,
+            started_at=self.started_at,
+            duration=self.duration,
+            status=self.status,
+            labels=self.labels,
+            attributes=self.attributes,
+        )
+
+
+class MetricsRegistry:
+    """ An in-process registry of counters, histograms and recent stage spans
+
+    The metrics can be exported in the Prometheus text format (`to_prometheus`) or as JSON lines (`to_jsonl`) with
+    the p50/p90/p99 of every histogram.
+
+    Args:
+        max_spans (int, optional): The number of most recent spans kept in memory.
+        trace_path (str, optional): A file every finished span is appended to as a JSON line ('' disables it).
+    """
+    def __init__(self, max_spans: int = MONITORING_MAX_SPANS, trace_path: str = MONITORING_TRACE_PATH):
+        self.counters: Dict[_SeriesKey, float] = {}
+        self.histograms: Dict[_SeriesKey, Histogram] = {}
+        self.spans = deque(maxlen=max_spans)
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> _SeriesKey:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        """ Increments a counter """
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: Any) -> None:
+        """ Adds a value to a histogram (the buckets are fixed by the first observation of the series) """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def quantile(self, name: str, q: float, **labels: Any) -> float:
+        """ Returns the estimated quantile of a histogram (0 if nothing was observed) """
+        with self._lock:
+            histogram = self.histograms.get(self._key(name, labels))
+            return histogram.quantile(q) if histogram else 0.0
+
+    def finish_span(self, span: Span) -> None:
+        """ Records a finished span: its duration, numeric attributes (histograms) and boolean attributes (counters) """
+        labels = dict(span.labels, stage=span.stage)
+        self.observe("stage_duration_seconds", span.duration, **labels, status=span.status)
+        for name, value in span.attributes.items():
+            if isinstance(value, bool):
+                self.inc(f"stage_{name}_total", **labels, result=str(value).lower())
+            elif isinstance(value, (int, float)):
+                self.observe(f"stage_{name}", value, buckets=SIZE_BUCKETS, **labels)
+
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self.spans.append(span.to_dict())
+            if self.trace_path:
+                with open(self.trace_path, "a") as f:
+                    f.write(line + "\n")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """ Returns every series (counters with their value, histograms with their count, sum and quantiles) """
+        with self._lock:
+            series = [
+                dict(name=name, type="counter", labels=dict(labels), value=value)
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            series += [
+                dict(name=name, type="histogram", labels=dict(labels), **histogram.summary())
+                for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])
+            ]
+        return series
+
+    def to_jsonl(self) -> str:
+        """ Returns the snapshot as JSON lines (one series per line, with the time of the snapshot) """
+        timestamp = time.time()
+        return "".join(json.dumps(dict(series, timestamp=timestamp)) + "\n" for series in self.snapshot())
+
+    def dump_jsonl(self, path: str) -> None:
+        """ Appends the snapshot to a JSON lines file """
+        with open(path, "a") as f:
+            f.write(self.to_jsonl())
+
+    def to_prometheus(self) -> str:
+        """ Returns the metrics in the Prometheus text exposition format """
+        def _labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+            pairs = [*labels, *extra.items()]
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines, typed = [], set()
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else repr(float(bound))
+                    lines.append(f"{name}_bucket{_labels(labels, le=le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.spans.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@lru_cache(maxsize=None)
+def get_metrics_registry() -> MetricsRegistry:
+    """ Returns the process-wide metrics registry """
+    return MetricsRegistry()
+
+
+@contextmanager
+def trace_stage(stage: str, registry: Optional[MetricsRegistry] = None, **labels: Any) -> Iterator[Span]:
+    """ Times a stage and records it (and the attributes attached to its span) in the metrics registry
+
+    Usage:
+        with trace_stage("query_llm", model_name=model_name) as span:
+            response = ...
+            span.record(output_tokens=count_tokens(response), cache_hit=False)
+
+    Labels should have few distinct values (i.e. model or chain names, not queries). The span is the current span of
+    the thread or task while the stage runs (see `record_stage`), and stages that raise are recorded with an 'error'
+    status.
+
+    Args:
+        stage (str): The name of the stage.
+        registry (MetricsRegistry, optional): The registry. Defaults to the process-wide registry.
+        **labels: The labels of the stage's metrics.
+
+    Yields:
+        Span: The span of the stage.
+    """
+    registry = get_metrics_registry() if registry is None else registry
+    span = Span(stage, {k: str(v) for k, v in labels.items()})
+    token = _CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException:
+        span.status = "error"
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        span.duration = time.perf_counter() - span.start
+        registry.finish_span(span)
+
+
+def current_span() -> Optional[Span]:
+    """ Returns the span of the innermost stage running in this thread or task (None outside of stages) """
+    return _CURRENT_SPAN.get()
+
+
+def record_stage(**attributes: Any) -> None:
+    """ Attaches attributes to the current span (does nothing outside of stages) """
+    span = current_span()
+    if span is not None:
+        span.record(**attributes)
@@ -1,5 +1,7 @@
-from src.prompts.information_retrieval import STUFF_PROMPT
+from src.prompts.information_retrieval import STUFF_PROMPT, MAP_PROMPT, REDUCE_PROMPT, RERANK_PROMPT
 
 IR_PROMPTS = {
     "stuff":STUFF_PROMPT,
+    "map_reduce": {"map": MAP_PROMPT, "reduce": REDUCE_PROMPT},
+    "map_rerank": {"map": RERANK_PROMPT},
 }
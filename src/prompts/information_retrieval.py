@@ -1,7 +1,7 @@
 from langchain.prompts import PromptTemplate
 
 ## Use a shorter template to reduce the number of tokens in the prompt
-template = """Create a final answer to the given questions using the provided document excerpts (in no particular order) as references. ALWAYS include a "SOURCES" section in your answer including only the minimal set of sources needed to answer the question. If you are unable to answer the question, simply state that you do not know. Do not attempt to fabricate an answer and leave the SOURCES section empty. Always think things through step by step and come to the correct conclusion. Please put the source values (#-#) immediately after any text that utilizes the respective source.
+template = """Create a final answer to the given questions using the provided document excerpts (in no particular order) as references. ALWAYS include a "SOURCES" section in your answer including only the minimal set of sources needed to answer the question. If you are unable to answer the question, simply state that you do not know. Do not attempt to fabricate an answer and leave the SOURCES section empty. Always think things through step by step and come to the correct conclusion. Please put the source values (#-#) immediately after any text that utilizes the respective source. When excerpts come from several documents the source values are prefixed with the document name (i.e. handbook.pdf:3-15); always copy source values exactly as they are given.
 
 The schema strictly follow the format below:
 
@@ -51,4 +51,38 @@ FINAL ANSWER:"""
 
 STUFF_PROMPT = PromptTemplate(
     template=template, input_variables=["summaries", "question"]
-)
\ No newline at end of file
+)
+
+## Map-reduce: each excerpt is condensed separately (map) and the condensed excerpts are answered like 'stuff' (reduce)
+map_template = """Use the following excerpt of a document to see if any of the text is relevant to answer the question. Return any relevant text verbatim. If none of the text is relevant, return exactly "NO RELEVANT TEXT".
+
+QUESTION: {question}
+=========
+{context}
+=========
+RELEVANT TEXT:"""
+
+MAP_PROMPT = PromptTemplate(
+    template=map_template, input_variables=["context", "question"]
+)
+
+REDUCE_PROMPT = STUFF_PROMPT
+
+
+## Map-rerank: each excerpt is answered separately with a confidence score and the best scoring answer is kept
+rerank_template = """Use the following excerpt of a document to answer the question. If you are unable to answer the question from the excerpt, simply state that you do not know and give a score of 0. Do not attempt to fabricate an answer.
+
+In addition to the answer, give a score from 0 to 100 of how fully the excerpt answers the question. The schema strictly follows the format below:
+
+ANSWER: {{The answer to the question}}
+SCORE: {{A number from 0 to 100}}
+
+QUESTION: {question}
+=========
+{context}
+=========
+ANSWER:"""
+
+RERANK_PROMPT = PromptTemplate(
+    template=rerank_template, input_variables=["context", "question"]
+)
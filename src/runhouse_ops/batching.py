@@ -0,0 +1,212 @@
+import time
+import queue
+import asyncio
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.config.settings import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+
+# Put on the queue to stop the dispatch thread
+_STOP = object()
+
+
+class BatchMetrics:
+    """ Thread-safe counters of a `MicroBatchScheduler` (batch fill and queueing delay)
+
+    Args:
+        max_batch_size (int): The maximum batch size of the scheduler (the batch fill is the batch size over it).
+        window (int, optional): The number of most recent queueing delays the percentiles are computed over.
+    """
+    def __init__(self, max_batch_size: int, window: int = 1024):
+        self.max_batch_size = max_batch_size
+        self.n_batches = 0
+        self.n_requests = 0
+        self.n_errors = 0
+        self.batch_sizes = Counter()
+        self._queue_delays = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, batch_size: int, queue_delays: List[float], error: bool = False) -> None:
+        """ Records a dispatched batch and the time (in seconds) each of its requests waited in the queue """
+        with self._lock:
+            self.n_batches += 1
+            self.n_requests += batch_size
+            self.n_errors += int(error)
+            self.batch_sizes[batch_size] += 1
+            self._queue_delays.extend(queue_delays)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ Returns the metrics as a dictionary (queueing delays in milliseconds) """
+        with self._lock:
+            delays_ms = np.array(self._queue_delays) * 1000
+            mean_batch_size = self.n_requests / self.n_batches if self.n_batches else 0.0
+            return dict(
+                batches=self.n_batches,
+                requests=self.n_requests,
+                errors=self.n_errors,
+                mean_batch_size=mean_batch_size,
+                mean_batch_fill=mean_batch_size / self.max_batch_size,
+                batch_size_counts=dict(sorted(self.batch_sizes.items())),
+                queue_delay_ms=dict(
+                    mean=float(delays_ms.mean()) if len(delays_ms) else 0.0,
+                    p50=float(np.percentile(delays_ms, 50)) if len(delays_ms) else 0.0,
+                    p95=float(np.percentile(delays_ms, 95)) if len(delays_ms) else 0.0,
+                    max=float(delays_ms.max()) if len(delays_ms) else 0.0,
+                ),
+            )
+
+
+class MicroBatchScheduler:
+    """ Collects concurrent queries into batches and dispatches each batch as one call of a batched function
+
+    A dispatch thread waits for the first query, then keeps collecting queries until the batch holds `max_batch_size`
+    of them or `max_wait_ms` have passed since the first one arrived, and calls `batch_fn` with the whole batch. Each
+    result is routed back to the caller of the matching query. At most `max_in_flight` batches run at once (one per
+    model replica, i.e. per cluster of the pool behind `batch_fn`) and the next batch fills up while they all run.
+    A batch whose call raises anything (even a `KeyboardInterrupt` from the remote client) fails its queries only.
+
+    Usage:
+        scheduler = MicroBatchScheduler(remote_generate)   # remote_generate(List[query]) -> List[response]
+        response = scheduler(query)                        # synchronous callers (blocks until the batch returns)
+        response = await scheduler.asubmit(query)          # coroutines
+
+    Args:
+        batch_fn (Callable[[List[Any]], List[Any]]): The batched function (one result per query, in order).
+        max_batch_size (int, optional): The maximum number of queries per batch.
+        max_wait_ms (float, optional): The maximum time a batch waits for more queries after its first one.
+        max_in_flight (int, optional): The maximum number of batches dispatched at once.
+    """
+    def __init__(
+            self,
+            batch_fn: Callable[[List[Any]], List[Any]],
+            max_batch_size: int = BATCH_MAX_SIZE,
+            max_wait_ms: float = BATCH_MAX_WAIT_MS,
+            max_in_flight: int = 1,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}")
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_in_flight = max_in_flight
+        self.metrics = BatchMetrics(max_batch_size)
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, query: Any) -> Future:
+        """ Queues a query and returns a future of its result """
+        future = Future()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="micro-batch-dispatch")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batch-scheduler", daemon=True)
+                self._thread.start()
+            self._queue.put((query, future, time.perf_counter()))
+        return future
+
+    def __call__(self, query: Any, timeout: Optional[float] = None) -> Any:
+        """ Queues a query and blocks until its result is available """
+        return self.submit(query).result(timeout=timeout)
+
+    async def asubmit(self, query: Any) -> Any:
+        """ Queues a query and waits (without blocking the event loop) for its result """
+        return await asyncio.wrap_future(self.submit(query))
+
+    def close(self) -> None:
+        """ Stops the dispatch thread once the queued queries are dispatched (and waits for the running batches) """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(_STOP)
+                self._thread.join()
+            self._thread = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _collect(self, first: Tuple[Any, Future, float]) -> Tuple[List[Tuple[Any, Future, float]], bool]:
+        """ Collects a batch starting with `first` (returns the batch and whether the scheduler was stopped) """
+        batch, deadline = [first], time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        executor, stopped = self._executor, False
+        while not stopped:
+            # Wait for a free slot first, so the queries keep queuing (and fill the next batch) while all slots run
+            self._slots.acquire()
+            batch = []
+            try:
+                item = self._queue.get()
+                if item is _STOP:
+                    self._slots.release()
+                    return
+                batch, stopped = self._collect(item)
+                executor.submit(self._dispatch, batch)
+            except BaseException as e:
+                # Don't leave the collected and queued queries hanging (the next `submit` starts a new thread)
+                self._slots.release()
+                self._fail([*batch, *self._drain()], e)
+                raise
+
+    def _drain(self) -> List[Tuple[Any, Future, float]]:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(item)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[Any, Future, float]], error: BaseException) -> None:
+        for _, future, _ in batch:
+            if not future.done() and future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _dispatch(self, batch: List[Tuple[Any, Future, float]]) -> None:
+        try:
+            self._call_batch_fn(batch)
+        finally:
+            self._slots.release()
+
+    def _call_batch_fn(self, batch: List[Tuple[Any, Future, float]]) -> None:
+        # Skip the queries whose callers gave up while they were queued
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        dispatched_at = time.perf_counter()
+        queue_delays = [dispatched_at - enqueued_at for _, _, enqueued_at in batch]
+        try:
+            results = list(self.batch_fn([query for query, _, _ in batch]))
+            if len(results) != len(batch):
+                raise ValueError(f"The batched function returned {len(results)} results for {len(batch)} queries")
+        except BaseException as e:
+            # Not just `Exception`: a `KeyboardInterrupt`/`SystemExit` of the remote client would leave the batch's
+            # futures pending forever
+            self.metrics.record(len(batch), queue_delays, error=True)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.metrics.record(len(batch), queue_delays)
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,292 @@
+import time
+import random
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import requests
+
+from src.config.settings import (
+    RH_HEALTH_CHECK_INTERVAL,
+    RH_MAX_RETRIES,
+    RH_MAX_FAILURES,
+    RH_INITIAL_BACKOFF,
+    RH_MAX_BACKOFF,
+)
+
+# A registered function: the function and the environment it is sent with
+_FunctionSpec = Tuple[Callable, Optional[Tuple[str, ...]]]
+
+# The errors of a remote call that mean the cluster (not the function) failed: connection, transport and timeout
+# errors. Anything else was raised by the function itself (i.e. for a bad input) and is re-raised as is
+TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class NoHealthyClusterError(RuntimeError):
+    """ Raised when every cluster of a pool is down """
+
+
+def _connect_cluster(spec: Dict[str, Any]) -> Any:
+    import runhouse as rh
+    return rh.cluster(**spec)
+
+
+def _send_function(fn: Callable, cluster: Any, env: Optional[Sequence[str]]) -> Callable:
+    import runhouse as rh
+    return rh.function(fn).to(cluster, env=list(env) if env else None)
+
+
+def _check_cluster(cluster: Any) -> bool:
+    return bool(cluster.is_up())
+
+
+def _restart_cluster(cluster: Any) -> None:
+    cluster.restart_server()
+
+
+def _function_key(fn: Callable, env: Optional[Sequence[str]]) -> str:
+    return f"{fn.__module__}.{fn.__qualname__}:{','.join(env or ())}"
+
+
+class ClusterNode:
+    """ The state of one cluster of a `ClusterPool` (its connection, warm function handles and load)
+
+    The load and health fields are guarded by the pool's lock, the connection and function handles by the node's own
+    `lock` (held while connecting and sending functions, so slow clusters never block the rest of the pool).
+    """
+    def __init__(self, name: str, spec: Dict[str, Any]):
+        self.name = name
+        self.spec = spec
+        self.cluster = None
+        self.healthy = True
+        self.in_flight = 0
+        self.n_calls = 0
+        self.n_failures = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.functions: Dict[str, Callable] = {}
+        self.lock = threading.Lock()
+
+    def describe(self) -> Dict[str, Any]:
+        return dict(
+            name=self.name,
+            healthy=self.healthy,
+            in_flight=self.in_flight,
+            calls=self.n_calls,
+            failures=self.n_failures,
+            last_error=self.last_error,
+            functions=sorted(self.functions.copy()),
+        )
+
+
+class ClusterPool:
+    """ Routes remote function calls over several Runhouse clusters
+
+    Every call goes to the healthy cluster with the fewest calls in flight. A failed call is retried on another
+    cluster when there is one (with jittered exponential backoff between attempts), and a cluster is taken out of
+    rotation after `max_failures` consecutive failures. A background thread health-checks every cluster every
+    `health_check_interval` seconds: clusters that are down get their server restarted, clusters that are back up
+    rejoin the rotation, and the registered functions are (re)sent to them so their handles are warm before the
+    next call.
+
+    Only cluster failures (errors connecting to a cluster or sending it a function, and the `retry_on` errors of a
+    call) are retried and counted against a cluster. Other errors are raised by the function itself (i.e. for a bad
+    input), so they are re-raised right away and the cluster stays in rotation.
+
+    Usage:
+        pool = ClusterPool([dict(name="a100-1", ips=[...], ssh_creds={...}), dict(name="a100-2", ...)])
+        remote_query = pool.function(query_model, env=["openai"])
+        response = remote_query(messages)
+
+    The cluster, function and health check operations are arguments so the pool can run without Runhouse (i.e. in
+    tests with local stand-ins, see `remote_ingest.LocalFunction`).
+
+    Args:
+        cluster_specs (List[Dict[str, Any]]): The `rh.cluster` kwargs of every cluster.
+        connect_fn (Callable, optional): Returns the cluster of a spec. Defaults to `rh.cluster(**spec)`.
+        send_fn (Callable, optional): Returns the handle of a function on a cluster. Defaults to `rh.function(...).to`.
+        health_fn (Callable, optional): Returns whether a cluster is up. Defaults to `cluster.is_up()`.
+        restart_fn (Callable, optional): Restarts the server of a cluster (None disables restarts).
+        health_check_interval (float, optional): The seconds between health checks (0 disables the background checks).
+        max_retries (int, optional): The number of times a failed call is retried.
+        max_failures (int, optional): The consecutive failures after which a cluster is taken out of rotation.
+        initial_backoff (float, optional): The seconds to wait before the first retry (doubled for every retry).
+        max_backoff (float, optional): The maximum seconds to wait between retries.
+        retry_on (Tuple[Type[BaseException], ...], optional): The errors of a call that are cluster failures.
+    """
+    def __init__(
+            self,
+            cluster_specs: List[Dict[str, Any]],
+            connect_fn: Callable[[Dict[str, Any]], Any] = _connect_cluster,
+            send_fn: Callable[[Callable, Any, Optional[Sequence[str]]], Callable] = _send_function,
+            health_fn: Callable[[Any], bool] = _check_cluster,
+            restart_fn: Optional[Callable[[Any], None]] = _restart_cluster,
+            health_check_interval: float = RH_HEALTH_CHECK_INTERVAL,
+            max_retries: int = RH_MAX_RETRIES,
+            max_failures: int = RH_MAX_FAILURES,
+            initial_backoff: float = RH_INITIAL_BACKOFF,
+            max_backoff: float = RH_MAX_BACKOFF,
+            retry_on: Tuple[Type[BaseException], ...] = TRANSIENT_ERRORS,
+    ):
+        if not cluster_specs:
+            raise ValueError("A cluster pool needs at least one cluster spec")
+        self.nodes = [ClusterNode(spec.get("name") or f"cluster-{i}", spec) for i, spec in enumerate(cluster_specs)]
+        self.connect_fn = connect_fn
+        self.send_fn = send_fn
+        self.health_fn = health_fn
+        self.restart_fn = restart_fn
+        self.health_check_interval = health_check_interval
+        self.max_retries = max_retries
+        self.max_failures = max(1, max_failures)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        self._registered: Dict[str, _FunctionSpec] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    def function(self, fn: Callable, env: Optional[Sequence[str]] = None) -> Callable:
+        """ Registers a function (sent to every cluster) and returns a callable that routes its calls over the pool """
+        key = _function_key(fn, env)
+        with self._lock:
+            self._registered[key] = (fn, tuple(env) if env else None)
+        self.start()
+
+        def _call(*args: Any, **kwargs: Any) -> Any:
+            return self.call(fn, *args, env=env, **kwargs)
+        _call.__name__ = getattr(fn, "__name__", "remote_function")
+        return _call
+
+    def call(self, fn: Callable, *args: Any, env: Optional[Sequence[str]] = None, **kwargs: Any) -> Any:
+        """ Calls a function on the least loaded healthy cluster, retrying cluster failures (on another cluster if any)
+
+        Raises:
+            NoHealthyClusterError: If every cluster is down.
+        """
+        key, tried, last_error = _function_key(fn, env), set(), None
+        for attempt in range(self.max_retries + 1):
+            try:
+                node = self._acquire(tried)
+            except NoHealthyClusterError as e:
+                raise e from last_error
+            handle = None
+            try:
+                handle = self._get_handle(node, key, fn, env)
+                result = handle(*args, **kwargs)
+            except Exception as e:
+                # Errors connecting to the cluster or sending it the function are cluster failures, errors raised by
+                # the call that are not `retry_on` errors come from the function itself (i.e. a bad input)
+                if handle is not None and not isinstance(e, self.retry_on):
+                    self._release(node)
+                    raise
+                self._release(node, error=e)
+                tried.add(node.name)
+                last_error = e
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(self.max_backoff, self.initial_backoff * 2 ** attempt) * (1 + random.random()))
+            else:
+                self._release(node)
+                return result
+
+    def _acquire(self, tried: set) -> ClusterNode:
+        # Prefer the clusters that haven't failed this call yet (fail over), then the least loaded one
+        with self._lock:
+            healthy = [node for node in self.nodes if node.healthy]
+            if not healthy:
+                raise NoHealthyClusterError(f"None of the {len(self.nodes)} clusters of the pool is healthy")
+            node = min(healthy, key=lambda n: (n.name in tried, n.in_flight, n.n_calls))
+            node.in_flight += 1
+            node.n_calls += 1
+            return node
+
+    def _release(self, node: ClusterNode, error: Optional[Exception] = None) -> None:
+        with self._lock:
+            node.in_flight -= 1
+            if error is None:
+                node.consecutive_failures = 0
+                return
+            node.n_failures += 1
+            node.consecutive_failures += 1
+            node.last_error = f"{type(error).__name__}: {error}"
+            taken_out = node.consecutive_failures >= self.max_failures
+            if taken_out:
+                node.healthy = False
+        if taken_out:
+            with node.lock:
+                node.functions.clear()
+
+    def _get_handle(self, node: ClusterNode, key: str, fn: Callable, env: Optional[Sequence[str]]) -> Callable:
+        # Warm handles are returned without waiting on the node's lock (i.e. behind a health check), missing ones are
+        # looked up again and installed under it so concurrent first calls connect and send the function once
+        handle = node.functions.get(key)
+        if handle is not None:
+            return handle
+        with node.lock:
+            handle = node.functions.get(key)
+            if handle is None:
+                if node.cluster is None:
+                    node.cluster = self.connect_fn(node.spec)
+                handle = node.functions[key] = self.send_fn(fn, node.cluster, env)
+            return handle
+
+    def check_health(self) -> None:
+        """ Health-checks every cluster (restarting the ones that are down) and warms the registered functions """
+        for node in self.nodes:
+            try:
+                # Under the node's lock so no handle is installed while the cluster restarts
+                with node.lock:
+                    if node.cluster is None:
+                        node.cluster = self.connect_fn(node.spec)
+                    # Clusters taken out of rotation by failed calls get their server restarted even if the box is up
+                    healthy = self.health_fn(node.cluster) and node.healthy
+                    if not healthy and self.restart_fn is not None:
+                        self.restart_fn(node.cluster)
+                        node.functions.clear()
+                        healthy = self.health_fn(node.cluster)
+                if healthy:
+                    with self._lock:
+                        registered = list(self._registered.items())
+                    for key, (fn, env) in registered:
+                        self._get_handle(node, key, fn, env)
+            except Exception as e:
+                healthy = False
+                node.last_error = f"{type(e).__name__}: {e}"
+
+            with self._lock:
+                if healthy and not node.healthy:
+                    node.consecutive_failures = 0
+                node.healthy = healthy
+            if not healthy:
+                with node.lock:
+                    node.functions.clear()
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_check_interval):
+            self.check_health()
+
+    def start(self) -> None:
+        """ Starts the background health checks (if they are enabled and not running yet) """
+        with self._lock:
+            if self.health_check_interval <= 0 or (self._health_thread and self._health_thread.is_alive()):
+                return
+            self._stop.clear()
+            self._health_thread = threading.Thread(target=self._health_loop, name="cluster-pool-health", daemon=True)
+            self._health_thread.start()
+
+    def close(self) -> None:
+        """ Stops the background health checks """
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """ Returns the state of every cluster (health, load, calls, failures and warm functions) """
+        with self._lock:
+            return [node.describe() for node in self.nodes]
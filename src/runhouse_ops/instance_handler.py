@@ -1,6 +1,13 @@
-from src.model_manager.model_loader import get_openai_chat_model
-from src.auth import dotenv_auth
-import runhouse as rh
+import json
+from functools import lru_cache
+
+from src.model_manager.client_registry import get_openai_client, load_credentials
+from src.model_manager.concurrency import get_llm_limiter
+from src.model_manager.hf_backend import HuggingFaceLocalLLM
+from src.runhouse_ops.batching import MicroBatchScheduler
+from src.runhouse_ops.remote_ingest import LocalFunction, ingest_files
+from src.runhouse_ops.cluster_pool import ClusterPool
+from src.config.settings import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, RH_CLUSTER_SPECS
 import streamlit as st
 
 def get_paperspace_kwargs():
@@ -14,6 +21,7 @@ def get_paperspace_kwargs():
 
 @st.cache_resource
 def init_rh(kwarg_overrides=None, restart_server=False):
+    import runhouse as rh
     byos_model_kwargs = get_paperspace_kwargs()
 
     # Step 3 - Create RH gpu and function for model query
@@ -24,10 +32,91 @@ def init_rh(kwarg_overrides=None, restart_server=False):
     return gpu
 
 
+@lru_cache(maxsize=None)
+def _get_cluster_pool(cluster_specs_json):
+    return ClusterPool(json.loads(cluster_specs_json))
+
+
+def get_cluster_pool(cluster_specs=None):
+    """ Returns the pool of Runhouse clusters that remote functions are routed over (see `ClusterPool`).
+
+    There is one pool per process and set of clusters, so every remote function (i.e. ingestion and batched
+    queries) shares its load balancing, health checks and warm connections.
+
+    Args:
+        cluster_specs (list of dicts, optional): The `rh.cluster` kwargs of every cluster. Defaults to
+            `RH_CLUSTER_SPECS` (or the paperspace box of `get_paperspace_kwargs` if it is empty).
+
+    Returns:
+        ClusterPool: The pool (health-checked in the background).
+    """
+    cluster_specs = list(cluster_specs or RH_CLUSTER_SPECS or [get_paperspace_kwargs()])
+    return _get_cluster_pool(json.dumps(cluster_specs, sort_keys=True))
+
+
+def get_pooled_fn(fn, env_vars=None):
+    """ Returns `fn` on the cluster pool (calls go to the least loaded healthy cluster and fail over on errors) """
+    return get_cluster_pool().function(fn, env=env_vars)
+
+
 @st.cache_resource
 def get_rh_query_fn(_query_fn, _rh_gpu, env_vars=None):
+    import runhouse as rh
     return rh.function(_query_fn).to(_rh_gpu, env=env_vars)
 
+
+@st.cache_resource
+def get_rh_batch_scheduler(
+        _batch_generate_fn, _rh_gpu, env_vars=None, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS
+):
+    """ Returns a micro-batching scheduler in front of a batched generate function sent to the Runhouse cluster.
+
+    Concurrent `query_model(..., model_type="self_hosted")` calls sharing the scheduler are dispatched to the cluster
+    as one batched call (see `src.runhouse_ops.batching.MicroBatchScheduler`).
+
+    Args:
+        _batch_generate_fn (callable): Takes a list of queries and returns one response per query (in order).
+        _rh_gpu (rh.Cluster): The cluster to run the function on (see `init_rh`), None for the cluster pool.
+        env_vars (list, optional): The environment of the remote function. Defaults to None.
+        max_batch_size (int, optional): The maximum number of queries per remote call.
+        max_wait_ms (float, optional): The maximum time a batch waits for more queries after its first one.
+
+    Returns:
+        MicroBatchScheduler: The scheduler (its `metrics` report the batch fill and queueing delay).
+    """
+    # Not `get_rh_query_fn`: its cache ignores the function, so it would hand back another function on the cluster
+    # One batch in flight per cluster, so every cluster of the pool serves batches
+    if _rh_gpu is None:
+        remote_fn = get_pooled_fn(_batch_generate_fn, env_vars=env_vars)
+        max_in_flight = len(get_cluster_pool().nodes)
+    else:
+        import runhouse as rh
+        remote_fn = rh.function(_batch_generate_fn).to(_rh_gpu, env=env_vars)
+        max_in_flight = 1
+    return MicroBatchScheduler(
+        remote_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_in_flight=max_in_flight
+    )
+
+
+@st.cache_resource
+def get_ingest_fn(mode="runhouse", env_vars=None):
+    """ Returns the ingestion function for `remote_ingest.embed_files_remote`.
+
+    Args:
+        mode (str, optional): 'runhouse' (on the cluster pool, see `get_cluster_pool`) or 'local' (a `LocalFunction`
+                              stand-in running in a local worker process). Defaults to "runhouse".
+        env_vars (list, optional): The environment of the remote function. Defaults to None.
+
+    Returns:
+        Callable: The ingestion function.
+    """
+    if mode == "runhouse":
+        return get_pooled_fn(ingest_files, env_vars=env_vars)
+    elif mode == "local":
+        return LocalFunction(ingest_files)
+    raise ValueError(f"Invalid ingestion mode: {mode}")
+
+
 def query_model(query, model_type="openai", model_kwargs=None, **kwargs):
     """ Queries the model for a response.
 
@@ -35,23 +124,71 @@ def query_model(query, model_type="openai", model_kwargs=None, **kwargs):
         query (list of Messages): The query to send to the model.
         model_type (str, optional): The type of model to use. Defaults to "openai".
         model_kwargs (dict, optional): Additional kwargs to pass to the model. Defaults to None.
+            For "self_hosted" models it holds the 'scheduler' (see `get_rh_batch_scheduler`).
+            For "hf" models it holds the `HuggingFaceLocalLLM` fields (i.e. model_name, device, max_new_tokens).
+            For "openai" models it holds the `get_openai_client` kwargs and the per-request 'callbacks'.
         **kwargs: Additional kwargs to pass to the model.
 
     Returns:
         Response from model based on query, model kwargs and model details
     """
-    dotenv_auth()
+    load_credentials()
 
     # ['hf', 'openai', 'anthropic', 'ai21', 'other']
     model_kwargs = {} if model_kwargs is None else model_kwargs
     model, response = None, None
     if model_type == "openai":
-        model = get_openai_chat_model(**model_kwargs)
-        response = model(query)
+        callbacks = model_kwargs.get("callbacks")
+        client_kwargs = {k: v for k, v in model_kwargs.items() if k != "callbacks"}
+        model = get_openai_client(**{"streaming": bool(callbacks), **client_kwargs})
+        with get_llm_limiter():
+            response = model(query, callbacks=callbacks)
+    elif model_type == "self_hosted":
+        response = model_kwargs["scheduler"](query)
     elif model_type == "hf":
-        raise NotImplementedError
+        model = HuggingFaceLocalLLM(**model_kwargs)
+        with get_llm_limiter():
+            response = model.predict_messages(query)
     elif model_type == "anthropic":
         raise NotImplementedError
     elif model_type == "ai21":
         raise NotImplementedError
     return response
+
+
+async def aquery_model(query, model_type="openai", model_kwargs=None, **kwargs):
+    """ The async version of `query_model` (the call doesn't block a thread while waiting for the model).
+
+    The calls share the process-wide limiter of in-flight LLM calls with `query_model`.
+
+    Args:
+        query (list of Messages): The query to send to the model.
+        model_type (str, optional): The type of model to use. Defaults to "openai".
+        model_kwargs (dict, optional): Additional kwargs to pass to the model. Defaults to None.
+            For "self_hosted" models it holds the 'scheduler' (see `get_rh_batch_scheduler`).
+            For "hf" models it holds the `HuggingFaceLocalLLM` fields (i.e. model_name, device, max_new_tokens).
+            For "openai" models it holds the `get_openai_client` kwargs and the per-request 'callbacks'.
+        **kwargs: Additional kwargs to pass to the model.
+
+    Returns:
+        Response from model based on query, model kwargs and model details
+    """
+    load_credentials()
+
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    model, response = None, None
+    if model_type == "openai":
+        callbacks = model_kwargs.get("callbacks")
+        client_kwargs = {k: v for k, v in model_kwargs.items() if k != "callbacks"}
+        model = get_openai_client(**{"streaming": bool(callbacks), **client_kwargs})
+        async with get_llm_limiter():
+            response = await model.apredict_messages(query, callbacks=callbacks)
+    elif model_type == "self_hosted":
+        response = await model_kwargs["scheduler"].asubmit(query)
+    elif model_type == "hf":
+        model = HuggingFaceLocalLLM(**model_kwargs)
+        async with get_llm_limiter():
+            response = await model.apredict_messages(query)
+    elif model_type in ("anthropic", "ai21"):
+        raise NotImplementedError
+    return response
@@ -0,0 +1,199 @@
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import FAISS
+
+from src.config.settings import INDEX_DIR, CHUNK_SIZE, CHUNK_TOKENIZER
+from src.data_manager.chunking import resolve_tokenizer
+from src.data_manager.data_loader import parse_documents, texts_to_docs, embed_chunks
+from src.data_manager.embedding_cache import get_embedding_model_name
+from src.data_manager.embedding_pipeline import get_embedding_model
+from src.data_manager.index_factory import build_vectorstore
+from src.data_manager.index_store import document_fingerprint, save_vectorstore
+from src.data_manager.lexical_index import BM25Index
+
+# Bumped whenever the layout of the serialized index changes
+INDEX_FORMAT_VERSION = 1
+
+
+def serialize_index(
+        docs: List[Document],
+        vectors: List[List[float]],
+        embedding_model: str,
+        fingerprint: Optional[str] = None,
+) -> Dict[str, Any]:
+    """ Packs chunks and their vectors into a compact, picklable index (the vectors as raw float32 bytes)
+
+    Args:
+        docs (List[Document]): The chunks.
+        vectors (List[List[float]]): One embedding vector per chunk.
+        embedding_model (str): The name of the embedding model (see `get_embedding_model_name`).
+        fingerprint (str, optional): The fingerprint of the documents (see `document_fingerprint`).
+
+    Returns:
+        Dict[str, Any]: The serialized index (see `deserialize_index`).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(docs), -1)
+    return dict(
+        version=INDEX_FORMAT_VERSION,
+        embedding_model=embedding_model,
+        fingerprint=fingerprint,
+        dim=vectors.shape[1],
+        vectors=vectors.tobytes(),
+        chunks=dict(text=[doc.page_content for doc in docs], metadata=[doc.metadata for doc in docs]),
+    )
+
+
+def deserialize_index(payload: Dict[str, Any], embeddings: Embeddings, index_spec: str = "auto") -> FAISS:
+    """ Builds a FAISS vectorstore (with its BM25 index) from a serialized index
+
+    Args:
+        payload (Dict[str, Any]): The serialized index (see `serialize_index`).
+        embeddings (Embeddings): The embedding model used to embed queries (the model the index was built with).
+        index_spec (str, optional): A FAISS index factory string or 'auto' (see `build_vectorstore`).
+
+    Raises:
+        ValueError: If the index has another format version or was built with another embedding model.
+
+    Returns:
+        FAISS: The vectorstore.
+    """
+    if payload["version"] != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version: {payload['version']}")
+    if payload["embedding_model"] != get_embedding_model_name(embeddings):
+        raise ValueError(
+            f"The index was embedded with {payload['embedding_model']}, not {get_embedding_model_name(embeddings)}"
+        )
+
+    chunks = payload["chunks"]
+    docs = [Document(page_content=text, metadata=meta) for text, meta in zip(chunks["text"], chunks["metadata"])]
+    vectors = np.frombuffer(payload["vectors"], dtype=np.float32).reshape(len(docs), payload["dim"])
+    vectorstore = build_vectorstore(docs, vectors, embeddings, index_spec=index_spec)
+    vectorstore.lexical_index = BM25Index.from_documents(docs)
+    vectorstore.fingerprint = payload["fingerprint"]
+    return vectorstore
+
+
+def ingest_files(
+        files: List[Tuple[bytes, str]],
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+        embedding_backend: str = "openai",
+        openai_api_key: Optional[str] = None,
+        index_spec: str = "auto",
+) -> Dict[str, Any]:
+    """ Parses, chunks and embeds files into a serialized index (the function sent to the Runhouse cluster)
+
+    The chunks are the ones `embed_texts` builds for the same files and settings, and the fingerprint matches the one
+    it persists them under.
+
+    Args:
+        files (List[Tuple[bytes, str]]): The contents and names of the files (pdf, docx or txt).
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (see `src.data_manager.chunking`).
+        embedding_backend (str, optional): The embedding backend (see `get_embedding_model`).
+        openai_api_key (str, optional): The OpenAI API key (only used by the 'openai' backend).
+        index_spec (str, optional): The FAISS index spec the caller builds (part of the fingerprint).
+
+    Returns:
+        Dict[str, Any]: The serialized index (see `serialize_index`).
+    """
+    doc_texts = parse_documents([(BytesIO(data), name) for data, name in files])
+    chunk_settings = dict(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=resolve_tokenizer(tokenizer))
+    embeddings = get_embedding_model(embedding_backend, openai_api_key=openai_api_key)
+    embedding_model = get_embedding_model_name(embeddings)
+    fingerprint = document_fingerprint(doc_texts, dict(chunk_settings, index_spec=index_spec), embedding_model)
+
+    docs = texts_to_docs(doc_texts, **chunk_settings)
+    vectors = embed_chunks([doc.page_content for doc in docs], embeddings, chunk_settings=chunk_settings)
+    return serialize_index(docs, vectors, embedding_model, fingerprint)
+
+
+class LocalFunction:
+    """ A local stand-in for a function on a Runhouse cluster (i.e. for tests or without a cluster)
+
+    Calls run in a worker process, so the arguments and the result are serialized like for a remote call. The workers
+    are spawned rather than forked (forking the threaded Streamlit server can deadlock the child) and are shut down by
+    `close` (or when the function is used as a context manager or garbage collected).
+
+    Args:
+        fn (Callable): The function (must be importable by the worker process).
+        max_workers (int, optional): The number of worker processes.
+    """
+    def __init__(self, fn: Callable, max_workers: int = 1):
+        self.fn = fn
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self._executor.submit(self.fn, *args, **kwargs).result()
+
+    def close(self) -> None:
+        """ Shuts the worker processes down (pending calls are cancelled) """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self) -> "LocalFunction":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if hasattr(self, "_executor"):
+            self.close()
+
+
+def embed_files_remote(
+        files: List[Tuple[bytes, str]],
+        ingest_fn: Callable[..., Dict[str, Any]],
+        openai_api_key: Optional[str] = None,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = 0,
+        tokenizer: Optional[str] = CHUNK_TOKENIZER,
+        embedding_backend: str = "openai",
+        index_spec: str = "auto",
+        persist: bool = True,
+        index_dir: str = INDEX_DIR,
+) -> FAISS:
+    """ Embeds files into a single shared vectorstore with the parsing and embedding offloaded to `ingest_fn`
+
+    Only the file contents are sent and only the chunk table and the vectors come back, the FAISS index is built
+    locally. The vectorstore is persisted like in `embed_texts`, so later sessions load it from the index directory.
+
+    Args:
+        files (List[Tuple[bytes, str]]): The contents and names of the files (pdf, docx or txt).
+        ingest_fn (Callable): `ingest_files` on the clusters (see `get_ingest_fn`) or a `LocalFunction` of it.
+        openai_api_key (str, optional): The OpenAI API key (sent to the cluster for the 'openai' backend).
+        chunk_size (int, optional): The size of each chunk (in tokens, or characters if `tokenizer` is None).
+        chunk_overlap (int, optional): The number of tokens (or characters) to overlap between chunks.
+        tokenizer (str, optional): The tokenizer chunk sizes are counted in (see `src.data_manager.chunking`).
+        embedding_backend (str, optional): The embedding backend (see `get_embedding_model`).
+        index_spec (str, optional): A FAISS index factory string or 'auto' (see `build_vectorstore`).
+        persist (bool, optional): Whether to save the vectorstore to the index directory.
+        index_dir (str, optional): The root directory of the persisted vectorstores.
+
+    Returns:
+        FAISS: The vectorstore (with a BM25 index over its chunks as `lexical_index`).
+    """
+    payload = ingest_fn(
+        files,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        tokenizer=tokenizer,
+        embedding_backend=embedding_backend,
+        openai_api_key=openai_api_key,
+        index_spec=index_spec,
+    )
+    embeddings = get_embedding_model(embedding_backend, openai_api_key=openai_api_key)
+    vectorstore = deserialize_index(payload, embeddings, index_spec=index_spec)
+    if persist and vectorstore.fingerprint is not None:
+        save_vectorstore(vectorstore, vectorstore.fingerprint, index_dir=index_dir)
+    return vectorstore
@@ -0,0 +1,255 @@
+"""
+The headless HTTP (ASGI) service for document ingest, retrieval and question answering.
+
+Run it with any ASGI server, i.e.:
+    uvicorn src.server.app:app --host 0.0.0.0 --port 8000
+
+Set `SERVER_LLM_BACKEND=fake` and `SERVER_EMBEDDING_BACKEND=fake` to run it without OpenAI (i.e. for tests).
+
+Endpoints:
+    GET    /health                        --> liveness check
+    GET    /metrics                       --> the stage metrics (Prometheus text, or JSON lines with ?format=jsonl)
+    POST   /indexes                       --> ingest documents given as text ({"documents": {name: text}})
+    POST   /indexes/upload                --> ingest uploaded pdf, docx or txt files (multipart form)
+    GET    /indexes                       --> list the registered indexes
+    DELETE /indexes/{index_id}            --> drop an index from the registry
+    POST   /indexes/{index_id}/search     --> retrieve the sources for a query
+    POST   /indexes/{index_id}/query      --> answer a query (as server-sent events if "stream" is true)
+
+The streamed events are 'token' (the next chunk of the answer), 'citation' (a source cited for the first time, sent
+as soon as its citation is complete), 'answer' (the parsed answer), 'error' and 'done'.
+"""
+
+import io
+import sys
+import json
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Union
+
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+# LANGCHAIN
+from langchain.docstore.document import Document
+from langchain.vectorstores.faiss import FAISS
+
+from src.config.settings import CHUNK_SIZE, SERVER_LLM_BACKEND, SERVER_EMBEDDING_BACKEND
+from src.data_manager.data_loader import parse_documents, embed_texts, search_docs
+from src.data_manager.chunking import count_tokens
+from src.data_manager.context_packing import get_context_budget, pack_sources
+from src.data_manager.output_parsing import StreamingCitationParser, split_raw_llm_response
+from src.model_manager.client_registry import close_aiohttp_session, load_credentials, use_pooled_aiohttp_session
+from src.model_manager.model_ecosystem import aget_llm_response, get_llm
+from src.model_manager.streaming import FirstTokenTimer, QueueSink
+from src.monitoring.metrics import get_metrics_registry, trace_stage
+from src.prompts import IR_PROMPTS
+from src.server.registry import get_index_registry
+
+
+class IngestRequest(BaseModel):
+    documents: Dict[str, str]
+    chunk_size: int = CHUNK_SIZE
+    chunk_overlap: int = 0
+
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = 5
+    mode: str = "vector"
+
+
+class QueryRequest(SearchRequest):
+    model_name: str = "gpt-3.5-turbo-0613"
+    temperature: float = 0.0
+    chain_type: str = "stuff"
+    stream: bool = False
+
+
+def _serialize_doc(doc: Document) -> Dict[str, Any]:
+    return dict(content=doc.page_content, metadata=doc.metadata)
+
+
+def _citation_events(events: List[Dict[str, Any]]) -> List[str]:
+    return [
+        _sse("citation", dict(source=e["source"], inline=e["inline"], document=_serialize_doc(e["document"])))
+        for e in events
+    ]
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _get_vectorstore(index_id: str) -> FAISS:
+    vectorstore = get_index_registry().get(index_id)
+    if vectorstore is None:
+        raise HTTPException(status_code=404, detail=f"Unknown index: {index_id}")
+    return vectorstore
+
+
+def _search(vectorstore: FAISS, request: SearchRequest) -> List[Document]:
+    try:
+        with trace_stage("get_sources_for_context", search_mode=request.mode) as span:
+            sources = search_docs(vectorstore, request.query, top_k=request.top_k, mode=request.mode)
+            span.record(sources=len(sources))
+        return sources
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _ingest(doc_texts: Dict[str, Union[str, List[str]]], chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+    with trace_stage("embed_document"):
+        vectorstore = embed_texts(
+            doc_texts,
+            openai_api_key=load_credentials(),
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            embedding_backend=SERVER_EMBEDDING_BACKEND,
+        )
+    index_id = getattr(vectorstore, "fingerprint", None) or uuid.uuid4().hex
+    return get_index_registry().put(index_id, vectorstore, list(doc_texts))
+
+
+def _format_answer(output_text: str, sources: List[Document], report: Dict[str, Any]) -> Dict[str, Any]:
+    answer, referenced_sources = split_raw_llm_response(output_text, sources, return_llm_response=True)
+    return dict(
+        answer=answer.strip(),
+        raw_output=output_text,
+        referenced_sources=[doc.metadata["source"] for doc in referenced_sources],
+        sources=[_serialize_doc(doc) for doc in sources],
+        context_packing=report,
+    )
+
+
+async def _aanswer(llm: Any, sources: List[Document], query: str, hyperparameters: Dict[str, Any]) -> Dict[str, Any]:
+    # The OpenAI requests of the query reuse the pooled connections of the server's event loop
+    use_pooled_aiohttp_session()
+    labels = dict(model_name=hyperparameters["model_name"], chain_type=hyperparameters["chain_type"])
+    with trace_stage("query_llm", **labels) as span:
+        response = await aget_llm_response(llm, sources, query, hyperparameters)
+        span.record(sources=len(sources), output_tokens=count_tokens(response["output_text"]))
+    return response
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    await close_aiohttp_session()
+
+
+def create_app() -> FastAPI:
+    """ Creates the ASGI application """
+    load_credentials()
+    app = FastAPI(
+        title="BoilerLLM", description="Document ingest, retrieval and question answering", lifespan=_lifespan
+    )
+
+    @app.get("/health")
+    def health() -> Dict[str, str]:
+        return {"status": "ok"}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics(format: str = "prometheus") -> str:
+        registry = get_metrics_registry()
+        if format == "jsonl":
+            return registry.to_jsonl()
+        if format != "prometheus":
+            raise HTTPException(status_code=400, detail=f"Invalid metrics format: {format}")
+        return registry.to_prometheus()
+
+    # Ingest, listing and search are blocking (parsing, embedding, FAISS) so they are plain functions that FastAPI runs
+    # in its thread pool, keeping the event loop free for the (async) query endpoint
+    @app.post("/indexes")
+    def ingest(request: IngestRequest) -> Dict[str, Any]:
+        if not request.documents:
+            raise HTTPException(status_code=400, detail="No documents to ingest")
+        return _ingest(request.documents, request.chunk_size, request.chunk_overlap)
+
+    @app.post("/indexes/upload")
+    def ingest_upload(
+            files: List[UploadFile] = File(...), chunk_size: int = CHUNK_SIZE, chunk_overlap: int = 0
+    ) -> Dict[str, Any]:
+        try:
+            doc_texts = parse_documents([(io.BytesIO(file.file.read()), file.filename) for file in files])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return _ingest(doc_texts, chunk_size, chunk_overlap)
+
+    @app.get("/indexes")
+    def list_indexes() -> List[Dict[str, Any]]:
+        return get_index_registry().list()
+
+    @app.delete("/indexes/{index_id}")
+    def delete_index(index_id: str) -> Dict[str, Any]:
+        if not get_index_registry().remove(index_id):
+            raise HTTPException(status_code=404, detail=f"Unknown index: {index_id}")
+        return {"index_id": index_id, "deleted": True}
+
+    @app.post("/indexes/{index_id}/search")
+    def search(index_id: str, request: SearchRequest) -> Dict[str, Any]:
+        sources = _search(_get_vectorstore(index_id), request)
+        return {"sources": [_serialize_doc(doc) for doc in sources]}
+
+    @app.post("/indexes/{index_id}/query")
+    async def query(index_id: str, request: QueryRequest):
+        if request.chain_type not in IR_PROMPTS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid chain type: {request.chain_type} (expected one of {', '.join(IR_PROMPTS)})",
+            )
+        vectorstore = _get_vectorstore(index_id)
+        sources = await asyncio.get_running_loop().run_in_executor(None, _search, vectorstore, request)
+
+        # Pack the sources into the model's context budget (the map chains only drop near-duplicates)
+        if request.chain_type == "stuff":
+            token_budget = get_context_budget(request.model_name, IR_PROMPTS["stuff"].template)
+        else:
+            token_budget = sys.maxsize
+        sources, report = pack_sources(sources, token_budget)
+
+        hyperparameters = dict(
+            model_name=request.model_name,
+            model_temperature=request.temperature,
+            top_k_sources=request.top_k,
+            chain_type=request.chain_type,
+        )
+        if not request.stream:
+            llm = get_llm(SERVER_LLM_BACKEND, model_name=request.model_name, temperature=request.temperature)
+            response = await _aanswer(llm, sources, request.query, hyperparameters)
+            return _format_answer(response["output_text"], sources, report)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        llm = get_llm(
+            SERVER_LLM_BACKEND, model_name=request.model_name, temperature=request.temperature,
+            callbacks=[QueueSink(queue), FirstTokenTimer(model_name=request.model_name)]
+        )
+
+        async def event_stream() -> AsyncIterator[str]:
+            citation_parser = StreamingCitationParser(sources)
+            task = asyncio.ensure_future(_aanswer(llm, sources, request.query, hyperparameters))
+            while not (task.done() and queue.empty()):
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait([getter, task], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield _sse("token", getter.result())
+                    for citation_event in _citation_events(citation_parser.feed(getter.result())):
+                        yield citation_event
+                else:
+                    getter.cancel()
+            for citation_event in _citation_events(citation_parser.close()):
+                yield citation_event
+            try:
+                yield _sse("answer", _format_answer(task.result()["output_text"], sources, report))
+            except Exception as e:
+                yield _sse("error", {"detail": str(e)})
+            yield _sse("done", {})
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+app = create_app()
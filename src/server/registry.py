@@ -0,0 +1,70 @@
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# LANGCHAIN
+from langchain.vectorstores.faiss import FAISS
+
+from src.config.settings import SERVER_MAX_INDEXES
+
+
+class IndexRegistry:
+    """ The process-wide registry of the vectorstores served by the HTTP server
+
+    Vectorstores are registered under an index id (the document fingerprint when there is one, so ingesting the same
+    documents twice returns the same index) and the least recently used ones are dropped once the registry holds more
+    than `max_indexes` (persisted vectorstores are reloaded from the index store on the next ingest).
+
+    Args:
+        max_indexes (int, optional): The maximum number of vectorstores kept in memory.
+    """
+    def __init__(self, max_indexes: int = SERVER_MAX_INDEXES):
+        self.max_indexes = max_indexes
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, index_id: str, vectorstore: FAISS, documents: List[str]) -> Dict[str, Any]:
+        """ Registers a vectorstore and returns its description """
+        entry = dict(vectorstore=vectorstore, documents=documents, created_at=time.time())
+        with self._lock:
+            self._entries[index_id] = entry
+            self._entries.move_to_end(index_id)
+            while len(self._entries) > self.max_indexes:
+                self._entries.popitem(last=False)
+        return self.describe(index_id, entry)
+
+    def get(self, index_id: str) -> Optional[FAISS]:
+        """ Returns the vectorstore registered under an index id (None if there is none) """
+        with self._lock:
+            entry = self._entries.get(index_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(index_id)
+            return entry["vectorstore"]
+
+    def remove(self, index_id: str) -> bool:
+        """ Removes a vectorstore from the registry (returns whether it was registered) """
+        with self._lock:
+            return self._entries.pop(index_id, None) is not None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """ Returns the descriptions of every registered vectorstore """
+        with self._lock:
+            return [self.describe(index_id, entry) for index_id, entry in self._entries.items()]
+
+    @staticmethod
+    def describe(index_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
+            index_id=index_id,
+            documents=entry["documents"],
+            n_chunks=len(entry["vectorstore"].index_to_docstore_id),
+            created_at=entry["created_at"],
+        )
+
+
+@lru_cache(maxsize=None)
+def get_index_registry() -> IndexRegistry:
+    """ Returns the process-wide index registry """
+    return IndexRegistry()
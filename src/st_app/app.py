@@ -43,16 +43,20 @@ def render_event_loop():
     # Enter backend event loop (wrap as a single fn?) - the underlying steps here are cached (data)
     ############################################################################################################
     #   [INPUT]
-    #       1. An uploaded file (streamlit object... essentially bytes and some metadata)
+    #       1. One or more uploaded files (streamlit objects... essentially bytes and some metadata)
     #
     #   [OUTPUT]
-    #       1. The entirety of the document text as a single string
-    #       2. A vector store to be used for indexing in the future (contains the chunked document text embeddings)
+    #       1. A dict mapping each file name to the document text (a string or a list of page strings)
+    #       2. A single vector store shared by all the files (contains the chunked document text embeddings)
     ############################################################################################################
-    if st.session_state["uploaded_file"] is not None and event_loop.check_auth():
-        _file = st.session_state["uploaded_file"]
-        document_text = event_loop.parse_upload(_file)
-        vectorstore = event_loop.embed_document(document_text)
+    if st.session_state["uploaded_file"] and event_loop.check_auth():
+        _files = st.session_state["uploaded_file"]
+        if st.session_state.get("ingest_fn"):
+            # Parse and embed on the ingestion cluster (only the vectors and chunks come back)
+            vectorstore = event_loop.ingest_uploads(_files)
+        else:
+            document_texts = event_loop.parse_uploads(_files)
+            vectorstore = event_loop.embed_documents(document_texts)
 
     ############################################################################################################
     # Create the query textbox widget that will capture the user input
@@ -81,12 +85,6 @@ def render_event_loop():
     if st.session_state.get("submit_state") and event_loop.submit_check():
         event_loop.create_ui_columns()
 
-        sources = event_loop.get_sources_for_context(
-            _vs=st.session_state.get("vectorstore"),
-            query_text=st.session_state.get("query_text"),
-            top_k=st.session_state.get("top_k_sources")
-        )
-
         llm = event_loop.create_llm(
             st.session_state.get("model_name"),
             st.session_state.get("OPENAI_API_KEY"),
@@ -105,15 +103,30 @@ def render_event_loop():
             OPENAI_API_KEY=st.session_state.get("OPENAI_API_KEY"),
             model_temperature=st.session_state.get("model_temperature"),
             top_k_sources=st.session_state.get("top_k_sources"),
+            chain_type=st.session_state.get("chain_type") or "stuff",
         )
 
-        raw_llm_response = event_loop.query_llm(
-            llm, sources, st.session_state.get("query_text"), hyperparameters
+        # retrieve the sources and query the llm (paraphrases of an already answered question reuse its answer)
+        raw_llm_response, sources, from_answer_cache = event_loop.answer_query(
+            llm,
+            st.session_state.get("vectorstore"),
+            st.session_state.get("query_text"),
+            hyperparameters,
+            search_mode=st.session_state.get("search_mode") or "vector"
         )
         llm_response, referenced_sources = event_loop.process_raw_llm_response(raw_llm_response, sources)
 
         event_loop.render_sources(sources if st.session_state.get("show_all_chunks") else referenced_sources)
         event_loop.render_llm_response(llm_response)
+        if from_answer_cache:
+            st.caption("Answered from the cache of previously asked (similar) questions")
+        elif st.session_state.get("context_packing_report", {}).get("dropped"):
+            packing_report = st.session_state["context_packing_report"]
+            dropped = ", ".join(f"{source['source']} ({source['reason']})" for source in packing_report["dropped"])
+            st.caption(
+                f"Left out of the context: {dropped}. "
+                f"{packing_report['tokens_used']}/{packing_report['token_budget']} context tokens used"
+            )
 
 
     # self.submit()
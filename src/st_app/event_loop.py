@@ -10,6 +10,8 @@ Generally the code in the event loop does 1 of 3 things:
 """
 
 import os
+import sys
+import hashlib
 import streamlit as st
 from src.st_app.widgets import (
     file_upload_widget,
@@ -33,17 +35,54 @@ from src.model_manager.model_ecosystem import (
     get_openai_model,
     get_llm_response
 )
+from src.model_manager.answer_cache import (
+    answer_with_cache,
+)
+from src.model_manager.client_registry import (
+    with_callbacks,
+)
+from src.model_manager.streaming import (
+    CitationHandler,
+    FirstTokenTimer,
+)
 
 from src.st_app.widgets import (
     file_upload_widget,
 )
 from src.data_manager.data_loader import (
     parse_document,
+    parse_documents,
     embed_text,
-    search_docs
+    embed_texts,
+    search_docs,
+    unique_document_names
 )
 from src.data_manager.output_parsing import (
     split_raw_llm_response,
+    StreamingCitationParser,
+)
+from src.data_manager.chunking import (
+    count_tokens,
+)
+from src.data_manager.context_packing import (
+    get_context_budget,
+    pack_sources
+)
+from src.prompts import IR_PROMPTS
+from src.config.settings import REMOTE_INGEST
+from src.runhouse_ops.remote_ingest import (
+    embed_files_remote,
+)
+from src.data_manager.stage_cache import (
+    cached_stage,
+    get_stage_cache,
+    get_vectorstore_key,
+    make_stage_key,
+    MISSING
+)
+from src.monitoring.metrics import (
+    get_metrics_registry,
+    trace_stage,
 )
 def init_st_state():
     """ Initializes the streamlit app
@@ -65,6 +104,12 @@ def init_st_state():
     ]:
         update_stss(stss_key, None)
     update_stss("query_fn", get_llm_response)
+    if REMOTE_INGEST != "off":
+        # Imported here so the app runs without runhouse installed when ingestion is not offloaded
+        from src.runhouse_ops.instance_handler import get_ingest_fn
+        update_stss("ingest_fn", get_ingest_fn(REMOTE_INGEST))
+    else:
+        update_stss("ingest_fn", None)
     update_stss("model_name", "gpt-3.5-turbo-0613")
     update_stss("state_initialized", True)
 
@@ -86,7 +131,16 @@ def file_upload(**file_upload_widget_kwargs):
     file_upload_widget(**file_upload_widget_kwargs)
 
 
-@st.cache_data()
+def _upload_key(file):
+    """ The stage cache key of an uploaded file (its name and a hash of its contents) """
+    return make_stage_key("parse_upload", name=file.name, content=hashlib.sha256(file.getvalue()).hexdigest())
+
+
+def _n_characters(document_text):
+    """ The number of characters of a parsed document (a str or a list of page strs) """
+    return len(document_text) if isinstance(document_text, str) else sum(len(page) for page in document_text)
+
+
 def parse_upload(file):
     """ Parses the uploaded file into a str """
 
@@ -95,11 +149,37 @@ def parse_upload(file):
     #  - If the file is a docx, use `docx2txt.process` to extract the text
     #  - If the file is a txt, use built-ins and `re` to extract the text
     #  - If the file is not one of the above, raise a `ValueError`
-    document_text = parse_document(f_bytes=file, f_name=file.name)
+    #  - The parsed text is cached by file content (shared with the other app processes, see `stage_cache`)
+    with trace_stage("parse_upload") as span:
+        document_text = cached_stage(_upload_key(file), lambda: parse_document(f_bytes=file, f_name=file.name))
+        span.record(files=1, characters=_n_characters(document_text))
     update_stss("document_text", document_text)
     return document_text
 
 
+def parse_uploads(files):
+    """ Parses several uploaded files (concurrently) into a dict mapping file name to parsed text
+
+    Only files that are not already in the stage cache are parsed. Files with the same name are suffixed with `#2`,
+    `#3`, etc. (see `unique_document_names`).
+    """
+    cache, registry = get_stage_cache(), get_metrics_registry()
+    with trace_stage("parse_upload") as span:
+        names = unique_document_names(file.name for file in files)
+        keys = {name: _upload_key(file) for name, file in zip(names, files)}
+        document_texts = {name: cache.get(keys[name]) for name in names}
+        missing = [(file, name) for name, file in zip(names, files) if document_texts[name] is MISSING]
+        for text in document_texts.values():
+            result = "miss" if text is MISSING else "hit"
+            registry.inc("stage_cache_requests_total", stage="parse_upload", result=result)
+        for name, text in parse_documents(missing).items() if missing else ():
+            cache.set(keys[name], text)
+            document_texts[name] = text
+        span.record(files=len(files), parsed_files=len(missing))
+    update_stss("document_text", document_texts)
+    return document_texts
+
+
 def check_auth(api_key="OPENAI_API_KEY"):
     """ Before moving forward we need to check auth """
     if st.session_state.get(api_key):
@@ -114,10 +194,44 @@ def check_auth(api_key="OPENAI_API_KEY"):
 
 
 # TODO: Add a decorator for st that catches relevant errors and displays them?
-@st.cache_data()
+# The vectorstores are persisted by document fingerprint (see `index_store`), which is what other processes share, so
+# the streamlit cache only has to hold on to the loaded vectorstore (as a resource, instead of pickling it every rerun)
+@st.cache_resource()
 def embed_document(document_text):
     """ If the file is successfully parsed, embed the text into a vector index """
-    vectorstore = embed_text(document_text, openai_api_key=st.session_state["OPENAI_API_KEY"])
+    with trace_stage("embed_document"):
+        vectorstore = embed_text(document_text, openai_api_key=st.session_state["OPENAI_API_KEY"])
+    update_stss("vectorstore", vectorstore)
+    return vectorstore
+
+
+@st.cache_resource()
+def embed_documents(document_texts):
+    """ If the files are successfully parsed, embed all of them into a single shared vector index """
+    with trace_stage("embed_document"):
+        vectorstore = embed_texts(document_texts, openai_api_key=st.session_state["OPENAI_API_KEY"])
+    update_stss("vectorstore", vectorstore)
+    return vectorstore
+
+
+@st.cache_resource()
+def _ingest_uploads(_files, upload_keys):
+    return embed_files_remote(
+        [(file.getvalue(), file.name) for file in _files],
+        st.session_state["ingest_fn"],
+        openai_api_key=st.session_state["OPENAI_API_KEY"],
+    )
+
+
+def ingest_uploads(files):
+    """ Parses and embeds the uploaded files on the ingestion cluster into a single shared vector index
+
+    Used instead of `parse_uploads` and `embed_documents` when an ingestion function is configured (see
+    `REMOTE_INGEST`), the vectorstore is cached by the contents of the files.
+    """
+    with trace_stage("embed_document", remote=True) as span:
+        vectorstore = _ingest_uploads(files, tuple(_upload_key(file) for file in files))
+        span.record(files=len(files))
     update_stss("vectorstore", vectorstore)
     return vectorstore
 
@@ -158,13 +272,15 @@ def submit_check():
         return True
 
 
-def update_ui_column(column_name, response_box=False, **kwargs):
+def update_ui_column(column_name, response_box=False, sources_box=False, **kwargs):
     """ Updates the ui split column with the UI elements """
     column_state_container = st.session_state.get(column_name)
     with column_state_container:
         st.markdown(f"#### {column_name}")
         if response_box:
             empty_widget("response_box", **kwargs)
+        if sources_box:
+            empty_widget("sources_box", **kwargs)
 
 
 def create_ui_columns(left_column_name="LLM Response",
@@ -173,13 +289,25 @@ def create_ui_columns(left_column_name="LLM Response",
     column_names = [left_column_name, right_column_name]
     column_widget(column_names=column_names, n_columns=len(column_names), **window_column_widget_kwargs)
     update_ui_column(left_column_name, response_box=True)
-    update_ui_column(right_column_name, response_box=False)
+    update_ui_column(right_column_name, response_box=False, sources_box=True)
     return column_names
 
 
-@st.cache_data()
-def get_sources_for_context(_vs, query_text, top_k=5, **kwargs):
-    sources = search_docs(vectorstore=_vs, query=query_text, top_k=top_k)
+def get_sources_for_context(_vs, query_text, top_k=5, search_mode="vector", **kwargs):
+    """ Retrieves the sources for the query (cached by document fingerprint, query and retrieval parameters)
+
+    Vectorstores without a fingerprint (i.e. built from a stream of pages) are not cached as they can't be identified
+    across processes.
+    """
+    vs_key = get_vectorstore_key(_vs)
+    key = None if vs_key is None else make_stage_key(
+        "get_sources_for_context", vectorstore=vs_key, query_text=query_text, top_k=top_k, search_mode=search_mode
+    )
+    with trace_stage("get_sources_for_context", search_mode=search_mode) as span:
+        sources = cached_stage(
+            key, lambda: search_docs(vectorstore=_vs, query=query_text, top_k=top_k, mode=search_mode)
+        )
+        span.record(sources=len(sources))
     return sources
 
 
@@ -195,14 +323,82 @@ def create_llm(model_name, openai_api_key, model_temperature=0.0, use_streaming=
     return llm
 
 
-@st.cache_data()
 def query_llm(_llm, _sources, query_text, hyperparameters):
-    """ Gets the LLM response for the query """
-    llm_response = st.session_state.get("query_fn")(_llm, _sources, query_text, hyperparameters)["output_text"]
+    """ Gets the LLM response for the query (cached by the sources, query and model parameters)
+
+    The call is traced as the 'query_llm' stage with the number of output tokens, and the time to first token of
+    streaming models is recorded by a `FirstTokenTimer`.
+    """
+    query_fn = st.session_state.get("query_fn")
+    key = make_stage_key(
+        "query_llm",
+        query_fn=getattr(query_fn, "__name__", str(query_fn)),
+        sources=[(source.metadata.get("source"), source.page_content) for source in _sources],
+        query_text=query_text,
+        hyperparameters={k: v for k, v in hyperparameters.items() if k != "OPENAI_API_KEY"},
+    )
+    model_name = hyperparameters.get("model_name")
+    if getattr(_llm, "streaming", False):
+        _llm = with_callbacks(_llm, [*(_llm.callbacks or []), FirstTokenTimer(model_name=model_name)])
+    with trace_stage("query_llm", model_name=model_name, chain_type=hyperparameters.get("chain_type", "stuff")) as span:
+        llm_response = cached_stage(
+            key, lambda: query_fn(_llm, _sources, query_text, hyperparameters)["output_text"]
+        )
+        span.record(sources=len(_sources), output_tokens=count_tokens(llm_response))
     update_stss("raw_llm_response_text", llm_response)
     return llm_response
 
 
+def pack_context(sources, model_name, chain_type="stuff"):
+    """ Packs the retrieved sources into the model's context budget (dropping near-duplicates and overflow)
+
+    The map chains send every source in a separate call, so they only drop the near-duplicates. The packing report
+    (budget, tokens used, kept and dropped sources) is stored in the session state.
+    """
+    if chain_type == "stuff":
+        token_budget = get_context_budget(model_name, IR_PROMPTS[chain_type].template)
+    else:
+        token_budget = sys.maxsize
+    packed_sources, packing_report = pack_sources(sources, token_budget)
+    update_stss("context_packing_report", packing_report)
+    return packed_sources
+
+
+def stream_citations(_llm, sources):
+    """ Renders the sources the answer cites as soon as they are cited while the answer streams
+
+    Returns a copy of the (streaming) model with a citation handler, or the model itself if it doesn't stream or every
+    retrieved chunk is shown anyway.
+    """
+    if not getattr(_llm, "streaming", False) or st.session_state.get("show_all_chunks"):
+        return _llm
+    parser = StreamingCitationParser(sources)
+    citation_handler = CitationHandler(parser, on_citation=lambda event: render_sources(parser.referenced_sources))
+    return with_callbacks(_llm, [*(_llm.callbacks or []), citation_handler])
+
+
+def answer_query(_llm, _vs, query_text, hyperparameters, search_mode="vector"):
+    """ Gets the (packed) sources and LLM response for the query, reusing the answer to a near-duplicate question
+
+    Returns the raw LLM response, the sources it was generated from and whether it came from the answer cache.
+    """
+    raw_llm_response, sources, hit = answer_with_cache(
+        _vs,
+        query_text,
+        retrieve_fn=lambda: pack_context(
+            get_sources_for_context(
+                _vs, query_text, top_k=hyperparameters.get("top_k_sources"), search_mode=search_mode
+            ),
+            hyperparameters.get("model_name"),
+            hyperparameters.get("chain_type", "stuff"),
+        ),
+        answer_fn=lambda sources: query_llm(stream_citations(_llm, sources), sources, query_text, hyperparameters),
+        params=dict(hyperparameters, search_mode=search_mode, OPENAI_API_KEY=None),
+    )
+    get_metrics_registry().inc("stage_cache_requests_total", stage="answer_cache", result="hit" if hit else "miss")
+    return raw_llm_response, sources, hit
+
+
 @st.cache_data()
 def process_raw_llm_response(raw_llm_response, _sources):
     llm_response, referenced_sources = split_raw_llm_response(
@@ -213,10 +409,10 @@ def process_raw_llm_response(raw_llm_response, _sources):
     return llm_response, referenced_sources
 
 
-def render_sources(sources, source_state_var="Sources"):
-    """ Renders the LLM response in the UI """
+def render_sources(sources, source_state_var="sources_box"):
+    """ Renders the sources in the UI (replacing the sources rendered so far, i.e. while the answer streams) """
 
-    with st.session_state.get(source_state_var):
+    with trace_stage("render", target="sources"), st.session_state.get(source_state_var).container():
         for source in sources:
             with st.expander(source.metadata["source"]):
                 st.markdown(source.page_content, unsafe_allow_html=True)
@@ -226,7 +422,7 @@ def render_sources(sources, source_state_var="Sources"):
 def render_llm_response(llm_response, llm_response_box_state_var="response_box"):
     """ Renders the LLM response in the UI """
 
-    with st.session_state.get(llm_response_box_state_var):
+    with trace_stage("render", target="llm_response"), st.session_state.get(llm_response_box_state_var):
         st.markdown(llm_response, unsafe_allow_html=True)
 
 
@@ -1,5 +1,6 @@
 import streamlit as st
 from typing import List
+from src.data_manager.output_parsing import wrap_text_in_html
 from src.st_app.state_utils import (
     update_stss,
     reset_submit_state
@@ -8,8 +9,8 @@ from src.st_app.state_utils import (
 
 def file_upload_widget(
         default_label: str = "Upload a pdf, docx, or txt file", supported_file_types=None,
-        help_text: str = "Scanned documents and multiple files are not supported yet!",
-        state_var_name="uploaded_file", **kwargs
+        help_text: str = "Scanned documents are not supported yet!",
+        state_var_name="uploaded_file", accept_multiple_files=True, **kwargs
 ):
     """ Uploads a file and parses it into a list of Documents.
 
@@ -18,13 +19,14 @@ def file_upload_widget(
         supported_file_types (List[str], optional): The list of supported file types
             - pdf, docx, txt
         help_text (str, optional): The help text to display below the file upload widget
+        accept_multiple_files (bool, optional): Whether several files can be uploaded (and indexed together)
 
     Returns:
         None; Updates the session state with the uploaded file.
 
     Streamlit State Updates:
         st.session_state['uploaded_file']
-            --> contains the uploaded file (SomeUploadedFiles)
+            --> contains the uploaded file(s) (SomeUploadedFiles - a list if `accept_multiple_files` is True)
     """
 
     # Enable uploading a file from the list of supported file types (not scanned documents)
@@ -33,7 +35,7 @@ def file_upload_widget(
         supported_file_types = ["pdf", "docx", "txt"]
 
     upload_file_widget_state = st.file_uploader(default_label, type=supported_file_types,
-                                                accept_multiple_files=False, help=help_text)
+                                                accept_multiple_files=accept_multiple_files, help=help_text)
 
     # Update the state variables
     update_stss(state_var_name, upload_file_widget_state)
@@ -60,6 +62,11 @@ def slider_widget(label, min_value, max_value, value, step, state_var_name, **kw
 #             )
 
 
+def selectbox_widget(label, options, state_var_name, index=0, **kwargs):
+    selectbox_widget_state = st.selectbox(label, options, index=index, **kwargs)
+    update_stss(state_var_name, selectbox_widget_state)
+
+
 def model_hyperparameter_settings_columns_widget():
     column_widget(column_names=["Model Temperature", "Top K Sources"], n_columns=2)
     with st.session_state.get("Model Temperature"):
@@ -79,12 +86,28 @@ def advanced_options_widget(label="Advanced Options", **kwargs):
         checkbox_widget("Show all chunks that were injected as context", "show_all_chunks", default_value=False)
         checkbox_widget("Show the entire document after parsing", "show_full_doc", default_value=False)
         checkbox_widget("Stream the model results (Only On Local)", "use_streaming", default_value=False)
+        selectbox_widget(
+            "Retrieval mode", ["hybrid", "vector", "lexical"], "search_mode", on_change=reset_submit_state,
+            help="'hybrid' fuses embedding similarity with keyword (BM25) matches to find exact terms like ids"
+        )
+        selectbox_widget(
+            "QA chain", ["stuff", "map_reduce", "map_rerank"], "chain_type", on_change=reset_submit_state,
+            help="'map_reduce' and 'map_rerank' query the model once per source (concurrently) before answering"
+        )
         model_hyperparameter_settings_columns_widget()
 
 
 def show_full_doc_widget(label="Full Document", full_doc_var_name="document_text", **kwargs):
     with st.expander(label):
-        st.markdown(st.session_state.get(full_doc_var_name, ""), unsafe_allow_html=True)
+        # The parsed document can be a single string, a list of page strings (i.e. for pdfs) or a mapping from
+        # file name to either of those (for multiple uploaded files)
+        document_text = st.session_state.get(full_doc_var_name) or ""
+        if not isinstance(document_text, dict):
+            document_text = {"": document_text}
+        for doc_name, doc_text in document_text.items():
+            if doc_name:
+                st.markdown(f"##### {doc_name}")
+            st.markdown(wrap_text_in_html(doc_text), unsafe_allow_html=True)
 
 
 def textbox_widget(label, state_var_name, default_value="", return_container=False, **kwargs):
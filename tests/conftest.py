@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# The settings are read from the environment on import: keep the caches and indexes of the tests out of ~/.cache and
+# run the server without OpenAI
+_CACHE_ROOT = tempfile.mkdtemp(prefix="boilerllm-tests-")
+for _name in ("EMBEDDING_CACHE_DIR", "INDEX_DIR", "STAGE_CACHE_DIR"):
+    os.environ.setdefault(_name, os.path.join(_CACHE_ROOT, _name.lower()))
+os.environ.setdefault("SERVER_LLM_BACKEND", "fake")
+os.environ.setdefault("SERVER_EMBEDDING_BACKEND", "fake")
@@ -0,0 +1,71 @@
+import re
+import random
+
+import pytest
+
+from src.data_manager import chunking
+from src.data_manager.chunking import get_token_spans, split_text_by_tokens
+
+# GPT-2 style pre-tokenization (tokens carry their leading space), like the BPE tokenizers of tiktoken
+_BPE_TOKEN_RE = re.compile(r"""'s|'t|'re|'ve|'m|'ll|'d| ?\w+| ?[^\s\w]+|\s+(?!\S)|\s+""")
+
+
+def _bpe_token_offsets(text):
+    return [match.start() for match in _BPE_TOKEN_RE.finditer(text)]
+
+
+def _make_text(n_words, seed=0):
+    rng = random.Random(seed)
+    words = [rng.choice(["alpha", "beta", "gamma", "delta", "epsilon"]) for _ in range(n_words)]
+    for i in range(0, n_words, 97):
+        words[i] += rng.choice([".", ",", "!", "?", "\n", "\n\n"])
+    return " ".join(words)
+
+
+@pytest.fixture
+def bpe_tokenizer(monkeypatch):
+    monkeypatch.setattr(chunking, "get_tokenizer", lambda name="cl100k_base": _bpe_token_offsets)
+
+
+@pytest.mark.parametrize("chunk_size", [8, 25, 100])
+def test_spans_round_trip_with_bpe_tokens(bpe_tokenizer, chunk_size):
+    text = _make_text(3000)
+    spans = get_token_spans(text, chunk_size)
+    assert "".join(text[start:end] for start, end, _ in spans) == text
+    assert all(n_tokens <= chunk_size for _, _, n_tokens in spans)
+    assert sum(n_tokens for _, _, n_tokens in spans) == len(_bpe_token_offsets(text))
+
+
+def test_chunks_keep_every_word(bpe_tokenizer):
+    text = _make_text(3000, seed=1)
+    chunks = split_text_by_tokens(text, 50)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_spans_round_trip_with_approx_tokens():
+    text = _make_text(1000, seed=2)
+    spans = get_token_spans(text, 30, tokenizer="approx")
+    assert "".join(text[start:end] for start, end, _ in spans) == text
+
+
+def test_overlapping_spans_stay_within_chunk_size(bpe_tokenizer):
+    text = _make_text(500, seed=3)
+    spans = get_token_spans(text, 40, chunk_overlap=10)
+    assert all(n_tokens <= 40 for _, _, n_tokens in spans)
+    assert spans[-1][1] == len(text)
+
+
+def test_resolve_tokenizer_names_the_tokenizer_used():
+    assert chunking.resolve_tokenizer("approx") == "approx"
+    assert chunking.resolve_tokenizer(None) is None
+    assert chunking.resolve_tokenizer("") is None
+
+
+def test_empty_tokenizer_chunks_by_characters():
+    from src.data_manager.data_loader import embed_text
+
+    text = _make_text(1000, seed=4)
+    vectorstore = embed_text(text, None, chunk_size=200, tokenizer="", embedding_backend="fake", persist=False,
+                             use_cache=False)
+    chunks = [doc.page_content for doc in vectorstore.docstore._dict.values()]
+    assert chunks and all(len(chunk) <= 200 for chunk in chunks)
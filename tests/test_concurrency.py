@@ -0,0 +1,190 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from src.model_manager.concurrency import ConcurrencyLimiter, run_async
+
+
+class _Tracker:
+    """ Records the number of holders of a limiter at any time """
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def exit(self):
+        with self._lock:
+            self.current -= 1
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_invalid_max_concurrency():
+    with pytest.raises(ValueError):
+        ConcurrencyLimiter(0)
+
+
+def test_caps_in_flight_sync_callers():
+    limiter, tracker = ConcurrencyLimiter(3), _Tracker()
+
+    def hold():
+        with limiter:
+            tracker.enter()
+            time.sleep(0.01)
+            tracker.exit()
+
+    threads = [threading.Thread(target=hold) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tracker.peak == 3
+    assert limiter.in_flight == 0
+
+
+def test_waiters_are_served_in_fifo_order():
+    limiter, order = ConcurrencyLimiter(1), []
+    limiter.acquire()
+
+    def wait(i):
+        with limiter:
+            order.append(i)
+
+    threads = []
+    for i in range(5):
+        threads.append(threading.Thread(target=wait, args=(i,)))
+        threads[-1].start()
+        # Queue the waiters one by one so their arrival order is known
+        _wait_for(lambda: len(limiter._waiters) == i + 1)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == list(range(5))
+    assert limiter.in_flight == 0
+
+
+def test_async_callers_are_capped_and_served_in_fifo_order():
+    limiter, tracker, order = ConcurrencyLimiter(2), _Tracker(), []
+
+    async def hold(i):
+        async with limiter:
+            tracker.enter()
+            order.append(i)
+            await asyncio.sleep(0.01)
+            tracker.exit()
+
+    async def main():
+        tasks = []
+        for i in range(8):
+            tasks.append(asyncio.ensure_future(hold(i)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert tracker.peak == 2
+    assert order == list(range(8))
+    assert limiter.in_flight == 0
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    limiter = ConcurrencyLimiter(1)
+
+    async def main():
+        limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0)
+        assert len(limiter._waiters) == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert not limiter._waiters
+        limiter.release()
+        assert limiter.in_flight == 0
+        await asyncio.wait_for(limiter.aacquire(), timeout=1)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.in_flight == 0
+
+
+def test_waiter_cancelled_after_the_handover_passes_the_slot_on():
+    limiter = ConcurrencyLimiter(1)
+
+    async def main():
+        limiter.acquire()
+        first = asyncio.ensure_future(limiter.aacquire())
+        second = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0)
+        # The slot is handed to `first`, which is cancelled before it wakes up: it must go to `second`
+        limiter.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, timeout=1)
+        assert limiter.in_flight == 1
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.in_flight == 0
+    assert not limiter._waiters
+
+
+def test_sync_and_async_holders_share_the_cap():
+    limiter, tracker = ConcurrencyLimiter(2), _Tracker()
+
+    def hold_sync():
+        with limiter:
+            tracker.enter()
+            time.sleep(0.01)
+            tracker.exit()
+
+    async def hold_async():
+        async with limiter:
+            tracker.enter()
+            await asyncio.sleep(0.01)
+            tracker.exit()
+
+    async def run_async_holders():
+        await asyncio.gather(*(hold_async() for _ in range(6)))
+
+    threads = [threading.Thread(target=hold_sync) for _ in range(6)]
+    # Two event loops in their own threads, next to the synchronous holders
+    threads += [threading.Thread(target=asyncio.run, args=(run_async_holders(),)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    assert tracker.peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_run_async_with_and_without_a_running_loop():
+    async def answer():
+        await asyncio.sleep(0)
+        return 42
+
+    async def fail():
+        raise KeyError("boom")
+
+    assert run_async(answer()) == 42
+
+    async def main():
+        # Called from a coroutine (the loop of this thread is running), so it runs on a helper thread
+        return run_async(answer())
+
+    assert asyncio.run(main()) == 42
+    with pytest.raises(KeyError):
+        run_async(fail())
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from src.model_manager.hf_backend import stream_until_stop, truncate_at_stop
+
+# A tiny randomly initialized GPT-2 on the hub (see `HF_MODEL_NAME`)
+TINY_MODEL = "sshleifer/tiny-gpt2"
+
+
+def _random_chunks(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, len(text) - 1)))
+    return [text[start:end] for start, end in zip([0, *cuts], [*cuts, len(text)])]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_stream_until_stop_matches_truncation(seed):
+    rng = random.Random(seed)
+    text = "Answer: the cat sat.\nHuman: and then?\nObservation: none"
+    stop = rng.choice([["\nHuman:"], ["Observation"], ["sat", "\nHuman:"], ["never"], []])
+    chunks = _random_chunks(text, rng)
+    streamed = list(stream_until_stop(chunks, stop))
+    assert "".join(streamed) == truncate_at_stop(text, stop)
+    assert all(streamed)
+
+
+def test_stream_until_stop_stops_consuming_at_the_stop_sequence():
+    consumed = []
+
+    def chunks():
+        for chunk in ["Hello", " wor", "ld\nHu", "man:", " more", " text"]:
+            consumed.append(chunk)
+            yield chunk
+
+    assert "".join(stream_until_stop(chunks(), ["\nHuman:"])) == "Hello world"
+    assert consumed[-1] == "man:"
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from src.model_manager.hf_backend import get_hf_model
+    try:
+        get_hf_model(TINY_MODEL, "cpu")
+    except OSError as e:
+        pytest.skip(f"The tiny model can't be loaded: {e}")
+    return TINY_MODEL
+
+
+def test_streamed_completion_is_cut_like_the_generated_one(tiny_model):
+    from src.model_manager.hf_backend import hf_generate, hf_stream
+
+    prompt = "The quick brown fox"
+    full = hf_generate([prompt], model_name=tiny_model, max_new_tokens=24)[0]
+    assert "".join(hf_stream(prompt, model_name=tiny_model, max_new_tokens=24)) == full
+
+    stop = [full[len(full) // 2:len(full) // 2 + 3]]
+    expected = hf_generate([prompt], model_name=tiny_model, max_new_tokens=24, stop=stop)[0]
+    assert expected == truncate_at_stop(full, stop)
+    assert "".join(hf_stream(prompt, model_name=tiny_model, max_new_tokens=24, stop=stop)) == expected
+
+
+def test_llm_streams_tokens_up_to_the_stop_sequence(tiny_model):
+    from langchain.callbacks.base import BaseCallbackHandler
+    from src.model_manager.hf_backend import HuggingFaceLocalLLM
+
+    class _Collect(BaseCallbackHandler):
+        tokens = []
+
+        def on_llm_new_token(self, token, **kwargs):
+            self.tokens.append(token)
+
+    batched = HuggingFaceLocalLLM(model_name=tiny_model, max_new_tokens=24)
+    full = batched("The quick brown fox")
+    stop = [full[len(full) // 2:len(full) // 2 + 3]]
+    handler = _Collect()
+    streaming = HuggingFaceLocalLLM(model_name=tiny_model, max_new_tokens=24, streaming=True, callbacks=[handler])
+    text = streaming("The quick brown fox", stop=stop)
+    assert text == batched("The quick brown fox", stop=stop)
+    assert "".join(handler.tokens) == text
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from langchain.docstore.document import Document
+
+from src.data_manager.output_parsing import StreamingCitationParser, split_raw_llm_response
+
+SOURCES = [Document(page_content=f"chunk {key}", metadata={"source": key}) for key in ["1-0", "1-1", "2-0", "3-4"]]
+
+ANSWERS = [
+    # Inline citations, then the sources section (with a key that is not one of the sources)
+    "Cats purr when content <sup><b>2-0</b></sup>. They sleep a lot <sup><b> 1-1 </b></sup> and sometimes "
+    "<sup><b>2-0</b></sup> again.\nSOURCES: 2-0, 1-1, 9-9",
+    # Only a sources section
+    "The answer is 42.\nSOURCES: 3-4,1-0",
+    # An unknown inline citation and no sources section
+    "Nothing cited here <sup><b>7-7</b></sup>.",
+    # The marker words inside the answer and a source cited only in the section
+    "Some SOURCES were <sup><b>1-0</b></sup> consulted.\nSOURCES: 1-0, 3-4",
+]
+
+
+def _random_chunks(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, min(len(text) - 1, 60))))
+    return [text[start:end] for start, end in zip([0, *cuts], [*cuts, len(text)])]
+
+
+def _stream(chunks):
+    parser = StreamingCitationParser(SOURCES)
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    events += parser.close()
+    return parser, events
+
+
+@pytest.mark.parametrize("answer", ANSWERS)
+@pytest.mark.parametrize("seed", range(25))
+def test_streamed_citations_match_the_parsed_response(answer, seed):
+    parser, events = _stream(_random_chunks(answer, random.Random(seed)))
+    llm_response, referenced_sources = split_raw_llm_response(answer, SOURCES, return_llm_response=True)
+
+    keys = [event["source"] for event in events]
+    assert len(keys) == len(set(keys))
+    assert set(keys) == {doc.metadata["source"] for doc in referenced_sources}
+    assert all(event["document"] is parser.sources_by_key[event["source"]] for event in events)
+    assert parser.answer == llm_response
+    assert parser.referenced_sources == [event["document"] for event in events]
+
+    # The events don't depend on where the tokens were split
+    _, whole_events = _stream([answer])
+    assert events == whole_events
+
+
+def test_inline_citations_are_reported_as_soon_as_they_are_complete():
+    parser = StreamingCitationParser(SOURCES)
+    assert parser.feed("Cats purr <sup><b>2-") == []
+    events = parser.feed("0</b></sup> when")
+    assert [(event["source"], event["inline"]) for event in events] == [("2-0", True)]
+    assert parser.feed(" content.\nSOURCES: 2-0, 1-") == []
+    # The last key of the section is only complete once the completion ends
+    assert parser.feed("1") == []
+    assert [(event["source"], event["inline"]) for event in parser.close()] == [("1-1", False)]
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+from src.server.app import create_app
+
+DOCUMENTS = {
+    "cats.txt": "Cats sleep for most of the day. A cat purrs when it is content.",
+    "dogs.txt": "Dogs are loyal companions. A dog wags its tail when it is happy.",
+}
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(create_app()) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def index_id(client):
+    response = client.post("/indexes", json=dict(documents=DOCUMENTS, chunk_size=16))
+    assert response.status_code == 200
+    return response.json()["index_id"]
+
+
+def test_ingest_registers_the_index(client, index_id):
+    assert index_id in [index["index_id"] for index in client.get("/indexes").json()]
+    # Ingesting the same documents again returns the same index
+    assert client.post("/indexes", json=dict(documents=DOCUMENTS, chunk_size=16)).json()["index_id"] == index_id
+
+
+def test_search_returns_sources(client, index_id):
+    response = client.post(f"/indexes/{index_id}/search", json=dict(query="Why do cats purr?", top_k=2))
+    assert response.status_code == 200
+    sources = response.json()["sources"]
+    assert len(sources) == 2
+    assert all(source["metadata"]["document"] in DOCUMENTS for source in sources)
+
+
+def test_query_cites_a_source(client, index_id):
+    response = client.post(f"/indexes/{index_id}/query", json=dict(query="Why do cats purr?", top_k=2))
+    assert response.status_code == 200
+    answer = response.json()
+    assert answer["answer"].startswith("This is a fake answer")
+    assert answer["referenced_sources"]
+    assert set(answer["referenced_sources"]) <= {source["metadata"]["source"] for source in answer["sources"]}
+
+
+def test_streamed_query_matches_the_answer(client, index_id):
+    request = dict(query="Why do cats purr?", top_k=2)
+    answer = client.post(f"/indexes/{index_id}/query", json=request).json()
+    response = client.post(f"/indexes/{index_id}/query", json=dict(request, stream=True))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = _parse_sse(response.text)
+    names = [name for name, _ in events]
+    assert names[-2:] == ["answer", "done"]
+    assert "token" in names and "error" not in names
+    assert "".join(data for name, data in events if name == "token") == answer["raw_output"]
+    streamed_answer = dict(events)["answer"]
+    assert streamed_answer["referenced_sources"] == answer["referenced_sources"]
+    citations = [data["source"] for name, data in events if name == "citation"]
+    assert citations == answer["referenced_sources"]
+
+
+def test_invalid_requests_are_rejected(client, index_id):
+    assert client.post("/indexes/unknown/search", json=dict(query="cats")).status_code == 404
+    assert client.post(f"/indexes/{index_id}/search", json=dict(query="cats", mode="psychic")).status_code == 400
+    response = client.post(f"/indexes/{index_id}/query", json=dict(query="cats", chain_type="refine_everything"))
+    assert response.status_code == 400
+    assert client.post("/indexes", json=dict(documents={})).status_code == 400
+
+
+def test_metrics_are_exported(client, index_id):
+    assert "stage_duration_seconds" in client.get("/metrics").text
+    assert client.get("/metrics", params=dict(format="xml")).status_code == 400